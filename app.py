@@ -1,59 +1,396 @@
-from flask import Flask, g, render_template_string, request, redirect, url_for, flash, send_file, jsonify, session
+from flask import Flask, Response, abort, g, has_request_context, request, redirect, url_for, flash, send_file, jsonify, session, get_flashed_messages, stream_with_context
 import sqlite3
 import os
-from datetime import datetime, date
+import math
+from datetime import datetime, date, timedelta
 from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.utils import safe_join
 import csv
+import click
 import io
 import zipfile
-from functools import wraps
-
-# Importaciones opcionales con manejo de errores
-try:
-    from reportlab.lib.pagesizes import letter
-    from reportlab.pdfgen import canvas as pdf_canvas
-    REPORTLAB_AVAILABLE = True
-except ImportError:
-    REPORTLAB_AVAILABLE = False
-
-try:
-    import openpyxl
-    from openpyxl.utils import get_column_letter
-    OPENPYXL_AVAILABLE = True
-except ImportError:
-    OPENPYXL_AVAILABLE = False
-
-try:
-    from twilio.rest import Client as TwilioClient
-    TWILIO_AVAILABLE = True
-except ImportError:
-    TWILIO_AVAILABLE = False
+import gzip
+import zlib
+import json
+import glob
+import hashlib
+import hmac
+import uuid
+import socket
+import mimetypes
+import shutil
+import struct
+from functools import wraps, lru_cache
+from types import SimpleNamespace
+import importlib.util
+import threading
+import queue
+import time
+from bisect import bisect_left, insort
+from collections import Counter, OrderedDict, deque, namedtuple
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
 
 # Configuración
-DB_PATH = os.path.join(os.path.dirname(__file__), 'lavanderia.db')
+DB_PATH = os.environ.get('DB_PATH', os.path.join(os.path.dirname(__file__), 'lavanderia.db'))
 app = Flask(__name__)
 app.secret_key = os.environ.get('SECRET_KEY', 'dev-secret-key-12345')
+app.config['DB_PATH'] = DB_PATH
+# Sucursales: BRANCHES="central=/ruta/central.db,norte=/ruta/norte.db", un SQLite
+# por sucursal. Sin BRANCHES hay una sola sucursal ('principal') en DB_PATH.
+app.config['BRANCHES'] = dict(
+    (name.strip(), path.strip()) for name, _, path in
+    (part.partition('=') for part in os.environ.get('BRANCHES', '').split(',') if part.strip()))
+# Réplica de lectura: copia instantánea (API de backup) para reportes y
+# exportaciones. Se usa mientras no tenga más de REPLICA_MAX_AGE segundos.
+app.config['REPLICA_ENABLED'] = os.environ.get('REPLICA_ENABLED', '0') == '1'
+app.config['REPLICA_MAX_AGE'] = int(os.environ.get('REPLICA_MAX_AGE', 300))
+app.config['REPLICA_PAGES_PER_STEP'] = int(os.environ.get('REPLICA_PAGES_PER_STEP', 1000))
+# Tablero en vivo (SSE): cada proceso consulta order_events una vez por intervalo
+app.config['BOARD_POLL_INTERVAL'] = float(os.environ.get('BOARD_POLL_INTERVAL', 0.5))
+app.config['BOARD_HEARTBEAT'] = int(os.environ.get('BOARD_HEARTBEAT', 15))
+app.config['BOARD_QUEUE_SIZE'] = int(os.environ.get('BOARD_QUEUE_SIZE', 100))
+app.config['BOARD_EVENTS_KEEP'] = int(os.environ.get('BOARD_EVENTS_KEEP', 5000))
+# Tareas programadas (se arrancan en create_app). Un intervalo de 0 desactiva la tarea.
+app.config['SCHEDULER_ENABLED'] = os.environ.get('SCHEDULER_ENABLED', '1') == '1'
+app.config['OVERDUE_SWEEP_INTERVAL'] = int(os.environ.get('OVERDUE_SWEEP_INTERVAL', 300))
+app.config['OVERDUE_NOTIFY'] = os.environ.get('OVERDUE_NOTIFY', '0') == '1'
+app.config['NOTIFY_INTERVAL'] = int(os.environ.get('NOTIFY_INTERVAL', 60))
+app.config['NOTIFY_BATCH'] = int(os.environ.get('NOTIFY_BATCH', 20))
+# Claves de idempotencia del formulario de nueva orden: vigencia y purga
+app.config['IDEMPOTENCY_TTL'] = int(os.environ.get('IDEMPOTENCY_TTL', 86400))
+app.config['IDEMPOTENCY_PURGE_INTERVAL'] = int(os.environ.get('IDEMPOTENCY_PURGE_INTERVAL', 3600))
+# Respaldos incrementales: copia base + deltas de páginas cada BACKUP_INTERVAL segundos
+app.config['BACKUP_DIR'] = os.environ.get('BACKUP_DIR', os.path.join(os.path.dirname(DB_PATH), 'backups'))
+app.config['BACKUP_INTERVAL'] = int(os.environ.get('BACKUP_INTERVAL', 900))
+app.config['BACKUP_DELTAS_PER_BASE'] = int(os.environ.get('BACKUP_DELTAS_PER_BASE', 96))
+app.config['BACKUP_KEEP_CHAINS'] = int(os.environ.get('BACKUP_KEEP_CHAINS', 7))
+# Mantenimiento de la base (tareas programadas; 0 desactiva cada una)
+app.config['MAINT_OPTIMIZE_INTERVAL'] = int(os.environ.get('MAINT_OPTIMIZE_INTERVAL', 3600))
+app.config['MAINT_ANALYZE_INTERVAL'] = int(os.environ.get('MAINT_ANALYZE_INTERVAL', 86400))
+app.config['MAINT_ANALYSIS_LIMIT'] = int(os.environ.get('MAINT_ANALYSIS_LIMIT', 1000))
+app.config['MAINT_VACUUM_INTERVAL'] = int(os.environ.get('MAINT_VACUUM_INTERVAL', 300))
+app.config['MAINT_VACUUM_PAGES'] = int(os.environ.get('MAINT_VACUUM_PAGES', 200))
+app.config['MAINT_VACUUM_BUDGET'] = float(os.environ.get('MAINT_VACUUM_BUDGET', 2))
+app.config['MAINT_IDLE_SECONDS'] = int(os.environ.get('MAINT_IDLE_SECONDS', 60))
+app.config['MAINT_CHECK_INTERVAL'] = int(os.environ.get('MAINT_CHECK_INTERVAL', 86400))
+# Registro de cambios para sincronización (/api/changes)
+app.config['CHANGES_API_TOKEN'] = os.environ.get('CHANGES_API_TOKEN')
+app.config['CHANGES_PAGE_SIZE'] = int(os.environ.get('CHANGES_PAGE_SIZE', 1000))
+app.config['CHANGES_MAX_WAIT'] = int(os.environ.get('CHANGES_MAX_WAIT', 25))
+app.config['CHANGES_POLL_INTERVAL'] = float(os.environ.get('CHANGES_POLL_INTERVAL', 0.5))
+app.config['CHANGES_RETENTION_DAYS'] = int(os.environ.get('CHANGES_RETENTION_DAYS', 14))
+app.config['CHANGES_PRUNE_INTERVAL'] = int(os.environ.get('CHANGES_PRUNE_INTERVAL', 3600))
+# Compresión de respuestas (gzip, o brotli si está instalado)
+app.config['COMPRESS_MIN_SIZE'] = int(os.environ.get('COMPRESS_MIN_SIZE', 1024))
+app.config['COMPRESS_MAX_SIZE'] = int(os.environ.get('COMPRESS_MAX_SIZE', 20 * 1024 * 1024))
+app.config['GZIP_LEVEL'] = int(os.environ.get('GZIP_LEVEL', 6))
+app.config['BROTLI_QUALITY'] = int(os.environ.get('BROTLI_QUALITY', 5))
+# Páginas con tablas largas se envían por partes de este tamaño
+app.config['STREAM_CHUNK_SIZE'] = int(os.environ.get('STREAM_CHUNK_SIZE', 16 * 1024))
+# Exportaciones en segundo plano
+app.config['EXPORT_DIR'] = os.environ.get('EXPORT_DIR', os.path.join(os.path.dirname(DB_PATH), 'exports'))
+app.config['EXPORT_WORKERS'] = int(os.environ.get('EXPORT_WORKERS', 2))
+app.config['EXPORT_TTL'] = int(os.environ.get('EXPORT_TTL', 3600))
+app.config['EXPORT_STALE_AFTER'] = int(os.environ.get('EXPORT_STALE_AFTER', 600))
+app.config['FEDERATION_WORKERS'] = int(os.environ.get('FEDERATION_WORKERS', 8))
+# Límites de concurrencia por grupo de rutas pesadas, compartidos entre workers
+app.config['CONCURRENCY_LIMITS'] = {
+    'pdf': int(os.environ.get('LIMIT_PDF', 2)),
+    'export': int(os.environ.get('LIMIT_EXPORT', 2)),
+    'backup': int(os.environ.get('LIMIT_BACKUP', 1)),
+}
+app.config['LIMIT_QUEUE'] = int(os.environ.get('LIMIT_QUEUE', 4))
+app.config['LIMIT_WAIT'] = float(os.environ.get('LIMIT_WAIT', 10))
+app.config['LIMIT_RETRY_AFTER'] = int(os.environ.get('LIMIT_RETRY_AFTER', 15))
+app.config['LIMIT_DIR'] = os.environ.get('LIMIT_DIR', os.path.join(os.path.dirname(DB_PATH), 'locks'))
+# Archivo frío: órdenes entregadas antiguas, adjuntado con ATTACH como 'archive'
+app.config['ARCHIVE_DB_PATH'] = os.environ.get('ARCHIVE_DB_PATH', os.path.splitext(DB_PATH)[0] + '_archivo.db')
+app.config['ARCHIVE_AFTER_DAYS'] = int(os.environ.get('ARCHIVE_AFTER_DAYS', 90))
+app.config['ARCHIVE_BATCH'] = int(os.environ.get('ARCHIVE_BATCH', 500))
+# Auditoría: días en la tabla viva antes de pasar a archivos .jsonl.gz diarios
+app.config['AUDIT_RETENTION_DAYS'] = int(os.environ.get('AUDIT_RETENTION_DAYS', 30))
+app.config['AUDIT_ARCHIVE_DIR'] = os.environ.get('AUDIT_ARCHIVE_DIR', os.path.join(os.path.dirname(DB_PATH), 'audit_archive'))
+app.config['AUDIT_BATCH'] = int(os.environ.get('AUDIT_BATCH', 1000))
+# Contraseñas: método de werkzeug (p. ej. 'scrypt:32768:8:1' o 'pbkdf2:sha256:600000')
+app.config['PASSWORD_HASH_METHOD'] = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt')
+app.config['HASH_WORKERS'] = int(os.environ.get('HASH_WORKERS', 2))
+app.config['HASH_QUEUE'] = int(os.environ.get('HASH_QUEUE', 8))
+app.config['HASH_TIMEOUT'] = float(os.environ.get('HASH_TIMEOUT', 5))
+# Intentos fallidos permitidos por ventana, por usuario y por IP
+app.config['LOGIN_WINDOW'] = int(os.environ.get('LOGIN_WINDOW', 300))
+app.config['LOGIN_MAX_PER_USER'] = int(os.environ.get('LOGIN_MAX_PER_USER', 5))
+app.config['LOGIN_MAX_PER_IP'] = int(os.environ.get('LOGIN_MAX_PER_IP', 20))
+app.config['LOGIN_TRACK_MAX'] = int(os.environ.get('LOGIN_TRACK_MAX', 10000))
+# Consulta pública de estado: caché en memoria y consultas por IP por ventana
+app.config['STATUS_CACHE_TTL'] = int(os.environ.get('STATUS_CACHE_TTL', 60))
+app.config['STATUS_CACHE_SIZE'] = int(os.environ.get('STATUS_CACHE_SIZE', 10000))
+# Búsqueda: segundos que se reutilizan total y facetas de una misma consulta
+app.config['SEARCH_CACHE_TTL'] = int(os.environ.get('SEARCH_CACHE_TTL', 30))
+app.config['STATUS_PHONE_DIGITS'] = int(os.environ.get('STATUS_PHONE_DIGITS', 4))
+app.config['STATUS_RATE_WINDOW'] = int(os.environ.get('STATUS_RATE_WINDOW', 60))
+app.config['STATUS_RATE_MAX'] = int(os.environ.get('STATUS_RATE_MAX', 20))
+# Capacidad de entrega por día (0 = sin límite); días sin entregas: 0=lunes ... 6=domingo
+app.config['DELIVERY_MAX_ORDERS'] = int(os.environ.get('DELIVERY_MAX_ORDERS', 40))
+app.config['DELIVERY_MAX_PIECES'] = int(os.environ.get('DELIVERY_MAX_PIECES', 300))
+app.config['DELIVERY_CATEGORY_PIECES'] = {
+    'cama': int(os.environ.get('DELIVERY_MAX_CAMA', 60)),
+    'ropa_formal': int(os.environ.get('DELIVERY_MAX_FORMAL', 60)),
+}
+app.config['DELIVERY_CLOSED_WEEKDAYS'] = os.environ.get('DELIVERY_CLOSED_WEEKDAYS', '')
+app.config['DELIVERY_HORIZON'] = int(os.environ.get('DELIVERY_HORIZON', 60))
+app.config['DELIVERY_ENFORCE'] = os.environ.get('DELIVERY_ENFORCE', '1') == '1'
+# Capacidad de una carga de lavadora, en kg de ropa seca
+app.config['WASH_LOAD_CAPACITY'] = float(os.environ.get('WASH_LOAD_CAPACITY', 10))
 
 # ---------------------- BASE DE DATOS ----------------------
+def connect_db(path=None):
+    """Abrir una conexión nueva (también fuera de una petición)"""
+    path = path or branch_db_path()
+    db = sqlite3.connect(path, timeout=10)
+    db.row_factory = sqlite3.Row
+    db.execute('PRAGMA busy_timeout = 10000')
+    attach_archive(db, archive_path_for(path))
+    return db
+
 def get_db():
     db = getattr(g, '_database', None)
     if db is None:
-        db = g._database = sqlite3.connect(DB_PATH)
-        db.row_factory = sqlite3.Row
+        db = g._database = connect_db()
+    return db
+
+def get_read_db():
+    """Conexión para lecturas pesadas: la réplica si está al día, si no la principal"""
+    db = getattr(g, '_read_database', None)
+    if db is None:
+        db = connect_read_db(current_branch())
+        if db is None:
+            return get_db()
+        g._read_database = db
     return db
 
 @app.teardown_appcontext
 def close_connection(exception):
-    db = getattr(g, '_database', None)
-    if db is not None:
+    for name in ('_database', '_read_database'):
+        db = getattr(g, name, None)
+        if db is not None:
+            db.close()
+
+# ---------------------- SUCURSALES ----------------------
+DEFAULT_BRANCH = 'principal'
+
+def get_branches():
+    return app.config['BRANCHES'] or {DEFAULT_BRANCH: app.config['DB_PATH']}
+
+def current_branch():
+    branches = get_branches()
+    branch = session.get('branch') if has_request_context() else None
+    return branch if branch in branches else next(iter(branches))
+
+def branch_db_path(branch=None):
+    return get_branches()[branch or current_branch()]
+
+def archive_path_for(db_path):
+    if db_path == app.config['DB_PATH']:
+        return app.config['ARCHIVE_DB_PATH']
+    return os.path.splitext(db_path)[0] + '_archivo.db'
+
+def audit_dir_for(branch):
+    if len(get_branches()) == 1:
+        return app.config['AUDIT_ARCHIVE_DIR']
+    return os.path.join(app.config['AUDIT_ARCHIVE_DIR'], branch)
+
+# Consultas federadas: la misma consulta en todas las sucursales a la vez.
+# sqlite3 libera el GIL mientras ejecuta, así que un pool de hilos basta.
+_federation_pool = None
+_federation_lock = threading.Lock()
+
+def _query_branch(branch, sql, params):
+    db = connect_read_db(branch) or connect_db(branch_db_path(branch))
+    try:
+        return branch, db.execute(sql, params).fetchall()
+    finally:
         db.close()
 
-def init_db():
-    db = get_db()
-    cur = db.cursor()
-    
+def federated_query(sql, params=()):
+    """Devolver [(sucursal, filas), ...] en el orden de BRANCHES"""
+    global _federation_pool
+    if _federation_pool is None:
+        with _federation_lock:
+            if _federation_pool is None:
+                _federation_pool = ThreadPoolExecutor(max_workers=app.config['FEDERATION_WORKERS'],
+                                                      thread_name_prefix='federation')
+    futures = [_federation_pool.submit(_query_branch, branch, sql, params) for branch in get_branches()]
+    return [f.result() for f in futures]
+
+# ---------------------- RÉPLICA DE LECTURA ----------------------
+# Reportes y exportaciones leen de una copia de la base hecha con la API de
+# backup de SQLite, por pasos cortos para no frenar a la caja. La copia se
+# escribe en un archivo temporal y se publica con os.replace (atómico); quien
+# ya la tenía abierta sigue leyendo la versión anterior. Si la copia es más
+# vieja que REPLICA_MAX_AGE se lee de la principal y se refresca en segundo plano.
+_replica_refreshing = set()
+_replica_lock = threading.Lock()
+
+def replica_path_for(db_path):
+    return os.path.splitext(db_path)[0] + '_replica.db'
+
+def replica_age(branch):
+    try:
+        return time.time() - os.path.getmtime(replica_path_for(branch_db_path(branch)))
+    except OSError:
+        return None
+
+def refresh_replica(branch):
+    """Copiar la base de la sucursal a su réplica; devuelve la duración en segundos"""
+    started = time.monotonic()
+    path = branch_db_path(branch)
+    target = replica_path_for(path)
+    tmp = f'{target}.{os.getpid()}.{threading.get_ident()}.tmp'
+    src = sqlite3.connect(path, timeout=10)
+    dst = sqlite3.connect(tmp)
+    try:
+        src.backup(dst, pages=app.config['REPLICA_PAGES_PER_STEP'], sleep=0.005)
+        # La réplica se abre en solo lectura: sin WAL no necesita -shm/-wal
+        dst.execute('PRAGMA journal_mode=DELETE')
+    finally:
+        dst.close()
+        src.close()
+    os.replace(tmp, target)
+    return time.monotonic() - started
+
+def _refresh_replica_background(branch):
+    with _replica_lock:
+        if branch in _replica_refreshing:
+            return
+        _replica_refreshing.add(branch)
+
+    def run():
+        try:
+            refresh_replica(branch)
+        except Exception as e:
+            app.logger.warning('No se pudo refrescar la réplica de %s: %s', branch, e)
+        finally:
+            with _replica_lock:
+                _replica_refreshing.discard(branch)
+    threading.Thread(target=run, name=f'replica-{branch}', daemon=True).start()
+
+def connect_read_db(branch):
+    """Conexión de solo lectura a la réplica, o None si está desactivada o vencida"""
+    if not app.config['REPLICA_ENABLED']:
+        return None
+    age = replica_age(branch)
+    if age is None or age > app.config['REPLICA_MAX_AGE']:
+        _refresh_replica_background(branch)
+        return None
+    path = branch_db_path(branch)
+    db = sqlite3.connect(f'file:{replica_path_for(path)}?mode=ro', uri=True, timeout=10)
+    db.row_factory = sqlite3.Row
+    # El archivo frío solo cambia con archive-orders: se lee directamente
+    attach_archive(db, archive_path_for(path))
+    return db
+
+@app.cli.command('refresh-replica')
+def refresh_replica_command():
+    """Regenerar la réplica de lectura de cada sucursal (para cron)"""
+    for branch in get_branches():
+        print(f'[{branch}] réplica actualizada en {refresh_replica(branch):.2f} s')
+
+# Versión del esquema, guardada en PRAGMA user_version. Cada cambio de
+# esquema agrega una entrada nueva en MIGRATIONS y sube SCHEMA_VERSION.
+# Una entrada puede ser SQL o una función que recibe la conexión.
+SCHEMA_VERSION = 14
+
+# Tablas cuyos cambios quedan en change_log (la de usuarios no: tiene hashes)
+CHANGE_TABLES = ('clients', 'orders', 'order_items', 'price_list', 'inventory')
+
+def _change_log_triggers(table):
+    return [f'''CREATE TRIGGER IF NOT EXISTS trg_{table}_{op}_log AFTER {op.upper()} ON {table}
+            BEGIN
+                INSERT INTO change_log (table_name, row_id, op, changed_at)
+                VALUES ('{table}', {ref}.id, '{op}', strftime('%Y-%m-%dT%H:%M:%f', 'now'));
+            END'''
+            for op, ref in (('insert', 'NEW'), ('update', 'NEW'), ('delete', 'OLD'))]
+
+# Documento de búsqueda de una orden (ver BÚSQUEDA DE ÓRDENES). Se usa en
+# los triggers, que solo ven la base principal, y para indexar el archivo.
+def _order_search_doc(where, orders='orders', items='order_items'):
+    return (f"INSERT INTO orders_fts (rowid, order_number, notes, client, garments, status, month) "
+            f"SELECT o.id, o.order_number, COALESCE(o.notes, ''), "
+            f"COALESCE(c.name, '') || ' ' || COALESCE(c.phone, ''), "
+            f"COALESCE((SELECT group_concat(garment_type, ' ') FROM {items} WHERE order_id = o.id), ''), "
+            f"o.status, substr(o.created_at, 1, 7) "
+            f"FROM {orders} o LEFT JOIN clients c ON c.id = o.client_id WHERE {where}")
+
+def _order_search_triggers():
+    refresh = lambda ref: (f'DELETE FROM orders_fts WHERE rowid = {ref}; '
+                           f'{_order_search_doc(f"o.id = {ref}")};')
+    return [
+        f'CREATE TRIGGER IF NOT EXISTS trg_orders_fts_insert AFTER INSERT ON orders BEGIN '
+        f'{_order_search_doc("o.id = NEW.id")}; END',
+        f'CREATE TRIGGER IF NOT EXISTS trg_orders_fts_update '
+        f'AFTER UPDATE OF order_number, notes, client_id, status, created_at ON orders BEGIN '
+        f'DELETE FROM orders_fts WHERE rowid = OLD.id; {_order_search_doc("o.id = NEW.id")}; END',
+        'CREATE TRIGGER IF NOT EXISTS trg_orders_fts_delete AFTER DELETE ON orders BEGIN '
+        'DELETE FROM orders_fts WHERE rowid = OLD.id; END',
+        f'CREATE TRIGGER IF NOT EXISTS trg_order_items_fts_insert AFTER INSERT ON order_items BEGIN '
+        f'{refresh("NEW.order_id")} END',
+        f'CREATE TRIGGER IF NOT EXISTS trg_order_items_fts_update AFTER UPDATE ON order_items BEGIN '
+        f'{refresh("OLD.order_id")} {refresh("NEW.order_id")} END',
+        f'CREATE TRIGGER IF NOT EXISTS trg_order_items_fts_delete AFTER DELETE ON order_items BEGIN '
+        f'{refresh("OLD.order_id")} END',
+        f'CREATE TRIGGER IF NOT EXISTS trg_clients_fts_update AFTER UPDATE OF name, phone ON clients BEGIN '
+        f'DELETE FROM orders_fts WHERE rowid IN (SELECT id FROM orders WHERE client_id = NEW.id); '
+        f'{_order_search_doc("o.client_id = NEW.id")}; END',
+    ]
+
+# Carga de entregas por día (ver CAPACIDAD DE ENTREGA): piezas por categoría
+# y, en la fila '*', total de piezas y de órdenes. Los triggers la mantienen
+# al crear, editar o borrar órdenes e items de la base principal.
+def _load_count_upsert(day, delta):
+    return (f"INSERT INTO delivery_load (day, category, pieces, orders) SELECT {day}, '*', 0, {delta} "
+            f"WHERE {day} IS NOT NULL "
+            f"ON CONFLICT (day, category) DO UPDATE SET orders = orders + excluded.orders")
+
+def _load_item_upsert(ref, sign):
+    return (f"INSERT INTO delivery_load (day, category, pieces, orders) "
+            f"SELECT o.delivery_date, c.category, {sign}{ref}.quantity, 0 FROM orders o, "
+            f"(SELECT COALESCE((SELECT category FROM price_list WHERE garment_type = {ref}.garment_type), 'otros') "
+            f"AS category UNION ALL SELECT '*') c "
+            f"WHERE o.id = {ref}.order_id AND o.delivery_date IS NOT NULL "
+            f"ON CONFLICT (day, category) DO UPDATE SET pieces = pieces + excluded.pieces")
+
+def _load_order_upsert(day, order_id, sign):
+    return (f"INSERT INTO delivery_load (day, category, pieces, orders) "
+            f"SELECT {day}, category, {sign}SUM(quantity), 0 FROM ("
+            f"SELECT COALESCE(p.category, 'otros') AS category, i.quantity FROM order_items i "
+            f"LEFT JOIN price_list p ON p.garment_type = i.garment_type WHERE i.order_id = {order_id} "
+            f"UNION ALL SELECT '*', quantity FROM order_items WHERE order_id = {order_id}) "
+            f"WHERE {day} IS NOT NULL GROUP BY category "
+            f"ON CONFLICT (day, category) DO UPDATE SET pieces = pieces + excluded.pieces")
+
+def _delivery_load_triggers():
+    return [
+        f'CREATE TRIGGER IF NOT EXISTS trg_orders_load_insert AFTER INSERT ON orders BEGIN '
+        f'{_load_count_upsert("NEW.delivery_date", 1)}; END',
+        f'CREATE TRIGGER IF NOT EXISTS trg_orders_load_delete AFTER DELETE ON orders BEGIN '
+        f'{_load_count_upsert("OLD.delivery_date", -1)}; END',
+        f'CREATE TRIGGER IF NOT EXISTS trg_orders_load_update AFTER UPDATE OF delivery_date ON orders '
+        f'WHEN OLD.delivery_date IS NOT NEW.delivery_date BEGIN '
+        f'{_load_count_upsert("OLD.delivery_date", -1)}; {_load_order_upsert("OLD.delivery_date", "OLD.id", "-")}; '
+        f'{_load_count_upsert("NEW.delivery_date", 1)}; {_load_order_upsert("NEW.delivery_date", "NEW.id", "")}; END',
+        f'CREATE TRIGGER IF NOT EXISTS trg_order_items_load_insert AFTER INSERT ON order_items BEGIN '
+        f'{_load_item_upsert("NEW", "")}; END',
+        f'CREATE TRIGGER IF NOT EXISTS trg_order_items_load_delete AFTER DELETE ON order_items BEGIN '
+        f'{_load_item_upsert("OLD", "-")}; END',
+        f'CREATE TRIGGER IF NOT EXISTS trg_order_items_load_update '
+        f'AFTER UPDATE OF order_id, garment_type, quantity ON order_items BEGIN '
+        f'{_load_item_upsert("OLD", "-")}; {_load_item_upsert("NEW", "")}; END',
+    ]
+
+MIGRATIONS = {
     # Tablas - ACTUALIZADA la tabla price_list
-    tables = [
+    1: [
         '''CREATE TABLE IF NOT EXISTS clients (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             name TEXT NOT NULL,
@@ -107,15 +444,261 @@ def init_db():
             row_id INTEGER,
             username TEXT,
             created_at TEXT
-        )'''
-    ]
-    
-    for table in tables:
-        cur.execute(table)
-    
+        )''',
+    ],
+    2: [
+        'CREATE INDEX IF NOT EXISTS idx_orders_status_created ON orders(status, created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_orders_client ON orders(client_id, created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_order_items_order ON order_items(order_id)',
+    ],
+    3: [
+        'CREATE INDEX IF NOT EXISTS idx_audit_logs_created ON audit_logs(created_at)',
+    ],
+    4: [
+        '''CREATE TABLE IF NOT EXISTS export_jobs (
+            id TEXT PRIMARY KEY,
+            kind TEXT NOT NULL,
+            params TEXT NOT NULL,
+            dedupe_key TEXT NOT NULL,
+            status TEXT NOT NULL,
+            progress INTEGER DEFAULT 0,
+            total INTEGER DEFAULT 0,
+            result_path TEXT,
+            error TEXT,
+            username TEXT,
+            created_at TEXT,
+            updated_at TEXT,
+            finished_at TEXT,
+            expires_at TEXT
+        )''',
+        'CREATE INDEX IF NOT EXISTS idx_export_jobs_dedupe ON export_jobs(dedupe_key, status)',
+        'CREATE INDEX IF NOT EXISTS idx_export_jobs_expires ON export_jobs(expires_at)',
+    ],
+    5: [
+        '''CREATE TABLE IF NOT EXISTS order_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            order_id INTEGER NOT NULL,
+            created_at TEXT
+        )''',
+    ],
+    6: [
+        'ALTER TABLE clients ADD COLUMN order_count INTEGER NOT NULL DEFAULT 0',
+        'ALTER TABLE clients ADD COLUMN total_spent REAL NOT NULL DEFAULT 0',
+        'ALTER TABLE clients ADD COLUMN avg_ticket REAL NOT NULL DEFAULT 0',
+        'ALTER TABLE clients ADD COLUMN last_order_at TEXT',
+        'CREATE INDEX IF NOT EXISTS idx_clients_order_count ON clients(order_count)',
+        'CREATE INDEX IF NOT EXISTS idx_clients_total_spent ON clients(total_spent)',
+        'CREATE INDEX IF NOT EXISTS idx_clients_avg_ticket ON clients(avg_ticket)',
+        'CREATE INDEX IF NOT EXISTS idx_clients_last_order ON clients(last_order_at)',
+        lambda db: rebuild_client_metrics(db),
+    ],
+    7: [
+        'ALTER TABLE orders ADD COLUMN overdue_at TEXT',
+        'CREATE INDEX IF NOT EXISTS idx_orders_status_delivery ON orders(status, delivery_date)',
+        '''CREATE TABLE IF NOT EXISTS scheduler_state (
+            name TEXT PRIMARY KEY,
+            lease_until TEXT,
+            holder TEXT,
+            high_water TEXT,
+            last_run_at TEXT,
+            last_duration REAL,
+            last_result TEXT
+        )''',
+        '''CREATE TABLE IF NOT EXISTS notification_queue (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            order_id INTEGER NOT NULL,
+            kind TEXT NOT NULL,
+            channel TEXT NOT NULL DEFAULT 'sms',
+            status TEXT NOT NULL DEFAULT 'pendiente',
+            error TEXT,
+            created_at TEXT,
+            sent_at TEXT,
+            UNIQUE(order_id, kind)
+        )''',
+        'CREATE INDEX IF NOT EXISTS idx_notification_queue_status ON notification_queue(status, id)',
+    ],
+    8: [
+        '''CREATE TABLE IF NOT EXISTS idempotency_keys (
+            key TEXT PRIMARY KEY,
+            order_id INTEGER,
+            created_at TEXT NOT NULL,
+            expires_at TEXT NOT NULL
+        )''',
+        'CREATE INDEX IF NOT EXISTS idx_idempotency_keys_expires ON idempotency_keys(expires_at)',
+    ],
+    9: [
+        '''CREATE TABLE IF NOT EXISTS change_log (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            table_name TEXT NOT NULL,
+            row_id INTEGER NOT NULL,
+            op TEXT NOT NULL,
+            changed_at TEXT NOT NULL
+        )''',
+        *[trigger for table in CHANGE_TABLES for trigger in _change_log_triggers(table)],
+    ],
+    10: [
+        lambda db: enable_incremental_vacuum(db),
+    ],
+    11: [
+        '''CREATE VIRTUAL TABLE IF NOT EXISTS orders_fts USING fts5(
+            order_number, notes, client, garments, status UNINDEXED, month UNINDEXED,
+            tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+        )''',
+        *_order_search_triggers(),
+        lambda db: rebuild_order_search(db),
+    ],
+    # Consumo de insumos por prenda y por orden, y consumo real por día. El
+    # índice parcial es el conjunto de insumos bajos, que SQLite mantiene al
+    # cambiar qty o el umbral
+    12: [
+        'ALTER TABLE inventory ADD COLUMN per_order REAL NOT NULL DEFAULT 0',
+        '''CREATE TABLE IF NOT EXISTS consumption_rates (
+            garment_type TEXT NOT NULL,
+            inventory_id INTEGER NOT NULL REFERENCES inventory(id) ON DELETE CASCADE,
+            per_unit REAL NOT NULL,
+            PRIMARY KEY (garment_type, inventory_id)
+        ) WITHOUT ROWID''',
+        '''CREATE TABLE IF NOT EXISTS supply_usage (
+            day TEXT NOT NULL,
+            inventory_id INTEGER NOT NULL,
+            used REAL NOT NULL,
+            PRIMARY KEY (day, inventory_id)
+        ) WITHOUT ROWID''',
+        'CREATE INDEX IF NOT EXISTS idx_inventory_low ON inventory(name) WHERE qty <= low_threshold',
+        lambda db: seed_consumption_rates(db),
+        lambda db: backfill_supply_usage(db),
+    ],
+    13: [
+        '''CREATE TABLE IF NOT EXISTS delivery_load (
+            day TEXT NOT NULL,
+            category TEXT NOT NULL,
+            pieces INTEGER NOT NULL DEFAULT 0,
+            orders INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, category)
+        ) WITHOUT ROWID''',
+        *_delivery_load_triggers(),
+        lambda db: rebuild_delivery_load(db),
+    ],
+    # Órdenes pendientes aún no marcadas como vencidas: el barrido recorre solo
+    # este índice parcial, que se vacía a medida que las marca
+    14: [
+        "CREATE INDEX IF NOT EXISTS idx_orders_overdue_pending ON orders(delivery_date) "
+        "WHERE status='pendiente' AND overdue_at IS NULL",
+    ],
+}
+
+# ---------------------- ARCHIVO DE ÓRDENES ----------------------
+# Las órdenes entregadas antiguas se mueven, con sus items, a un SQLite aparte
+# que cada conexión adjunta como 'archive'. Las vistas temporales all_orders y
+# all_order_items unen ambos archivos para historial, reportes y exportaciones.
+# Los ids no chocan: AUTOINCREMENT nunca reutiliza ids en la base principal.
+ORDER_COLUMNS = 'id, order_number, client_id, status, created_at, delivery_date, total, notes'
+ORDER_ITEM_COLUMNS = 'id, order_id, garment_type, quantity, unit_price, subtotal'
+
+ARCHIVE_TABLES = [
+    '''CREATE TABLE IF NOT EXISTS archive.orders (
+        id INTEGER PRIMARY KEY,
+        order_number TEXT UNIQUE NOT NULL,
+        client_id INTEGER,
+        status TEXT NOT NULL,
+        created_at TEXT,
+        delivery_date TEXT,
+        total REAL DEFAULT 0,
+        notes TEXT
+    )''',
+    '''CREATE TABLE IF NOT EXISTS archive.order_items (
+        id INTEGER PRIMARY KEY,
+        order_id INTEGER,
+        garment_type TEXT,
+        quantity INTEGER,
+        unit_price REAL,
+        subtotal REAL
+    )''',
+    'CREATE INDEX IF NOT EXISTS archive.idx_orders_client ON orders(client_id, created_at)',
+    'CREATE INDEX IF NOT EXISTS archive.idx_order_items_order ON order_items(order_id)',
+]
+
+def attach_archive(db, archive_path):
+    db.execute('ATTACH DATABASE ? AS archive', (archive_path,))
+    db.execute(f'CREATE TEMP VIEW IF NOT EXISTS all_orders AS '
+               f'SELECT {ORDER_COLUMNS} FROM main.orders UNION ALL SELECT {ORDER_COLUMNS} FROM archive.orders')
+    db.execute(f'CREATE TEMP VIEW IF NOT EXISTS all_order_items AS '
+               f'SELECT {ORDER_ITEM_COLUMNS} FROM main.order_items '
+               f'UNION ALL SELECT {ORDER_ITEM_COLUMNS} FROM archive.order_items')
+
+def init_archive(db):
+    for statement in ARCHIVE_TABLES:
+        db.execute(statement)
     db.commit()
+
+def archive_orders(db, days=None, batch=None):
+    """Mover órdenes entregadas con más de `days` días al archivo, por lotes"""
+    days = app.config['ARCHIVE_AFTER_DAYS'] if days is None else days
+    batch = batch or app.config['ARCHIVE_BATCH']
+    cutoff = (datetime.utcnow() - timedelta(days=days)).isoformat()
+    moved = 0
+    while True:
+        ids = [r[0] for r in db.execute(
+            "SELECT id FROM main.orders WHERE status='entregado' AND created_at < ? ORDER BY created_at LIMIT ?",
+            (cutoff, batch))]
+        if not ids:
+            return moved
+        marks = ','.join('?' * len(ids))
+        # Una transacción por lote para no retener el bloqueo de escritura.
+        # En WAL el commit no es atómico entre archivos; INSERT OR REPLACE
+        # hace que repetir un lote interrumpido sea seguro.
+        with db:
+            db.execute(f'INSERT OR REPLACE INTO archive.orders ({ORDER_COLUMNS}) '
+                       f'SELECT {ORDER_COLUMNS} FROM main.orders WHERE id IN ({marks})', ids)
+            db.execute(f'INSERT OR REPLACE INTO archive.order_items ({ORDER_ITEM_COLUMNS}) '
+                       f'SELECT {ORDER_ITEM_COLUMNS} FROM main.order_items WHERE order_id IN ({marks})', ids)
+            db.execute(f'DELETE FROM main.order_items WHERE order_id IN ({marks})', ids)
+            db.execute(f'DELETE FROM main.orders WHERE id IN ({marks})', ids)
+            # Los triggers sacaron estas órdenes del buscador; se indexan desde el archivo
+            db.execute(_order_search_doc(f'o.id IN ({marks})', 'archive.orders', 'archive.order_items'), ids)
+        moved += len(ids)
+
+def get_schema_version(db):
+    return db.execute('PRAGMA user_version').fetchone()[0]
+
+def migrate_db(db):
+    """Aplicar las migraciones pendientes y devolver la versión final"""
+    current = get_schema_version(db)
+    for version in range(current + 1, SCHEMA_VERSION + 1):
+        for statement in MIGRATIONS.get(version, []):
+            if callable(statement):
+                statement(db)
+            else:
+                db.execute(statement)
+        # PRAGMA no admite parámetros; version es un entero interno
+        db.execute(f'PRAGMA user_version = {version}')
+        db.commit()
+    return get_schema_version(db)
+
+def init_db(db=None):
+    db = db or get_db()
+    # WAL queda guardado en el archivo: lectores y escritores de varios
+    # procesos (workers) ya no se bloquean entre sí
+    db.execute('PRAGMA journal_mode=WAL')
+    # El archivo primero: algunas migraciones leen all_orders
+    init_archive(db)
+    migrate_db(db)
     seed_defaults(db)
 
+def check_schema(path=None):
+    """Verificación barata al arrancar un worker: solo lee user_version"""
+    db = connect_db(path)
+    try:
+        version = get_schema_version(db)
+        archive_ready = db.execute("SELECT 1 FROM archive.sqlite_master WHERE name='orders'").fetchone()
+    finally:
+        db.close()
+    if version < SCHEMA_VERSION or not archive_ready:
+        raise RuntimeError(f'Esquema de base de datos desactualizado (v{version}, se requiere '
+                           f'v{SCHEMA_VERSION}). Ejecuta: flask --app app init-db')
+    return version
+
 def seed_defaults(db):
     cur = db.cursor()
     
@@ -123,7 +706,7 @@ def seed_defaults(db):
     cur.execute("SELECT COUNT(*) as c FROM users")
     if cur.fetchone()['c'] == 0:
         cur.execute("INSERT INTO users (username,password_hash,role,created_at) VALUES (?,?,?,?)",
-                    ('admin', generate_password_hash('admin123'), 'admin', datetime.utcnow().isoformat()))
+                    ('admin', hash_password('admin123'), 'admin', datetime.utcnow().isoformat()))
     
     # PRENDAS TÍPICAS DE REPÚBLICA DOMINICANA POR CATEGORÍAS
     categories_and_prices = [
@@ -184,22 +767,455 @@ def seed_defaults(db):
     # Inventario por defecto
     items = [('detergente', 50, 5), ('suavizante', 40, 5), ('bolsas', 200, 10)]
     for name, qty, low in items:
-        cur.execute('INSERT OR IGNORE INTO inventory (name,qty,low_threshold) VALUES (?,?,?)', (name, qty, low))
+        # inventory.name no es UNIQUE: evitar duplicados al repetir init-db
+        cur.execute('INSERT INTO inventory (name,qty,low_threshold) SELECT ?,?,? '
+                    'WHERE NOT EXISTS (SELECT 1 FROM inventory WHERE name=?)', (name, qty, low, name))
+    seed_consumption_rates(db)
     
     db.commit()
 
-# Inicializar BD al inicio
-with app.app_context():
-    init_db()
+@app.cli.command('init-db')
+def init_db_command():
+    """Crear o migrar el esquema y cargar los datos por defecto"""
+    for branch, path in get_branches().items():
+        db = connect_db(path)
+        try:
+            before = get_schema_version(db)
+            init_db(db)
+            after = get_schema_version(db)
+        finally:
+            db.close()
+        print(f'[{branch}] Base de datos lista en {path} (esquema v{before} -> v{after})')
+
+@app.cli.command('archive-orders')
+@click.option('--days', type=int, default=None, help='Antigüedad mínima en días')
+@click.option('--batch', type=int, default=None, help='Órdenes por transacción')
+def archive_orders_command(days, batch):
+    """Mover órdenes entregadas antiguas al archivo frío"""
+    for branch, path in get_branches().items():
+        db = connect_db(path)
+        try:
+            moved = archive_orders(db, days, batch)
+        finally:
+            db.close()
+        print(f'[{branch}] {moved} órdenes archivadas en {archive_path_for(path)}')
+
+def create_app(config=None):
+    """Preparar la aplicación para un worker de producción.
+
+    La inicialización del esquema y los datos por defecto se hace una sola vez
+    con `flask --app app init-db`; aquí solo se comprueba la versión.
+    """
+    if config:
+        app.config.update(config)
+    for path in get_branches().values():
+        check_schema(path)
+    if app.config['SCHEDULER_ENABLED']:
+        start_scheduler()
+    return app
+
+# ---------------------- ACCESO A DATOS ----------------------
+# Lecturas centralizadas por entidad. Cada consulta es un texto fijo, así el
+# caché de sentencias de cada conexión sqlite3 la compila una sola vez. Las
+# filas son namedtuples: tuplas con acceso por atributo (los templates no
+# cambian) que no cargan el mapa de nombres de sqlite3.Row en cada fila.
+CLIENT_COLUMNS = 'id, name, phone, address, created_at, order_count, total_spent, avg_ticket, last_order_at'
+PRICE_COLUMNS = 'id, garment_type, price, category'
+INVENTORY_COLUMNS = 'id, name, qty, low_threshold, per_order'
+
+ClientRow = namedtuple('ClientRow', CLIENT_COLUMNS)
+OrderRow = namedtuple('OrderRow', ORDER_COLUMNS)
+BoardOrderRow = namedtuple('BoardOrderRow', ORDER_COLUMNS + ', overdue_at, client_name')
+OrderDetailRow = namedtuple('OrderDetailRow', ORDER_COLUMNS + ', client_name, phone, address')
+ExportOrderRow = namedtuple('ExportOrderRow', 'order_number, client_name, phone, status, created_at, '
+                                              'delivery_date, total, notes')
+OrderItemRow = namedtuple('OrderItemRow', ORDER_ITEM_COLUMNS)
+PriceRow = namedtuple('PriceRow', PRICE_COLUMNS)
+InventoryRow = namedtuple('InventoryRow', INVENTORY_COLUMNS)
+OrderStatusRow = namedtuple('OrderStatusRow', 'status, delivery_date, phone')
+PendingItemRow = namedtuple('PendingItemRow', 'order_number, delivery_date, garment_type, quantity, category')
+
+def _prefixed(alias, columns):
+    return ', '.join(f'{alias}.{c.strip()}' for c in columns.split(','))
+
+class Query:
+    """Sentencia SQL fija y el tipo de fila que produce"""
+    __slots__ = ('sql', 'row')
+
+    def __init__(self, sql, row):
+        self.sql = sql
+        self.row = row
+
+    def _cursor(self, db, args):
+        cur = db.cursor()
+        cur.row_factory = None  # tuplas crudas; se envuelven con row._make
+        return cur.execute(self.sql, args)
+
+    def iter(self, db, *args):
+        return map(self.row._make, self._cursor(db, args))
+
+    def all(self, db, *args):
+        return list(self.iter(db, *args))
+
+    def one(self, db, *args):
+        raw = self._cursor(db, args).fetchone()
+        return None if raw is None else self.row._make(raw)
+
+# Clientes: la lista admite filtros y orden (CLIENT_SORTS), por eso es una función
+CLIENT_FILTERS = (('min_orders', 'order_count >= ?'), ('min_spent', 'total_spent >= ?'))
+
+def list_clients(db, order_by='name', **filters):
+    sql, args = f'SELECT {CLIENT_COLUMNS} FROM clients WHERE 1=1', []
+    for name, condition in CLIENT_FILTERS:
+        if filters.get(name):
+            sql += f' AND {condition}'
+            args.append(filters[name])
+    return Query(f'{sql} ORDER BY {order_by}', ClientRow).all(db, *args)
+
+clients_repo = SimpleNamespace(
+    by_id=Query(f'SELECT {CLIENT_COLUMNS} FROM clients WHERE id=?', ClientRow),
+    by_name=Query(f'SELECT {CLIENT_COLUMNS} FROM clients ORDER BY name', ClientRow),
+    list=list_clients,
+)
+
+orders_repo = SimpleNamespace(
+    recent=Query(f'SELECT {_prefixed("o", ORDER_COLUMNS)}, o.overdue_at, c.name FROM orders o '
+                 'LEFT JOIN clients c ON o.client_id=c.id ORDER BY o.created_at DESC LIMIT ?', BoardOrderRow),
+    detail=Query(f'SELECT {_prefixed("o", ORDER_COLUMNS)}, c.name, c.phone, c.address FROM all_orders o '
+                 'LEFT JOIN clients c ON o.client_id=c.id WHERE o.id=?', OrderDetailRow),
+    by_client=Query(f'SELECT {ORDER_COLUMNS} FROM all_orders WHERE client_id=? ORDER BY created_at DESC', OrderRow),
+    public_status=Query('SELECT o.status, o.delivery_date, c.phone FROM all_orders o '
+                        'LEFT JOIN clients c ON o.client_id=c.id WHERE o.order_number=?', OrderStatusRow),
+)
+
+items_repo = SimpleNamespace(
+    by_order=Query(f'SELECT {ORDER_ITEM_COLUMNS} FROM all_order_items WHERE order_id=?', OrderItemRow),
+    pending=Query("SELECT o.order_number, o.delivery_date, i.garment_type, i.quantity, p.category FROM orders o "
+                  "JOIN order_items i ON i.order_id=o.id LEFT JOIN price_list p ON p.garment_type=i.garment_type "
+                  "WHERE o.status='pendiente'", PendingItemRow),
+)
+
+prices_repo = SimpleNamespace(
+    all=Query(f'SELECT {PRICE_COLUMNS} FROM price_list ORDER BY category, garment_type', PriceRow),
+    by_id=Query(f'SELECT {PRICE_COLUMNS} FROM price_list WHERE id=?', PriceRow),
+)
+
+inventory_repo = SimpleNamespace(
+    all=Query(f'SELECT {INVENTORY_COLUMNS} FROM inventory ORDER BY name', InventoryRow),
+    by_id=Query(f'SELECT {INVENTORY_COLUMNS} FROM inventory WHERE id=?', InventoryRow),
+    low=Query(f'SELECT {INVENTORY_COLUMNS} FROM inventory WHERE qty <= low_threshold ORDER BY name', InventoryRow),
+)
+
+# ---------------------- DEPENDENCIAS OPCIONALES ----------------------
+# ReportLab, openpyxl, pyarrow y Twilio se importan recién en el primer uso. Saber si
+# están instalados solo requiere buscar el paquete (find_spec), sin cargarlo.
+def _load_reportlab():
+    from reportlab.lib.pagesizes import letter
+    from reportlab.pdfgen import canvas
+    return SimpleNamespace(letter=letter, canvas=canvas)
+
+def _load_openpyxl():
+    import openpyxl
+    from openpyxl.utils import get_column_letter
+    return SimpleNamespace(Workbook=openpyxl.Workbook, get_column_letter=get_column_letter)
+
+def _load_brotli():
+    import brotli
+    return brotli
+
+def _load_pyarrow():
+    import pyarrow
+    import pyarrow.parquet
+    return SimpleNamespace(pa=pyarrow, pq=pyarrow.parquet)
+
+def _load_twilio():
+    from twilio.rest import Client
+    return SimpleNamespace(Client=Client)
+
+# nombre -> (paquete a buscar, cargador)
+OPTIONAL_BACKENDS = {
+    'reportlab': ('reportlab', _load_reportlab),
+    'openpyxl': ('openpyxl', _load_openpyxl),
+    'twilio': ('twilio', _load_twilio),
+    'brotli': ('brotli', _load_brotli),
+    'pyarrow': ('pyarrow', _load_pyarrow),
+}
+
+@lru_cache(maxsize=None)
+def backend_available(name):
+    return importlib.util.find_spec(OPTIONAL_BACKENDS[name][0]) is not None
+
+@lru_cache(maxsize=None)
+def load_backend(name):
+    package, loader = OPTIONAL_BACKENDS[name]
+    if not backend_available(name):
+        raise RuntimeError(f'{package} no disponible. Instala con: pip install {package}')
+    try:
+        return loader()
+    except ImportError as e:
+        raise RuntimeError(f'{package} instalado pero no se pudo cargar: {e}')
+
+# ---------------------- RECURSOS ESTÁTICOS Y COMPRESIÓN ----------------------
+# Bootstrap se sirve desde static/ (sin depender del CDN). asset_url() agrega
+# al nombre un hash del contenido, así que la URL cambia con cada versión y el
+# navegador puede guardarla un año sin volver a preguntar.
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+COMPRESSIBLE_TYPES = {'text/html', 'application/json', 'text/csv', 'text/css',
+                      'application/javascript', 'text/javascript', 'image/svg+xml'}
+
+@lru_cache(maxsize=None)
+def _asset_digest(filename):
+    with open(os.path.join(STATIC_DIR, filename), 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()[:12]
+
+def asset_url(filename):
+    base, ext = os.path.splitext(filename)
+    return f'/assets/{base}.{_asset_digest(filename)}{ext}'
+
+app.add_template_global(asset_url)
+
+def negotiate_encoding():
+    if backend_available('brotli') and request.accept_encodings['br']:
+        return 'br'
+    if request.accept_encodings['gzip']:
+        return 'gzip'
+    return None
+
+def compress_body(data, encoding):
+    if encoding == 'br':
+        return load_backend('brotli').compress(data, quality=app.config['BROTLI_QUALITY'])
+    return gzip.compress(data, compresslevel=app.config['GZIP_LEVEL'])
+
+@lru_cache(maxsize=32)
+def _asset_body(filename, encoding):
+    # Los recursos no cambian sin reiniciar: se comprimen una sola vez
+    with open(os.path.join(STATIC_DIR, filename), 'rb') as f:
+        data = f.read()
+    return compress_body(data, encoding) if encoding else data
+
+@app.route('/assets/<path:hashed_name>')
+def asset(hashed_name):
+    stem, ext = os.path.splitext(hashed_name)
+    base, _, digest = stem.rpartition('.')
+    filename = base + ext
+    path = safe_join(STATIC_DIR, filename)
+    if not base or path is None or not os.path.isfile(path):
+        abort(404)
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    encoding = negotiate_encoding() if mimetype in COMPRESSIBLE_TYPES else None
+    response = Response(_asset_body(filename, encoding), mimetype=mimetype)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    if digest == _asset_digest(filename):
+        response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    else:
+        # URL de una versión anterior: servir la actual sin fijarla en caché
+        response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@app.after_request
+def compress_response(response):
+    """Comprimir HTML, JSON y CSV por encima de COMPRESS_MIN_SIZE"""
+    if (response.status_code != 200 or response.mimetype not in COMPRESSIBLE_TYPES
+            or 'Content-Encoding' in response.headers):
+        return response
+    if response.direct_passthrough:
+        # send_file: solo si el tamaño es conocido y razonable para memoria
+        if response.content_length is None or response.content_length > app.config['COMPRESS_MAX_SIZE']:
+            return response
+        response.direct_passthrough = False
+    elif response.is_streamed:
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = negotiate_encoding()
+    if encoding is None:
+        return response
+    data = response.get_data()
+    if len(data) < app.config['COMPRESS_MIN_SIZE']:
+        return response
+    response.set_data(compress_body(data, encoding))
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag:
+        response.set_etag(f'{etag}-{encoding}', weak)
+    return response
+
+# Plantillas: render_template_string de Flask vuelve a compilar la plantilla en
+# cada petición (15-30 ms en las más grandes). Las plantillas son constantes
+# del módulo, así que cada proceso compila cada una la primera vez que la usa.
+@lru_cache(maxsize=64)
+def compiled_template(source):
+    return app.jinja_env.from_string(source)
+
+def render_page(source, **context):
+    """Como render_template_string, con la plantilla compilada una sola vez por proceso"""
+    app.update_template_context(context)
+    return compiled_template(source).render(context)
+
+# Páginas en streaming: la plantilla se genera mientras se recorre el cursor
+# y se envía en bloques de ~STREAM_CHUNK_SIZE bytes, así el navegador pinta
+# las primeras filas enseguida y la memoria del worker no crece con el
+# resultado. compress_response no toca respuestas en streaming, por eso cada
+# bloque se comprime aquí con gzip y Z_SYNC_FLUSH (el navegador lo puede
+# descomprimir sin esperar al final).
+def _chunked(fragments, size):
+    buf, pending = [], 0
+    for fragment in fragments:
+        buf.append(fragment)
+        pending += len(fragment)
+        if pending >= size:
+            yield ''.join(buf).encode('utf-8')
+            buf, pending = [], 0
+    if buf:
+        yield ''.join(buf).encode('utf-8')
+
+def _gzip_stream(chunks):
+    z = zlib.compressobj(app.config['GZIP_LEVEL'], zlib.DEFLATED, 31)
+    for chunk in chunks:
+        yield z.compress(chunk) + z.flush(zlib.Z_SYNC_FLUSH)
+    yield z.flush()
+
+def _closing(body, connections):
+    try:
+        yield from body
+    finally:
+        for db in connections:
+            db.close()
+
+def stream_page(source, **context):
+    """Como render_template_string, pero enviando la página por partes"""
+    # Los mensajes flash salen de la sesión; se leen antes de enviar las
+    # cabeceras para que la cookie de sesión quede actualizada.
+    get_flashed_messages(with_categories=True)
+    app.update_template_context(context)
+    template = compiled_template(source)
+    body = _chunked(template.generate(context), app.config['STREAM_CHUNK_SIZE'])
+    # teardown_appcontext cierra las conexiones de g antes de que se envíe el
+    # cuerpo; la página se queda con ellas y las cierra al terminar.
+    body = _closing(body, [g.pop(name) for name in ('_database', '_read_database') if name in g])
+    headers = {'X-Accel-Buffering': 'no'}
+    if request.accept_encodings['gzip']:
+        body = _gzip_stream(body)
+        headers['Content-Encoding'] = 'gzip'
+    response = Response(stream_with_context(body), mimetype='text/html', headers=headers)
+    response.vary.add('Accept-Encoding')
+    return response
 
 # ---------------------- UTILIDADES ----------------------
-def log_action(action, table, row_id=None, username='system'):
-    db = get_db()
+def log_action(action, table, row_id=None, username='system', db=None):
+    db = db or get_db()
     cur = db.cursor()
     cur.execute('INSERT INTO audit_logs (action,table_name,row_id,username,created_at) VALUES (?,?,?,?,?)',
                 (action, table, row_id, username, datetime.utcnow().isoformat()))
     db.commit()
 
+# ---------------------- RETENCIÓN DE AUDITORÍA ----------------------
+# Las entradas con más de AUDIT_RETENTION_DAYS días se escriben en un archivo
+# comprimido por día (audit-AAAA-MM-DD.jsonl.gz) y luego se borran de la tabla
+# en lotes pequeños. Cada lote agrega un miembro gzip nuevo al archivo del día;
+# si se corta entre escribir y borrar, el lote se repite y la búsqueda
+# descarta los ids duplicados.
+AUDIT_COLUMNS = ('id', 'action', 'table_name', 'row_id', 'username', 'created_at')
+
+def _audit_segment_path(day, directory):
+    return os.path.join(directory, f'audit-{day}.jsonl.gz')
+
+def rotate_audit_logs(db, days=None, batch=None, directory=None):
+    """Pasar la auditoría antigua a archivos comprimidos y devolver cuántas filas movió"""
+    days = app.config['AUDIT_RETENTION_DAYS'] if days is None else days
+    batch = batch or app.config['AUDIT_BATCH']
+    cutoff = (datetime.utcnow() - timedelta(days=days)).isoformat()
+    directory = directory or audit_dir_for(current_branch())
+    os.makedirs(directory, exist_ok=True)
+    moved = 0
+    while True:
+        rows = db.execute(f'SELECT {", ".join(AUDIT_COLUMNS)} FROM audit_logs '
+                          'WHERE created_at < ? ORDER BY created_at LIMIT ?', (cutoff, batch)).fetchall()
+        if not rows:
+            return moved
+        by_day = {}
+        for r in rows:
+            by_day.setdefault((r['created_at'] or '')[:10] or 'sin-fecha', []).append(dict(zip(AUDIT_COLUMNS, r)))
+        for day, entries in by_day.items():
+            with gzip.open(_audit_segment_path(day, directory), 'at', encoding='utf-8') as f:
+                for entry in entries:
+                    f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+        ids = [r['id'] for r in rows]
+        with db:
+            db.execute(f'DELETE FROM audit_logs WHERE id IN ({",".join("?" * len(ids))})', ids)
+        moved += len(ids)
+
+def search_audit(db, since=None, until=None, action=None, table=None, row_id=None, username=None,
+                 directory=None):
+    """Buscar en la tabla viva y en los archivos diarios; devuelve dicts ordenados por fecha"""
+    def matches(e):
+        return ((since is None or (e['created_at'] or '') >= since) and
+                (until is None or (e['created_at'] or '') < until) and
+                (action is None or e['action'] == action) and
+                (table is None or e['table_name'] == table) and
+                (row_id is None or e['row_id'] == row_id) and
+                (username is None or e['username'] == username))
+
+    found = {}
+    directory = directory or audit_dir_for(current_branch())
+    for path in sorted(glob.glob(_audit_segment_path('*', directory))):
+        day = os.path.basename(path)[len('audit-'):-len('.jsonl.gz')]
+        # Saltar archivos de días fuera del rango sin abrirlos
+        if day != 'sin-fecha' and ((since and day < since[:10]) or (until and day > until[:10])):
+            continue
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                entry = json.loads(line)
+                if matches(entry):
+                    found[entry['id']] = entry
+
+    query = f'SELECT {", ".join(AUDIT_COLUMNS)} FROM audit_logs WHERE 1=1'
+    params = []
+    for column, op, value in (('created_at', '>=', since), ('created_at', '<', until), ('action', '=', action),
+                              ('table_name', '=', table), ('row_id', '=', row_id), ('username', '=', username)):
+        if value is not None:
+            query += f' AND {column} {op} ?'
+            params.append(value)
+    for r in db.execute(query, params):
+        found[r['id']] = dict(zip(AUDIT_COLUMNS, r))
+    return sorted(found.values(), key=lambda e: (e['created_at'] or '', e['id']))
+
+@app.cli.command('rotate-audit')
+@click.option('--days', type=int, default=None, help='Días que se conservan en la tabla')
+@click.option('--batch', type=int, default=None, help='Filas por lote')
+def rotate_audit_command(days, batch):
+    """Archivar y podar la auditoría antigua"""
+    for branch, path in get_branches().items():
+        db = connect_db(path)
+        try:
+            moved = rotate_audit_logs(db, days, batch, audit_dir_for(branch))
+        finally:
+            db.close()
+        print(f'[{branch}] {moved} entradas de auditoría archivadas en {audit_dir_for(branch)}')
+
+@app.cli.command('audit-search')
+@click.option('--since', help='Fecha/hora ISO inicial (incluida)')
+@click.option('--until', help='Fecha/hora ISO final (excluida)')
+@click.option('--action')
+@click.option('--table')
+@click.option('--row-id', type=int)
+@click.option('--user', 'username')
+@click.option('--branch', help='Sucursal (por defecto la primera)')
+def audit_search_command(since, until, action, table, row_id, username, branch):
+    """Buscar en la auditoría viva y archivada"""
+    branch = branch or current_branch()
+    db = connect_db(branch_db_path(branch))
+    try:
+        entries = search_audit(db, since, until, action, table, row_id, username, audit_dir_for(branch))
+    finally:
+        db.close()
+    for e in entries:
+        print(f"{e['created_at']}  {e['username'] or '-':12s} {e['action']:20s} {e['table_name']}#{e['row_id']}")
+    print(f'{len(entries)} resultados')
+
 def generate_order_number():
     db = get_db()
     cur = db.cursor()
@@ -211,19 +1227,717 @@ def generate_order_number():
 
 
 def get_garments_by_category():
-    db = get_db()
-    cur = db.cursor()
-    cur.execute('SELECT DISTINCT category FROM price_list ORDER BY category')
-    categories = cur.fetchall()
-    
     garments_by_category = {}
-    for category in categories:
-        cur.execute('SELECT garment_type, price FROM price_list WHERE category = ? ORDER BY garment_type', 
-                   (category['category'],))
-        garments_by_category[category['category']] = cur.fetchall()
-    
+    for p in prices_repo.all.iter(get_db()):
+        garments_by_category.setdefault(p.category, []).append(p)
     return garments_by_category
 
+# ---------------------- CONTRASEÑAS ----------------------
+# Verificar un hash seguro cuesta decenas de ms de CPU. Se hace en un pool
+# pequeño y acotado para que una ráfaga de logins no acapare los workers:
+# si el pool y su cola están llenos, el login responde 503 de inmediato.
+class HashPoolBusy(RuntimeError):
+    pass
+
+_hash_pool = None
+_hash_slots = None
+_hash_pool_lock = threading.Lock()
+
+def _run_in_hash_pool(fn, *args):
+    global _hash_pool, _hash_slots
+    if _hash_pool is None:
+        with _hash_pool_lock:
+            if _hash_pool is None:
+                workers = app.config['HASH_WORKERS']
+                _hash_slots = threading.BoundedSemaphore(workers + app.config['HASH_QUEUE'])
+                _hash_pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='hash')
+    if not _hash_slots.acquire(blocking=False):
+        raise HashPoolBusy('Demasiadas verificaciones de contraseña en curso')
+    try:
+        future = _hash_pool.submit(fn, *args)
+    except Exception:
+        _hash_slots.release()
+        raise
+    future.add_done_callback(lambda _: _hash_slots.release())
+    try:
+        return future.result(timeout=app.config['HASH_TIMEOUT'])
+    except FutureTimeout:
+        raise HashPoolBusy('La verificación de contraseña tardó demasiado')
+
+def hash_password(password):
+    return generate_password_hash(password, method=app.config['PASSWORD_HASH_METHOD'])
+
+def verify_password(password_hash, password):
+    return _run_in_hash_pool(check_password_hash, password_hash, password)
+
+@lru_cache(maxsize=None)
+def _dummy_hash(method):
+    # Para usuarios inexistentes: verificar contra este hash cuesta lo mismo
+    # que contra uno real y no delata qué nombres de usuario existen
+    return generate_password_hash(uuid.uuid4().hex, method=method)
+
+def _hash_prefix(method):
+    # 'scrypt' se expande a 'scrypt:32768:8:1'
+    return _dummy_hash(method).split('$', 1)[0]
+
+def password_needs_rehash(password_hash):
+    return password_hash.split('$', 1)[0] != _hash_prefix(app.config['PASSWORD_HASH_METHOD'])
+
+# Ventana deslizante de intentos fallidos, en memoria de cada proceso
+_login_failures = {}
+_login_failures_lock = threading.Lock()
+
+def _recent_failures(key, now):
+    attempts = _login_failures.get(key)
+    if attempts is None:
+        return 0
+    while attempts and attempts[0] <= now - app.config['LOGIN_WINDOW']:
+        attempts.popleft()
+    if not attempts:
+        del _login_failures[key]
+        return 0
+    return len(attempts)
+
+def login_throttled(username, ip):
+    now = time.monotonic()
+    with _login_failures_lock:
+        return (_recent_failures(('user', username), now) >= app.config['LOGIN_MAX_PER_USER'] or
+                _recent_failures(('ip', ip), now) >= app.config['LOGIN_MAX_PER_IP'])
+
+def record_login_failure(username, ip):
+    now = time.monotonic()
+    with _login_failures_lock:
+        if len(_login_failures) > app.config['LOGIN_TRACK_MAX']:
+            # Claves sin intentos recientes (p. ej. usuarios inventados): se descartan de una vez
+            for stale in [k for k, attempts in _login_failures.items()
+                          if not attempts or attempts[-1] <= now - app.config['LOGIN_WINDOW']]:
+                del _login_failures[stale]
+        for key in (('user', username), ('ip', ip)):
+            _login_failures.setdefault(key, deque()).append(now)
+
+def clear_login_failures(username):
+    with _login_failures_lock:
+        _login_failures.pop(('user', username), None)
+
+# ---------------------- TAREAS PROGRAMADAS ----------------------
+# Un hilo por proceso revisa las tareas registradas con @scheduled_job. Antes
+# de ejecutar una tarea en una sucursal toma un "lease" en scheduler_state
+# por la duración del intervalo: con varios workers solo uno la ejecuta.
+# holder indica quién la está ejecutando y vuelve a NULL al terminar; así
+# run-job puede tomar el lease de una tarea que ya corrió, pero no de una en curso.
+SCHEDULED_JOBS = {}
+_scheduler_thread = None
+_scheduler_lock = threading.Lock()
+SCHEDULER_HOLDER = f'{socket.gethostname()}:{os.getpid()}'
+
+def scheduled_job(name, interval_key):
+    """Registrar fn(db) para ejecutarse cada app.config[interval_key] segundos"""
+    def decorator(fn):
+        SCHEDULED_JOBS[name] = (interval_key, fn)
+        return fn
+    return decorator
+
+def _acquire_lease(db, name, seconds, if_idle=False):
+    """Tomar el lease si venció; con if_idle también si nadie está ejecutando la tarea"""
+    now = datetime.utcnow()
+    with db:
+        cur = db.execute(
+            'INSERT INTO scheduler_state (name, lease_until, holder) VALUES (?,?,?) '
+            'ON CONFLICT(name) DO UPDATE SET lease_until=excluded.lease_until, holder=excluded.holder '
+            'WHERE scheduler_state.lease_until IS NULL OR scheduler_state.lease_until <= ? '
+            'OR (? AND scheduler_state.holder IS NULL)',
+            (name, (now + timedelta(seconds=seconds)).isoformat(), SCHEDULER_HOLDER, now.isoformat(), if_idle))
+    return cur.rowcount == 1
+
+def run_scheduled_job(name, db):
+    """Ejecutar una tarea y guardar su resultado y duración en scheduler_state"""
+    _, fn = SCHEDULED_JOBS[name]
+    started = time.monotonic()
+    try:
+        result = fn(db)
+    except Exception as e:
+        db.rollback()
+        result = {'error': str(e)}
+        app.logger.exception('Falló la tarea programada %s', name)
+    with db:
+        db.execute('INSERT INTO scheduler_state (name) VALUES (?) ON CONFLICT(name) DO NOTHING', (name,))
+        db.execute('UPDATE scheduler_state SET last_run_at=?, last_duration=?, last_result=?, holder=NULL '
+                   'WHERE name=?',
+                   (datetime.utcnow().isoformat(), time.monotonic() - started,
+                    json.dumps(result, ensure_ascii=False, default=str), name))
+    return result
+
+def _scheduler_loop():
+    next_run = {}
+    while True:
+        for name, (interval_key, _) in list(SCHEDULED_JOBS.items()):
+            interval = app.config[interval_key]
+            if interval <= 0:
+                continue
+            for branch, path in get_branches().items():
+                if next_run.get((name, branch), 0) > time.monotonic():
+                    continue
+                next_run[(name, branch)] = time.monotonic() + interval
+                try:
+                    with app.app_context():
+                        db = connect_db(path)
+                        try:
+                            if _acquire_lease(db, name, interval):
+                                run_scheduled_job(name, db)
+                        finally:
+                            db.close()
+                except Exception:
+                    app.logger.exception('Planificador: error en %s (%s)', name, branch)
+        time.sleep(1)
+
+def start_scheduler():
+    global _scheduler_thread
+    with _scheduler_lock:
+        if _scheduler_thread is None:
+            _scheduler_thread = threading.Thread(target=_scheduler_loop, name='scheduler', daemon=True)
+            _scheduler_thread.start()
+
+@app.cli.command('run-job')
+@click.argument('name')
+def run_job_command(name):
+    """Ejecutar una tarea programada ahora en todas las sucursales (salvo donde ya está en curso)"""
+    if name not in SCHEDULED_JOBS:
+        raise click.BadParameter(f'Tareas disponibles: {", ".join(sorted(SCHEDULED_JOBS))}')
+    interval = app.config[SCHEDULED_JOBS[name][0]]
+    for branch, path in get_branches().items():
+        db = connect_db(path)
+        try:
+            if not _acquire_lease(db, name, interval if interval > 0 else 3600, if_idle=True):
+                holder = db.execute('SELECT holder FROM scheduler_state WHERE name=?', (name,)).fetchone()[0]
+                print(f'[{branch}] {name}: en ejecución por {holder}, se omite')
+                continue
+            result = run_scheduled_job(name, db)
+        finally:
+            db.close()
+        print(f'[{branch}] {name}: {json.dumps(result, ensure_ascii=False, default=str)}')
+
+# Órdenes vencidas: pendientes cuya delivery_date ya pasó. Cada pasada recorre
+# el índice parcial de pendientes sin marcar (idx_orders_overdue_pending) hasta
+# hoy, así encuentra también órdenes creadas con una fecha ya pasada y nunca
+# vuelve a leer las ya marcadas. Hoy es la fecha UTC, como overdue_at.
+@scheduled_job('overdue_sweep', 'OVERDUE_SWEEP_INTERVAL')
+def sweep_overdue_orders(db):
+    today = datetime.utcnow().date().isoformat()
+    ids = [r['id'] for r in db.execute(
+        "SELECT id FROM orders INDEXED BY idx_orders_overdue_pending "
+        "WHERE status='pendiente' AND overdue_at IS NULL AND delivery_date < ?", (today,))]
+    now = datetime.utcnow().isoformat()
+    with db:
+        for start in range(0, len(ids), 500):
+            batch = ids[start:start + 500]
+            marks = ','.join('?' * len(batch))
+            db.execute(f'UPDATE orders SET overdue_at=? WHERE id IN ({marks})', (now, *batch))
+            if app.config['OVERDUE_NOTIFY']:
+                db.execute(f"INSERT OR IGNORE INTO notification_queue (order_id, kind, created_at) "
+                           f"SELECT id, 'overdue', ? FROM orders WHERE id IN ({marks}) AND client_id IS NOT NULL",
+                           (now, *batch))
+    return {'marked': len(ids), 'before': today}
+
+@scheduled_job('notifications', 'NOTIFY_INTERVAL')
+def send_queued_notifications(db):
+    """Enviar en lote los avisos encolados (hasta NOTIFY_BATCH por pasada)"""
+    pending = db.execute("SELECT id, order_id, kind, channel FROM notification_queue WHERE status='pendiente' "
+                         "ORDER BY id LIMIT ?", (app.config['NOTIFY_BATCH'],)).fetchall()
+    if pending and get_twilio_client() is None:
+        return {'pending': len(pending), 'sent': 0, 'error': 'Twilio no configurado'}
+    sent = failed = 0
+    for n in pending:
+        try:
+            send_notification(n['order_id'], n['channel'], n['kind'], db=db)
+            status, error = 'enviado', None
+            sent += 1
+        except Exception as e:
+            status, error = 'error', str(e)
+            failed += 1
+        with db:
+            db.execute('UPDATE notification_queue SET status=?, error=?, sent_at=? WHERE id=?',
+                       (status, error, datetime.utcnow().isoformat(), n['id']))
+    return {'sent': sent, 'failed': failed}
+
+# ---------------------- RESPALDOS INCREMENTALES ----------------------
+# Cada archivo SQLite (sucursal y su archivo frío) se respalda en cadenas: una
+# copia base y luego deltas con solo las páginas que cambiaron. En cada pasada
+# se hace una copia consistente con la API de backup (las escrituras siguen),
+# se compara un hash por página con el último estado de la cadena y se guardan
+# comprimidas las páginas distintas. La API de backup conserva la numeración de
+# páginas, por eso restaurar a una hora es copiar la base y aplicar sus deltas
+# hasta esa hora. La resolución es BACKUP_INTERVAL.
+#
+#   BACKUP_DIR/<base>-<hash de la ruta>/chain-<hora>/base.db, delta-<hora>.gz, hashes.bin, manifest.jsonl
+PAGE_HASH_SIZE = 16
+BACKUP_READ_PAGES = 256
+
+def _backup_stamp(moment):
+    return moment.strftime('%Y%m%dT%H%M%S%f')
+
+def _page_size(path):
+    with open(path, 'rb') as f:
+        size = struct.unpack('>H', f.read(100)[16:18])[0]
+    return 65536 if size == 1 else size
+
+def _iter_pages(path, page_size):
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(page_size * BACKUP_READ_PAGES)
+            if not chunk:
+                return
+            view = memoryview(chunk)
+            for offset in range(0, len(chunk), page_size):
+                yield view[offset:offset + page_size]
+
+def _snapshot_sqlite(src_path, dest_path):
+    if os.path.exists(dest_path):
+        os.remove(dest_path)
+    src = sqlite3.connect(src_path, timeout=10)
+    dst = sqlite3.connect(dest_path)
+    try:
+        src.backup(dst, pages=app.config['REPLICA_PAGES_PER_STEP'], sleep=0.005)
+        dst.execute('PRAGMA journal_mode=DELETE')  # lo restaurado abre sin -wal/-shm
+    finally:
+        dst.close()
+        src.close()
+
+def _read_manifest(chain_dir):
+    with open(os.path.join(chain_dir, 'manifest.jsonl')) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def _append_manifest(chain_dir, entry):
+    with open(os.path.join(chain_dir, 'manifest.jsonl'), 'a') as f:
+        f.write(json.dumps(entry) + '\n')
+
+def _chains(target_dir):
+    return sorted(glob.glob(os.path.join(target_dir, 'chain-*')))
+
+def _write_hashes(chain_dir, hashes):
+    path = os.path.join(chain_dir, 'hashes.bin')
+    with open(path + '.tmp', 'wb') as f:
+        f.write(hashes)
+    os.replace(path + '.tmp', path)
+
+def _start_chain(work, target_dir, now, page_size):
+    chain_dir = os.path.join(target_dir, f'chain-{_backup_stamp(now)}')
+    os.makedirs(chain_dir)
+    base = os.path.join(chain_dir, 'base.db')
+    os.replace(work, base)
+    hashes = bytearray()
+    for page in _iter_pages(base, page_size):
+        hashes += hashlib.blake2b(page, digest_size=PAGE_HASH_SIZE).digest()
+    page_count = len(hashes) // PAGE_HASH_SIZE
+    _write_hashes(chain_dir, hashes)
+    _append_manifest(chain_dir, {'kind': 'base', 'file': 'base.db', 'taken_at': now.isoformat(),
+                                 'page_size': page_size, 'page_count': page_count, 'pages': page_count})
+    return {'kind': 'base', 'pages': page_count}
+
+def _append_delta(work, chain_dir, now, page_size):
+    with open(os.path.join(chain_dir, 'hashes.bin'), 'rb') as f:
+        old = f.read()
+    hashes = bytearray()
+    changed = 0
+    name = f'delta-{_backup_stamp(now)}.gz'
+    tmp = os.path.join(chain_dir, name + '.tmp')
+    # Registro por página: número (4 bytes) + contenido; gzip nivel 1 para no frenar
+    with gzip.open(tmp, 'wb', compresslevel=1) as out:
+        for n, page in enumerate(_iter_pages(work, page_size)):
+            digest = hashlib.blake2b(page, digest_size=PAGE_HASH_SIZE).digest()
+            hashes += digest
+            if old[n * PAGE_HASH_SIZE:(n + 1) * PAGE_HASH_SIZE] != digest:
+                out.write(struct.pack('>I', n))
+                out.write(page)
+                changed += 1
+    os.replace(tmp, os.path.join(chain_dir, name))
+    _write_hashes(chain_dir, hashes)
+    _append_manifest(chain_dir, {'kind': 'delta', 'file': name, 'taken_at': now.isoformat(),
+                                 'page_count': len(hashes) // PAGE_HASH_SIZE, 'pages': changed})
+    os.remove(work)
+    return {'kind': 'delta', 'pages': changed}
+
+def backup_database(src_path, target_dir, force_base=False):
+    """Agregar un punto de respaldo de src_path en target_dir (base o delta)"""
+    os.makedirs(target_dir, exist_ok=True)
+    lock = _try_lock(os.path.join(target_dir, '.lock'))
+    if lock is None:
+        return {'skipped': 'otro respaldo en curso'}
+    try:
+        now = datetime.utcnow()
+        work = os.path.join(target_dir, '.work.db')
+        _snapshot_sqlite(src_path, work)
+        page_size = _page_size(work)
+        chains = _chains(target_dir)
+        manifest = _read_manifest(chains[-1]) if chains else []
+        # Cadena nueva si no hay, si cambió el tamaño de página o si los deltas ya
+        # suman más que media base (restaurar seguiría siendo rápido)
+        if (force_base or not manifest or manifest[0]['page_size'] != page_size
+                or len(manifest) > app.config['BACKUP_DELTAS_PER_BASE']
+                or sum(e['pages'] for e in manifest[1:]) > manifest[0]['page_count'] // 2):
+            result = _start_chain(work, target_dir, now, page_size)
+            for old_chain in _chains(target_dir)[:-app.config['BACKUP_KEEP_CHAINS']]:
+                shutil.rmtree(old_chain)
+        else:
+            result = _append_delta(work, chains[-1], now, page_size)
+        return result
+    finally:
+        _unlock(lock)
+
+def backup_dir_for(db_path):
+    # Nombre del archivo más un hash de la ruta absoluta: dos sucursales con el
+    # mismo nombre de archivo en carpetas distintas no comparten (ni rotan) respaldos
+    path = os.path.abspath(db_path)
+    name = os.path.splitext(os.path.basename(path))[0]
+    return os.path.join(app.config['BACKUP_DIR'], f'{name}-{hashlib.sha1(path.encode()).hexdigest()[:8]}')
+
+@scheduled_job('incremental_backup', 'BACKUP_INTERVAL')
+def incremental_backup(db):
+    files = {row[1]: row[2] for row in db.execute('PRAGMA database_list')}
+    return {name: backup_database(files[name], backup_dir_for(files[name]))
+            for name in ('main', 'archive') if files.get(name)}
+
+def restore_database(target_dir, at, out_path):
+    """Reconstruir en out_path la base tal como estaba en `at` (ISO UTC); devuelve la hora del punto usado"""
+    chains = [c for c in _chains(target_dir) if _read_manifest(c)[0]['taken_at'] <= at]
+    if not chains:
+        raise ValueError(f'No hay respaldos anteriores a {at} en {target_dir}')
+    manifest = _read_manifest(chains[-1])
+    page_size = manifest[0]['page_size']
+    tmp = out_path + '.tmp'
+    shutil.copyfile(os.path.join(chains[-1], 'base.db'), tmp)
+    last = manifest[0]
+    with open(tmp, 'r+b') as f:
+        for entry in manifest[1:]:
+            if entry['taken_at'] > at:
+                break
+            with gzip.open(os.path.join(chains[-1], entry['file']), 'rb') as delta:
+                while True:
+                    head = delta.read(4)
+                    if not head:
+                        break
+                    f.seek(struct.unpack('>I', head)[0] * page_size)
+                    f.write(delta.read(page_size))
+            last = entry
+        f.truncate(last['page_count'] * page_size)
+    check = sqlite3.connect(tmp)
+    try:
+        status = check.execute('PRAGMA quick_check').fetchone()[0]
+    finally:
+        check.close()
+    if status != 'ok':
+        os.remove(tmp)
+        raise RuntimeError(f'La base restaurada no pasó quick_check: {status}')
+    os.replace(tmp, out_path)
+    return last['taken_at']
+
+@app.cli.command('backup')
+@click.option('--base', is_flag=True, help='Empezar una cadena nueva con una copia completa')
+def backup_command(base):
+    """Tomar ahora un punto de respaldo incremental de cada sucursal"""
+    for branch, path in get_branches().items():
+        for src in (path, archive_path_for(path)):
+            if not os.path.exists(src):
+                continue
+            started = time.monotonic()
+            result = backup_database(src, backup_dir_for(src), force_base=base)
+            print(f'[{branch}] {os.path.basename(src)}: {result} en {time.monotonic() - started:.2f} s')
+
+@app.cli.command('restore')
+@click.option('--at', 'at', default=None, help='Hora UTC ISO (p. ej. 2024-05-01T18:30); por defecto el último punto')
+@click.option('--out', 'out_dir', required=True, help='Carpeta donde escribir las bases restauradas')
+@click.option('--branch', default=None, help='Sucursal (por defecto la principal)')
+def restore_command(at, out_dir, branch):
+    """Reconstruir una sucursal (y su archivo) tal como estaba a una hora dada"""
+    at = at or datetime.utcnow().isoformat()
+    branch = branch or next(iter(get_branches()))
+    if branch not in get_branches():
+        raise click.BadParameter(f'Sucursal desconocida: {branch}')
+    os.makedirs(out_dir, exist_ok=True)
+    path = get_branches()[branch]
+    for src in (path, archive_path_for(path)):
+        name = os.path.basename(src)
+        target = backup_dir_for(src)
+        legacy = os.path.join(app.config['BACKUP_DIR'], os.path.splitext(name)[0])
+        if not _chains(target) and _chains(legacy):
+            target = legacy  # respaldos anteriores, guardados solo por nombre de archivo
+        if not _chains(target):
+            print(f'[{branch}] {name}: sin respaldos')
+            continue
+        started = time.monotonic()
+        point = restore_database(target, at, os.path.join(out_dir, name))
+        print(f'[{branch}] {name}: restaurada al punto {point} en {time.monotonic() - started:.2f} s')
+
+# ---------------------- MANTENIMIENTO ----------------------
+# Estadísticas del planificador (optimize/ANALYZE), auto_vacuum incremental y
+# quick_check como tareas programadas. Ninguna toma el bloqueo de escritura
+# por mucho tiempo: el vacuum libera pocas páginas por transacción, solo si
+# no hubo cambios en MAINT_IDLE_SECONDS y con un tope de tiempo por pasada.
+# Los resultados quedan en scheduler_state y se ven en /admin/maintenance.
+MAINTENANCE_JOBS = ('optimize', 'analyze', 'incremental_vacuum', 'quick_check')
+
+def enable_incremental_vacuum(db):
+    """auto_vacuum solo cambia con la base vacía o tras un VACUUM completo (una vez, en init-db)"""
+    if db.execute('PRAGMA main.auto_vacuum').fetchone()[0] != 2:
+        db.commit()
+        db.execute('PRAGMA main.auto_vacuum = INCREMENTAL')
+        db.execute('VACUUM main')
+
+def db_is_idle(db):
+    last = db.execute('SELECT changed_at FROM change_log ORDER BY seq DESC LIMIT 1').fetchone()
+    cutoff = (datetime.utcnow() - timedelta(seconds=app.config['MAINT_IDLE_SECONDS'])).isoformat()
+    return last is None or last[0] < cutoff
+
+@scheduled_job('optimize', 'MAINT_OPTIMIZE_INTERVAL')
+def optimize_db(db):
+    # optimize solo vuelve a analizar las tablas que lo necesitan
+    db.execute(f'PRAGMA analysis_limit = {app.config["MAINT_ANALYSIS_LIMIT"]}')
+    db.execute('PRAGMA optimize')
+    return {'ok': True}
+
+@scheduled_job('analyze', 'MAINT_ANALYZE_INTERVAL')
+def analyze_db(db):
+    # analysis_limit acota las filas leídas por índice: ANALYZE tarda lo mismo con la base grande
+    db.execute(f'PRAGMA analysis_limit = {app.config["MAINT_ANALYSIS_LIMIT"]}')
+    db.execute('ANALYZE')
+    db.commit()
+    return {'indexes': db.execute('SELECT COUNT(*) FROM main.sqlite_stat1').fetchone()[0]}
+
+@scheduled_job('incremental_vacuum', 'MAINT_VACUUM_INTERVAL')
+def incremental_vacuum_db(db):
+    if db.execute('PRAGMA main.auto_vacuum').fetchone()[0] != 2:
+        return {'skipped': 'auto_vacuum no es INCREMENTAL (ejecuta init-db)'}
+    free = db.execute('PRAGMA main.freelist_count').fetchone()[0]
+    freed = 0
+    deadline = time.monotonic() + app.config['MAINT_VACUUM_BUDGET']
+    while free and time.monotonic() < deadline:
+        if not db_is_idle(db):
+            return {'freed': freed, 'free_pages': free, 'stopped': 'hay actividad'}
+        # Con execute() sqlite3 da un solo paso y libera una página; executescript corre hasta el final
+        db.executescript(f'PRAGMA main.incremental_vacuum({app.config["MAINT_VACUUM_PAGES"]});')
+        remaining = db.execute('PRAGMA main.freelist_count').fetchone()[0]
+        freed, free = freed + free - remaining, remaining
+        time.sleep(0.05)  # deja pasar a la caja entre lotes
+    return {'freed': freed, 'free_pages': free}
+
+@scheduled_job('quick_check', 'MAINT_CHECK_INTERVAL')
+def quick_check_db(db):
+    problems = [r[0] for r in db.execute('PRAGMA quick_check(20)')]
+    if problems != ['ok']:
+        app.logger.error('quick_check encontró problemas: %s', problems)
+        return {'ok': False, 'problems': problems}
+    return {'ok': True}
+
+def maintenance_status(branch):
+    """Estado de las tareas programadas y del archivo de una sucursal"""
+    db = connect_db(branch_db_path(branch))
+    try:
+        jobs = {r['name']: dict(r) for r in db.execute('SELECT * FROM scheduler_state ORDER BY name')}
+        for job in jobs.values():
+            job['last_result'] = json.loads(job['last_result']) if job['last_result'] else None
+        page_size = db.execute('PRAGMA main.page_size').fetchone()[0]
+        stats = {
+            'page_count': db.execute('PRAGMA main.page_count').fetchone()[0],
+            'free_pages': db.execute('PRAGMA main.freelist_count').fetchone()[0],
+            'auto_vacuum': {0: 'NONE', 1: 'FULL', 2: 'INCREMENTAL'}[db.execute('PRAGMA main.auto_vacuum').fetchone()[0]],
+        }
+    finally:
+        db.close()
+    stats['size_mb'] = stats['page_count'] * page_size / 2**20
+    stats['free_mb'] = stats['free_pages'] * page_size / 2**20
+    return jobs, stats
+
+# ---------------------- IDEMPOTENCIA ----------------------
+# El formulario de nueva orden lleva una clave única (idempotency_key). Se
+# reserva en la misma transacción que crea la orden: un doble clic o un
+# reintento del navegador espera al primero (bloqueo de escritura de SQLite)
+# y luego encuentra la clave ya usada, sin repetir las escrituras.
+def new_idempotency_key():
+    return uuid.uuid4().hex
+
+def claim_idempotency_key(db, key):
+    """Reservar la clave; devuelve None si es nueva o la fila previa si ya se usó"""
+    now = datetime.utcnow()
+    expires = now + timedelta(seconds=app.config['IDEMPOTENCY_TTL'])
+    cur = db.execute(
+        'INSERT INTO idempotency_keys (key, created_at, expires_at) VALUES (?,?,?) '
+        'ON CONFLICT(key) DO UPDATE SET order_id=NULL, created_at=excluded.created_at, '
+        'expires_at=excluded.expires_at WHERE idempotency_keys.expires_at <= ?',
+        (key, now.isoformat(), expires.isoformat(), now.isoformat()))
+    if cur.rowcount:
+        return None
+    return db.execute('SELECT k.order_id, o.order_number FROM idempotency_keys k '
+                      'LEFT JOIN orders o ON o.id = k.order_id WHERE k.key=?', (key,)).fetchone()
+
+def complete_idempotency_key(db, key, order_id):
+    db.execute('UPDATE idempotency_keys SET order_id=? WHERE key=?', (order_id, key))
+
+@scheduled_job('idempotency_purge', 'IDEMPOTENCY_PURGE_INTERVAL')
+def purge_idempotency_keys(db):
+    with db:
+        cur = db.execute('DELETE FROM idempotency_keys WHERE expires_at <= ?', (datetime.utcnow().isoformat(),))
+    return {'deleted': cur.rowcount}
+
+# ---------------------- LÍMITES DE CONCURRENCIA ----------------------
+# Recibos PDF, exportaciones y respaldos consumen mucha CPU y memoria. Cada
+# grupo tiene N cupos compartidos por todos los workers: un archivo de bloqueo
+# por cupo (flock), que el sistema libera aunque el proceso muera. Quien no
+# consigue cupo toma un turno en una cola acotada (también de archivos) y
+# espera hasta LIMIT_WAIT segundos. Cola llena -> 429, espera agotada -> 503,
+# ambos con Retry-After.
+try:
+    import fcntl
+except ImportError:  # sin flock (Windows) los cupos quedan por proceso
+    fcntl = None
+
+class ConcurrencyLimited(RuntimeError):
+    def __init__(self, group, status):
+        super().__init__(f'Límite de concurrencia alcanzado en {group}')
+        self.group = group
+        self.status = status
+
+EXPORT_LIMIT_GROUPS = {'orders_csv': 'export', 'orders_xlsx': 'export', 'orders_parquet': 'export',
+                       'backup_zip': 'backup'}
+_local_locks = {}
+_local_locks_guard = threading.Lock()
+
+def _lock_paths(group, kind, count):
+    return [os.path.join(app.config['LIMIT_DIR'], f'{group}.{kind}{i}.lock') for i in range(count)]
+
+def _try_lock(path):
+    if fcntl is None:
+        with _local_locks_guard:
+            lock = _local_locks.setdefault(path, threading.Lock())
+        return lock if lock.acquire(blocking=False) else None
+    f = open(path, 'a')
+    try:
+        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        f.close()
+        return None
+    return f
+
+def _unlock(handle):
+    if fcntl is None:
+        handle.release()
+    else:
+        handle.close()  # cerrar el descriptor libera el flock
+
+def _lock_any(paths):
+    for path in paths:
+        handle = _try_lock(path)
+        if handle is not None:
+            return handle
+    return None
+
+def _limits_db():
+    os.makedirs(app.config['LIMIT_DIR'], exist_ok=True)
+    db = sqlite3.connect(os.path.join(app.config['LIMIT_DIR'], 'limits.db'), timeout=1)
+    db.execute('CREATE TABLE IF NOT EXISTS limit_counters (grp TEXT, event TEXT, n INTEGER NOT NULL DEFAULT 0, '
+               'PRIMARY KEY (grp, event))')
+    return db
+
+def _count_limit_event(group, event):
+    # Contadores acumulados de todos los workers; si la escritura falla se pierde la muestra
+    try:
+        db = _limits_db()
+        try:
+            with db:
+                db.execute('INSERT INTO limit_counters (grp, event, n) VALUES (?,?,1) '
+                           'ON CONFLICT(grp, event) DO UPDATE SET n = n + 1', (group, event))
+        finally:
+            db.close()
+    except sqlite3.Error:
+        app.logger.warning('No se pudo registrar la métrica %s/%s', group, event)
+
+@contextmanager
+def concurrency_slot(group, background=False, heartbeat=None):
+    """Ocupar un cupo del grupo; las tareas en segundo plano esperan sin límite y sin turno.
+
+    heartbeat, si se da, se llama en cada vuelta de la espera.
+    """
+    os.makedirs(app.config['LIMIT_DIR'], exist_ok=True)
+    slots = _lock_paths(group, 'slot', app.config['CONCURRENCY_LIMITS'][group])
+    held = _lock_any(slots)
+    if held is None:
+        ticket = None
+        if not background:
+            ticket = _lock_any(_lock_paths(group, 'queue', app.config['LIMIT_QUEUE']))
+            if ticket is None:
+                _count_limit_event(group, 'rejected_full')
+                raise ConcurrencyLimited(group, 429)
+            _count_limit_event(group, 'queued')
+        deadline = time.monotonic() + app.config['LIMIT_WAIT']
+        delay = 0.02
+        try:
+            while held is None:
+                if not background and time.monotonic() >= deadline:
+                    _count_limit_event(group, 'rejected_timeout')
+                    raise ConcurrencyLimited(group, 503)
+                if heartbeat is not None:
+                    heartbeat()
+                time.sleep(delay)
+                delay = min(delay * 2, 0.25)
+                held = _lock_any(slots)
+        finally:
+            if ticket is not None:
+                _unlock(ticket)
+    _count_limit_event(group, 'admitted')
+    try:
+        yield
+    finally:
+        _unlock(held)
+
+def limit_concurrency(group):
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            with concurrency_slot(group):
+                return f(*args, **kwargs)
+        return decorated_function
+    return decorator
+
+@app.errorhandler(ConcurrencyLimited)
+def concurrency_limited(e):
+    message = ('Hay demasiadas descargas en curso. Intente de nuevo en unos segundos.' if e.status == 429
+               else 'El servidor sigue ocupado con otros documentos. Intente de nuevo en unos segundos.')
+    return Response(message, status=e.status, mimetype='text/plain',
+                    headers={'Retry-After': str(app.config['LIMIT_RETRY_AFTER'])})
+
+def _locks_held(paths):
+    # Sondea cada archivo: si se puede bloquear está libre y se suelta al instante
+    held = 0
+    for path in paths:
+        handle = _try_lock(path)
+        if handle is None:
+            held += 1
+        else:
+            _unlock(handle)
+    return held
+
+def concurrency_metrics():
+    """Cupos ocupados, profundidad de cola y contadores por grupo"""
+    try:
+        db = _limits_db()
+        try:
+            counters = db.execute('SELECT grp, event, n FROM limit_counters').fetchall()
+        finally:
+            db.close()
+    except sqlite3.Error:
+        counters = []
+    metrics = {}
+    for group, limit in app.config['CONCURRENCY_LIMITS'].items():
+        metrics[group] = {
+            'limit': limit,
+            'active': _locks_held(_lock_paths(group, 'slot', limit)),
+            'queue_size': app.config['LIMIT_QUEUE'],
+            'queue_depth': _locks_held(_lock_paths(group, 'queue', app.config['LIMIT_QUEUE'])),
+            'admitted': 0, 'queued': 0, 'rejected_full': 0, 'rejected_timeout': 0,
+        }
+    for group, event, n in counters:
+        if group in metrics:
+            metrics[group][event] = n
+    return metrics
+
 # ---------------------- AUTENTICACIÓN ----------------------
 def login_required(f):
     @wraps(f)
@@ -247,18 +1961,52 @@ def login():
     if request.method == 'POST':
         username = request.form['username']
         password = request.form['password']
+        ip = request.remote_addr or '-'
+        branch = request.form.get('branch')
+        if branch not in get_branches():
+            branch = current_branch()
+        elif branch != current_branch():
+            # Las sucursales tienen usuarios propios: validar contra su base.
+            # La sesión cambia de sucursal solo si el login es correcto
+            previous_db = g.pop('_database', None)
+            if previous_db is not None:
+                previous_db.close()
+            g._database = connect_db(branch_db_path(branch))
+        if login_throttled(username, ip):
+            flash('Demasiados intentos fallidos. Espera unos minutos e intenta de nuevo', 'danger')
+            return render_page(LOGIN_TEMPLATE, branches=get_branches()), 429
         db = get_db()
         cur = db.cursor()
         cur.execute('SELECT * FROM users WHERE username=?', (username,))
         user = cur.fetchone()
-        if user and check_password_hash(user['password_hash'], password):
+        try:
+            if user is None:
+                verify_password(_dummy_hash(app.config['PASSWORD_HASH_METHOD']), password)
+                valid = False
+            else:
+                valid = verify_password(user['password_hash'], password)
+        except HashPoolBusy:
+            flash('El servidor está ocupado, intenta de nuevo en unos segundos', 'warning')
+            return render_page(LOGIN_TEMPLATE, branches=get_branches()), 503
+        if valid:
+            clear_login_failures(username)
+            if password_needs_rehash(user['password_hash']):
+                # Parámetros de hash cambiados: actualizar el hash guardado
+                try:
+                    new_hash = _run_in_hash_pool(hash_password, password)
+                    cur.execute('UPDATE users SET password_hash=? WHERE id=?', (new_hash, user['id']))
+                    db.commit()
+                except HashPoolBusy:
+                    pass  # se reintenta en el próximo login
+            session['branch'] = branch
             session['user_id'] = user['id']
             session['username'] = user['username']
             session['user_role'] = user['role']
             flash('Sesión iniciada correctamente', 'success')
             return redirect(url_for('index'))
+        record_login_failure(username, ip)
         flash('Usuario o contraseña incorrectos', 'danger')
-    return render_template_string(LOGIN_TEMPLATE)
+    return render_page(LOGIN_TEMPLATE, branches=get_branches())
 
 @app.route('/logout')
 def logout():
@@ -271,22 +2019,64 @@ def logout():
 @login_required
 def index():
     db = get_db()
-    cur = db.cursor()
-    cur.execute("SELECT o.*, c.name as client_name FROM orders o LEFT JOIN clients c ON o.client_id=c.id ORDER BY o.created_at DESC LIMIT 20")
-    orders = cur.fetchall()
-    cur.execute('SELECT * FROM inventory WHERE qty <= low_threshold')
-    low_items = cur.fetchall()
-    return render_template_string(INDEX_TEMPLATE, orders=orders, low_items=low_items)
+    orders = orders_repo.recent.all(db, 20)
+    low_items = inventory_repo.low.all(db)
+    return render_page(INDEX_TEMPLATE, orders=orders, low_items=low_items)
 
 # ---------------------- CLIENTES ----------------------
+# Métricas por cliente (órdenes, total gastado, ticket promedio, última orden)
+# guardadas en la propia fila de clients. new_order las actualiza en la misma
+# transacción que crea la orden; archivar órdenes no las toca porque siguen
+# contando en la vida del cliente. rebuild-client-metrics las recalcula.
+CLIENT_SORTS = {
+    'name': 'name',
+    'orders': 'order_count DESC',
+    'spent': 'total_spent DESC',
+    'avg': 'avg_ticket DESC',
+    'last': 'last_order_at DESC',
+}
+
+def record_client_order(db, client_id, total, created_at):
+    if client_id is None:
+        return
+    db.execute('UPDATE clients SET order_count = order_count + 1, total_spent = total_spent + ?, '
+               'avg_ticket = (total_spent + ?) / (order_count + 1), '
+               'last_order_at = MAX(COALESCE(last_order_at, \'\'), ?) WHERE id=?',
+               (total, total, created_at, client_id))
+
+def rebuild_client_metrics(db):
+    """Recalcular las métricas de todos los clientes desde las órdenes (vivas y archivadas)"""
+    with db:
+        db.execute('UPDATE clients SET order_count=0, total_spent=0, avg_ticket=0, last_order_at=NULL')
+        db.execute("""UPDATE clients SET order_count=m.n, total_spent=m.spent, avg_ticket=m.spent / m.n,
+                          last_order_at=m.last
+                      FROM (SELECT client_id, COUNT(*) as n, COALESCE(SUM(total), 0) as spent,
+                                   MAX(created_at) as last
+                            FROM all_orders WHERE client_id IS NOT NULL GROUP BY client_id) AS m
+                      WHERE clients.id = m.client_id""")
+
+@app.cli.command('rebuild-client-metrics')
+def rebuild_client_metrics_command():
+    """Recalcular las métricas de clientes desde cero"""
+    for branch, path in get_branches().items():
+        db = connect_db(path)
+        try:
+            rebuild_client_metrics(db)
+        finally:
+            db.close()
+        print(f'[{branch}] métricas de clientes recalculadas')
+
 @app.route('/clients')
 @login_required
 def clients():
-    db = get_db()
-    cur = db.cursor()
-    cur.execute('SELECT * FROM clients ORDER BY name')
-    clients_list = cur.fetchall()
-    return render_template_string(CLIENTS_TEMPLATE, clients=clients_list)
+    sort = request.args.get('sort', 'name')
+    if sort not in CLIENT_SORTS:
+        sort = 'name'
+    min_orders = request.args.get('min_orders', type=int)
+    min_spent = request.args.get('min_spent', type=float)
+    clients_list = clients_repo.list(get_db(), CLIENT_SORTS[sort], min_orders=min_orders, min_spent=min_spent)
+    return render_page(CLIENTS_TEMPLATE, clients=clients_list, sort=sort,
+                       min_orders=min_orders, min_spent=min_spent)
 
 @app.route('/clients/new', methods=['GET','POST'])
 @login_required
@@ -307,28 +2097,26 @@ def new_client():
             return redirect(url_for('clients'))
         except sqlite3.IntegrityError:
             flash('Error: El teléfono ya existe', 'danger')
-    return render_template_string(NEW_CLIENT_TEMPLATE)
+    return render_page(NEW_CLIENT_TEMPLATE)
 
 @app.route('/clients/<int:client_id>')
 @login_required
 def client_detail(client_id):
     db = get_db()
-    cur = db.cursor()
-    cur.execute('SELECT * FROM clients WHERE id=?', (client_id,))
-    client = cur.fetchone()
-    cur.execute('SELECT * FROM orders WHERE client_id=? ORDER BY created_at DESC', (client_id,))
-    orders = cur.fetchall()
-    return render_template_string(CLIENT_DETAIL_TEMPLATE, client=client, orders=orders)
+    client = clients_repo.by_id.one(db, client_id)
+    if client is None:
+        abort(404)
+    orders = orders_repo.by_client.iter(db, client_id)
+    return stream_page(CLIENT_DETAIL_TEMPLATE, client=client, orders=orders)
 
 # ---------------------- INVENTARIO ----------------------
 @app.route('/inventory')
 @login_required
 def inventory():
     db = get_db()
-    cur = db.cursor()
-    cur.execute('SELECT * FROM inventory ORDER BY name')
-    items = cur.fetchall()
-    return render_template_string(INVENTORY_TEMPLATE, items=items)
+    forecast = forecast_stockouts(db)
+    items = inventory_repo.all.iter(db)
+    return stream_page(INVENTORY_TEMPLATE, items=items, forecast=forecast)
 
 @app.route('/inventory/edit/<int:item_id>', methods=['GET','POST'])
 @admin_required
@@ -336,26 +2124,147 @@ def edit_inventory(item_id):
     db = get_db()
     cur = db.cursor()
     if request.method == 'POST':
-        qty = int(request.form['qty'])
+        qty = float(request.form['qty'])
         low = int(request.form['low_threshold'])
-        cur.execute('UPDATE inventory SET qty=?, low_threshold=? WHERE id=?', (qty, low, item_id))
+        per_order = float(request.form.get('per_order') or 0)
+        cur.execute('UPDATE inventory SET qty=?, low_threshold=?, per_order=? WHERE id=?',
+                    (qty, low, per_order, item_id))
         db.commit()
         log_action('edit_inventory', 'inventory', item_id, session.get('username'))
         flash('Inventario actualizado', 'success')
         return redirect(url_for('inventory'))
-    cur.execute('SELECT * FROM inventory WHERE id=?', (item_id,))
-    item = cur.fetchone()
-    return render_template_string(INVENTORY_EDIT_TEMPLATE, item=item)
+    item = inventory_repo.by_id.one(db, item_id)
+    return render_page(INVENTORY_EDIT_TEMPLATE, item=item)
+
+# ---------------------- CONSUMO DE INSUMOS ----------------------
+# Cada pieza consume insumos según consumption_rates (por prenda) y cada orden
+# según inventory.per_order (bolsas). consume_supplies descuenta el stock y
+# suma el consumo del día en supply_usage dentro de la transacción de
+# new_order: la orden y el descuento se guardan juntos o ninguno. El
+# pronóstico lee supply_usage (un registro por insumo y día), no el
+# historial de órdenes; la migración lo llena una vez desde order_items.
+FORECAST_DAYS = 56
+FORECAST_HORIZON = 365
+# Consumo por defecto en unidades de insumo por kg de ropa (pesos de CARGAS DE LAVADO)
+SUPPLY_PER_KG = {'detergente': 0.02, 'suavizante': 0.015}
+SUPPLY_PER_ORDER = {'bolsas': 1}
+
+def seed_consumption_rates(db, garment_type=None):
+    """Consumos por defecto para los insumos y prendas que no tienen uno (o solo para garment_type)"""
+    if garment_type is None:
+        for name, per_order in SUPPLY_PER_ORDER.items():
+            db.execute('UPDATE inventory SET per_order=? WHERE name=? AND per_order=0', (per_order, name))
+        garments = db.execute('SELECT garment_type, category FROM price_list').fetchall()
+    else:
+        garments = db.execute('SELECT garment_type, category FROM price_list WHERE garment_type=?',
+                              (garment_type,)).fetchall()
+    for name, per_kg in SUPPLY_PER_KG.items():
+        db.executemany('INSERT OR IGNORE INTO consumption_rates (garment_type, inventory_id, per_unit) '
+                       'SELECT ?, id, ? FROM inventory WHERE name=?',
+                       [(garment, round(per_kg * _piece_grams(garment, category) / 1000, 5), name)
+                        for garment, category in garments])
+
+ORDER_USAGE_SQL = """SELECT id, SUM(amount) FROM (
+    SELECT r.inventory_id AS id, r.per_unit * i.quantity AS amount
+    FROM order_items i JOIN consumption_rates r ON r.garment_type = i.garment_type WHERE i.order_id = ?
+    UNION ALL SELECT id, per_order FROM inventory WHERE per_order > 0
+) GROUP BY id"""
+
+ADD_USAGE_SQL = ('INSERT INTO supply_usage (day, inventory_id, used) VALUES (?,?,?) '
+                 'ON CONFLICT (day, inventory_id) DO UPDATE SET used = used + excluded.used')
+
+def consume_supplies(db, order_id, day):
+    """Descontar los insumos de una orden creada en day (AAAA-MM-DD, UTC); no hace commit"""
+    usage = db.execute(ORDER_USAGE_SQL, (order_id,)).fetchall()
+    db.executemany('UPDATE inventory SET qty = qty - ? WHERE id = ?', [(used, inv) for inv, used in usage])
+    db.executemany(ADD_USAGE_SQL, [(day, inv, used) for inv, used in usage])
+
+# Historial completo: se agrupa primero por día y prenda (pocas filas) y
+# recién después se multiplica por los consumos de cada insumo.
+BACKFILL_USAGE_SQL = """INSERT INTO supply_usage (day, inventory_id, used)
+    SELECT day, id, SUM(used) FROM (
+        SELECT g.day, r.inventory_id AS id, r.per_unit * g.qty AS used FROM (
+            SELECT substr(o.created_at, 1, 10) AS day, i.garment_type AS garment, SUM(i.quantity) AS qty
+            FROM orders o JOIN order_items i ON i.order_id = o.id WHERE o.created_at IS NOT NULL GROUP BY 1, 2
+        ) g JOIN consumption_rates r ON r.garment_type = g.garment
+        UNION ALL
+        SELECT d.day, v.id, d.n * v.per_order FROM (
+            SELECT substr(created_at, 1, 10) AS day, COUNT(*) AS n FROM orders
+            WHERE created_at IS NOT NULL GROUP BY 1
+        ) d JOIN inventory v ON v.per_order > 0
+    ) WHERE 1 GROUP BY day, id
+    ON CONFLICT (day, inventory_id) DO UPDATE SET used = excluded.used"""
+
+def backfill_supply_usage(db):
+    db.execute(BACKFILL_USAGE_SQL)
+
+# Regresión lineal del consumo diario, para todos los insumos en una sola
+# consulta: x = días desde ayer (ayer es 0, hacia atrás negativos), y = consumo.
+# Hoy queda fuera porque la jornada está incompleta y bajaría la estimación.
+# Los días sin consumo valen y = 0 y no aportan a Σy ni Σxy; Σx y Σx² de la
+# ventana completa salen en forma cerrada.
+FORECAST_SQL = """SELECT inventory_id, SUM(used), SUM((julianday(day) - julianday(:until)) * used)
+    FROM supply_usage WHERE day >= :since AND day <= :until GROUP BY inventory_id"""
+
+def _days_until_empty(qty, rate, slope):
+    # Consumo acumulado en t días: rate·t + slope·t²/2
+    if qty <= 0:
+        return 0
+    if abs(slope) < 1e-9:
+        return qty / rate if rate > 0 else None
+    disc = rate * rate + 2 * slope * qty
+    if disc < 0:
+        return None  # el consumo llega a cero antes de agotar el insumo
+    t = (-rate + math.sqrt(disc)) / slope
+    return t if t >= 0 else None
+
+def forecast_stockouts(db, today=None):
+    """{id de insumo: {'daily', 'trend', 'date'}} según las últimas FORECAST_DAYS jornadas completas"""
+    today = today or datetime.utcnow().date()
+    n = FORECAST_DAYS
+    until = today - timedelta(days=1)
+    since = (until - timedelta(days=n - 1)).isoformat()
+    sum_x = -n * (n - 1) / 2
+    sum_xx = (n - 1) * n * (2 * n - 1) / 6
+    sums = {row[0]: row[1:] for row in
+            db.execute(FORECAST_SQL, {'until': until.isoformat(), 'since': since})}
+    result = {}
+    for item in inventory_repo.all.iter(db):
+        sum_y, sum_xy = sums.get(item.id, (0, 0))
+        slope = (n * sum_xy - sum_x * sum_y) / (n * sum_xx - sum_x * sum_x)
+        # Recta evaluada en hoy (x = 1)
+        rate = max(0.0, (sum_y - slope * sum_x) / n + slope)
+        days = _days_until_empty(item.qty, rate, slope) if rate > 0 or slope > 0 else None
+        empty_on = today + timedelta(days=int(days)) if days is not None and days <= FORECAST_HORIZON else None
+        result[item.id] = {'daily': rate, 'trend': slope, 'date': empty_on}
+    return result
+
+@app.route('/inventory/<int:item_id>/rates', methods=['GET', 'POST'])
+@admin_required
+def inventory_rates(item_id):
+    db = get_db()
+    item = inventory_repo.by_id.one(db, item_id)
+    if item is None:
+        abort(404)
+    if request.method == 'POST':
+        with db:
+            db.execute('DELETE FROM consumption_rates WHERE inventory_id=?', (item_id,))
+            db.executemany('INSERT INTO consumption_rates (garment_type, inventory_id, per_unit) VALUES (?,?,?)',
+                           [(key[5:], item_id, float(value)) for key, value in request.form.items()
+                            if key.startswith('rate_') and value and float(value) > 0])
+        log_action('edit_consumption_rates', 'inventory', item_id, session.get('username'))
+        flash('Consumo actualizado', 'success')
+        return redirect(url_for('inventory'))
+    rates = dict(db.execute('SELECT garment_type, per_unit FROM consumption_rates WHERE inventory_id=?', (item_id,)))
+    return render_page(INVENTORY_RATES_TEMPLATE, item=item, rates=rates,
+                       garments_by_category=get_garments_by_category())
 
 # ---------------------- PRECIOS ----------------------
 @app.route('/prices')
 @login_required
 def prices():
-    db = get_db()
-    cur = db.cursor()
-    cur.execute('SELECT * FROM price_list ORDER BY category, garment_type')
-    prices_list = cur.fetchall()
-    return render_template_string(PRICES_TEMPLATE, prices=prices_list)
+    prices_list = prices_repo.all.iter(get_db())
+    return stream_page(PRICES_TEMPLATE, prices=prices_list)
 
 @app.route('/prices/edit/<int:pid>', methods=['GET','POST'])
 @admin_required
@@ -372,9 +2281,8 @@ def edit_price(pid):
         log_action('edit_price', 'price_list', pid, session.get('username'))
         flash('Precio actualizado', 'success')
         return redirect(url_for('prices'))
-    cur.execute('SELECT * FROM price_list WHERE id=?', (pid,))
-    price_item = cur.fetchone()
-    return render_template_string(PRICE_EDIT_TEMPLATE, p=price_item)
+    price_item = prices_repo.by_id.one(db, pid)
+    return render_page(PRICE_EDIT_TEMPLATE, p=price_item)
 
 @app.route('/prices/new', methods=['GET','POST'])
 @admin_required
@@ -388,12 +2296,14 @@ def new_price():
         try:
             cur.execute('INSERT INTO price_list (garment_type, price, category) VALUES (?,?,?)',
                         (garment_type, price, category))
+            # Solo la prenda nueva: no repone consumos que el admin haya quitado a otras
+            seed_consumption_rates(db, garment_type)
             db.commit()
             flash('Prenda agregada exitosamente', 'success')
             return redirect(url_for('prices'))
         except sqlite3.IntegrityError:
             flash('Error: Ya existe una prenda con ese nombre', 'danger')
-    return render_template_string(NEW_PRICE_TEMPLATE)
+    return render_page(NEW_PRICE_TEMPLATE)
 
 # ---------------------- ÓRDENES ----------------------
 @app.route('/orders/new', methods=['GET','POST'])
@@ -401,8 +2311,7 @@ def new_price():
 def new_order():
     db = get_db()
     cur = db.cursor()
-    cur.execute('SELECT * FROM clients ORDER BY name')
-    clients_list = cur.fetchall()
+    clients_list = clients_repo.by_name.all(db)
     
     # Obtener prendas por categoría
     garments_by_category = get_garments_by_category()
@@ -411,91 +2320,109 @@ def new_order():
         client_id = int(request.form['client_id']) if request.form.get('client_id') else None
         delivery_date = request.form['delivery_date']
         notes = request.form.get('notes', '')
+        idem_key = request.form.get('idempotency_key', '')
+        if not (idem_key.isalnum() and len(idem_key) <= 64):
+            idem_key = None
         
-        # Generar número de orden de manera segura
-        order_number = generate_order_number()
+        unit_prices = {p.garment_type: p.price for ps in garments_by_category.values() for p in ps}
+        categories = {p.garment_type: p.category for ps in garments_by_category.values() for p in ps}
         created_at = datetime.utcnow().isoformat()
         
-        # Verificar que el número de orden no existe (double-check)
-        cur.execute('SELECT id FROM orders WHERE order_number = ?', (order_number,))
-        if cur.fetchone():
-            # Si por alguna razón ya existe, generar uno nuevo
+        # Si el número de orden choca con otro, se reintenta una sola vez: la
+        # transacción se deshace entera, así que la clave se vuelve a reservar
+        for attempt in range(2):
+            if idem_key:
+                previous = claim_idempotency_key(db, idem_key)
+                if previous is not None:
+                    db.rollback()
+                    if previous['order_number']:
+                        flash(f'La orden {previous["order_number"]} ya había sido registrada', 'info')
+                    return redirect(url_for('index'))
+            
+            # Generar número de orden de manera segura
             order_number = generate_order_number()
-        
-        try:
-            cur.execute('INSERT INTO orders (order_number,client_id,status,created_at,delivery_date,notes) VALUES (?,?,?,?,?,?)',
-                        (order_number, client_id, 'pendiente', created_at, delivery_date, notes))
-            order_id = cur.lastrowid
-            total = 0.0
             
-            # Procesar items
-            items_added = False
-            for key in request.form:
-                if key.startswith('qty_'):
-                    garment = key.split('qty_')[1]
-                    qty = int(request.form[key] or 0)
-                    if qty <= 0:
-                        continue
-                    
-                    cur.execute('SELECT price FROM price_list WHERE garment_type=?', (garment,))
-                    row = cur.fetchone()
-                    unit_price = row['price'] if row else 0.0
-                    subtotal = unit_price * qty
-                    total += subtotal
-                    
-                    cur.execute('INSERT INTO order_items (order_id,garment_type,quantity,unit_price,subtotal) VALUES (?,?,?,?,?)',
-                                (order_id, garment, qty, unit_price, subtotal))
-                    items_added = True
+            # Verificar que el número de orden no existe (double-check)
+            cur.execute('SELECT id FROM orders WHERE order_number = ?', (order_number,))
+            if cur.fetchone():
+                # Si por alguna razón ya existe, generar uno nuevo
+                order_number = generate_order_number()
             
-            # Si no se agregaron items, eliminar la orden vacía
-            if not items_added:
-                cur.execute('DELETE FROM orders WHERE id=?', (order_id,))
+            try:
+                cur.execute('INSERT INTO orders (order_number,client_id,status,created_at,delivery_date,notes) VALUES (?,?,?,?,?,?)',
+                            (order_number, client_id, 'pendiente', created_at, delivery_date, notes))
+                order_id = cur.lastrowid
+                total = 0.0
+                # Piezas por categoría tal como se insertan, para verificar la capacidad del día
+                basket = Counter()
+                
+                # Procesar items
+                items_added = False
+                for key in request.form:
+                    if key.startswith('qty_'):
+                        garment = key.split('qty_')[1]
+                        qty = int(request.form[key] or 0)
+                        if qty <= 0:
+                            continue
+                        
+                        unit_price = unit_prices.get(garment, 0.0)
+                        subtotal = unit_price * qty
+                        total += subtotal
+                        basket[categories.get(garment, 'otros')] += qty
+                        basket['*'] += qty
+                        
+                        cur.execute('INSERT INTO order_items (order_id,garment_type,quantity,unit_price,subtotal) VALUES (?,?,?,?,?)',
+                                    (order_id, garment, qty, unit_price, subtotal))
+                        items_added = True
+                
+                # Si no se agregaron items, deshacer todo: orden, clave y lo que anotaron los triggers
+                if not items_added:
+                    db.rollback()
+                    flash('Error: La orden debe tener al menos una prenda', 'danger')
+                    return redirect(url_for('new_order'))
+                
+                if app.config['DELIVERY_ENFORCE'] and not delivery_date_ok(db, delivery_date, basket, included=True):
+                    db.rollback()
+                    options = ', '.join(available_delivery_dates(db, basket, count=3)) or 'ninguna en el horizonte'
+                    flash(f'El {delivery_date} no tiene capacidad para esta orden. Fechas disponibles: {options}',
+                          'warning')
+                    return redirect(url_for('new_order'))
+                
+                cur.execute('UPDATE orders SET total=? WHERE id=?', (total, order_id))
+                consume_supplies(db, order_id, created_at[:10])
+                record_client_order(db, client_id, total, created_at)
+                publish_order_event(db, 'created', order_id)
+                if idem_key:
+                    complete_idempotency_key(db, idem_key, order_id)
                 db.commit()
-                flash('Error: La orden debe tener al menos una prenda', 'danger')
-                return redirect(url_for('new_order'))
+                invalidate_order_status(current_branch(), order_number)
+                log_action('create_order', 'orders', order_id, session.get('username'))
+                flash(f'Orden {order_number} creada exitosamente', 'success')
+                return redirect(url_for('index'))
             
-            cur.execute('UPDATE orders SET total=? WHERE id=?', (total, order_id))
-            db.commit()
-            log_action('create_order', 'orders', order_id, session.get('username'))
-            flash(f'Orden {order_number} creada exitosamente', 'success')
-            return redirect(url_for('index'))
-        
-        except sqlite3.IntegrityError as e:
-            db.rollback()
-            if 'UNIQUE constraint failed: orders.order_number' in str(e):
-                # Regenerar número y reintentar (solo una vez)
-                try:
-                    order_number = generate_order_number()
-                    cur.execute('INSERT INTO orders (order_number,client_id,status,created_at,delivery_date,notes) VALUES (?,?,?,?,?,?)',
-                                (order_number, client_id, 'pendiente', created_at, delivery_date, notes))
-                    # ... resto del código de inserción
-                    db.commit()
-                    flash(f'Orden {order_number} creada exitosamente', 'success')
-                    return redirect(url_for('index'))
-                except Exception as e2:
-                    db.rollback()
-                    flash(f'Error crítico al crear orden: {str(e2)}', 'danger')
-            else:
+            except sqlite3.IntegrityError as e:
+                db.rollback()
+                if attempt == 0 and 'UNIQUE constraint failed: orders.order_number' in str(e):
+                    continue
                 flash(f'Error al crear orden: {str(e)}', 'danger')
+                break
     
     # Pasar la fecha de hoy al template
     today = date.today().isoformat()
     
-    return render_template_string(NEW_ORDER_TEMPLATE, 
+    return render_page(NEW_ORDER_TEMPLATE, 
                                  clients=clients_list, 
                                  garments_by_category=garments_by_category,
-                                 today=today)
+                                 today=today,
+                                 idempotency_key=new_idempotency_key())
 
 @app.route('/orders/<int:order_id>')
 @login_required
 def order_detail(order_id):
     db = get_db()
-    cur = db.cursor()
-    cur.execute('SELECT o.*, c.name as client_name, c.phone FROM orders o LEFT JOIN clients c ON o.client_id=c.id WHERE o.id=?', (order_id,))
-    order = cur.fetchone()
-    cur.execute('SELECT * FROM order_items WHERE order_id=?', (order_id,))
-    items = cur.fetchall()
-    return render_template_string(ORDER_DETAIL_TEMPLATE, order=order, items=items)
+    order = orders_repo.detail.one(db, order_id)
+    items = items_repo.by_order.all(db, order_id)
+    return render_page(ORDER_DETAIL_TEMPLATE, order=order, items=items)
 
 @app.route('/orders/<int:order_id>/status', methods=['POST'])
 @login_required
@@ -503,8 +2430,12 @@ def change_status(order_id):
     status = request.form['status']
     db = get_db()
     cur = db.cursor()
-    cur.execute('UPDATE orders SET status=? WHERE id=?', (status, order_id))
+    cur.execute('UPDATE orders SET status=? WHERE id=? RETURNING order_number', (status, order_id))
+    updated = cur.fetchone()
+    publish_order_event(db, 'status', order_id)
     db.commit()
+    if updated:
+        invalidate_order_status(current_branch(), updated['order_number'])
     log_action('change_status', 'orders', order_id, session.get('username'))
     
     if status == 'listo':
@@ -517,125 +2448,1135 @@ def change_status(order_id):
     flash('Estado actualizado', 'success')
     return redirect(url_for('order_detail', order_id=order_id))
 
+# ---------------------- CONSULTA PÚBLICA DE ESTADO ----------------------
+# Los clientes consultan su orden sin iniciar sesión con el número de orden y
+# los últimos STATUS_PHONE_DIGITS dígitos del teléfono. Cada proceso guarda
+# las respuestas (también "no existe") durante STATUS_CACHE_TTL segundos, así
+# una ráfaga de consultas después de un envío de SMS no llega a la base.
+# change_status y new_order borran la entrada en el proceso que hace el
+# cambio; los demás workers la borran al leer el evento en order_events (el
+# mismo hilo por sucursal que alimenta el tablero en vivo).
+_status_cache = OrderedDict()
+_status_cache_lock = threading.Lock()
+_status_hits = {}
+_status_hits_lock = threading.Lock()
+
+def invalidate_order_status(branch, order_number):
+    with _status_cache_lock:
+        _status_cache.pop((branch, order_number), None)
+
+def _read_order_status(db, branch, order_number):
+    # El hilo de eventos de la sucursal debe estar leyendo antes de la consulta,
+    # así ningún cambio posterior se pierde para esta entrada de la caché
+    get_event_bus(branch).watch(db)
+    return orders_repo.public_status.one(db, order_number)
+
+def cached_order_status(branch, order_number):
+    """Estado de la orden (OrderStatusRow o None) desde la caché o la base"""
+    key, now = (branch, order_number), time.monotonic()
+    with _status_cache_lock:
+        entry = _status_cache.get(key)
+        if entry is not None and entry[0] > now:
+            _status_cache.move_to_end(key)
+            return entry[1]
+    if branch == current_branch():
+        row = _read_order_status(get_db(), branch, order_number)
+    else:
+        db = connect_db(branch_db_path(branch))
+        try:
+            row = _read_order_status(db, branch, order_number)
+        finally:
+            db.close()
+    with _status_cache_lock:
+        _status_cache[key] = (now + app.config['STATUS_CACHE_TTL'], row)
+        _status_cache.move_to_end(key)
+        while len(_status_cache) > app.config['STATUS_CACHE_SIZE']:
+            _status_cache.popitem(last=False)
+    return row
+
+def status_rate_limited(ip):
+    """Registrar una consulta de la IP; devuelve los segundos a esperar o 0"""
+    now, window = time.monotonic(), app.config['STATUS_RATE_WINDOW']
+    with _status_hits_lock:
+        if len(_status_hits) > 4 * app.config['STATUS_CACHE_SIZE']:
+            # IPs que ya no consultan: se descartan de una vez
+            for stale in [k for k, hits in _status_hits.items() if hits[-1] <= now - window]:
+                del _status_hits[stale]
+        hits = _status_hits.setdefault(ip, deque())
+        while hits and hits[0] <= now - window:
+            hits.popleft()
+        if len(hits) >= app.config['STATUS_RATE_MAX']:
+            return int(hits[0] + window - now) + 1
+        hits.append(now)
+        return 0
+
+def lookup_order_status(branch, order_number, phone_digits):
+    """Estado visible para el cliente, o None si la orden o el teléfono no coinciden"""
+    digits = app.config['STATUS_PHONE_DIGITS']
+    phone_digits = ''.join(ch for ch in phone_digits if ch.isdigit())
+    if not order_number or len(phone_digits) < digits:
+        return None
+    row = cached_order_status(branch, order_number)
+    if row is None:
+        return None
+    expected = ''.join(ch for ch in (row.phone or '') if ch.isdigit())[-digits:]
+    if len(expected) < digits or not hmac.compare_digest(expected, phone_digits[-digits:]):
+        return None
+    overdue = (row.status != 'entregado' and row.delivery_date is not None
+               and row.delivery_date < datetime.utcnow().date().isoformat())
+    return {'order_number': order_number, 'status': row.status,
+            'delivery_date': row.delivery_date, 'overdue': overdue}
+
+def _public_status_request():
+    branches = get_branches()
+    branch = request.values.get('branch') or next(iter(branches))
+    if branch not in branches:
+        return None, None, 0
+    retry = status_rate_limited(request.remote_addr or '-')
+    if retry:
+        return branch, None, retry
+    order_number = request.values.get('order', '').strip().upper()
+    return branch, lookup_order_status(branch, order_number, request.values.get('phone', '')), 0
+
+@app.route('/estado')
+def public_status():
+    result, retry, searched = None, 0, 'order' in request.args
+    if searched:
+        _, result, retry = _public_status_request()
+    status_code = 429 if retry else 404 if searched and result is None else 200
+    response = Response(render_page(PUBLIC_STATUS_TEMPLATE, result=result, retry=retry,
+                                    searched=searched, branches=get_branches(),
+                                    digits=app.config['STATUS_PHONE_DIGITS']),
+                        status=status_code)
+    if retry:
+        response.headers['Retry-After'] = str(retry)
+    return response
+
+@app.route('/api/status')
+def api_public_status():
+    _, result, retry = _public_status_request()
+    if retry:
+        return jsonify(error='Demasiadas consultas'), 429, {'Retry-After': str(retry)}
+    if result is None:
+        return jsonify(error='Orden no encontrada'), 404
+    return jsonify(result)
+
+# ---------------------- BÚSQUEDA DE ÓRDENES ----------------------
+# Índice FTS5 (orders_fts, rowid = id de la orden) con número, notas, nombre y
+# teléfono del cliente y prendas. Los triggers de la base principal lo
+# mantienen al día; archive_orders indexa lo que mueve al archivo. Estado y
+# mes van como columnas sin indexar para contar facetas sin tocar orders.
+# Total y facetas se cuentan sobre las SEARCH_FACET_LIMIT coincidencias más
+# recientes; una palabra que aparece en cientos de miles de órdenes no
+# dispara el tiempo de respuesta y la página muestra "N+". Ese conteo es lo
+# más caro de la búsqueda: cada proceso lo guarda SEARCH_CACHE_TTL segundos
+# por consulta y filtros, así las páginas siguientes solo leen su página.
+SearchHitRow = namedtuple('SearchHitRow', 'id, order_number, status, created_at, delivery_date, total, '
+                                          'client_name, phone')
+SEARCH_PAGE_SIZE = 25
+SEARCH_FACET_LIMIT = 5000
+SEARCH_CACHE_SIZE = 1000
+_search_counts_cache = OrderedDict()
+_search_counts_lock = threading.Lock()
+
+def rebuild_order_search(db):
+    """Reindexar todas las órdenes (vivas y archivadas)"""
+    with db:
+        db.execute('DELETE FROM orders_fts')
+        db.execute(_order_search_doc('1', 'main.orders', 'main.order_items'))
+        db.execute(_order_search_doc('1', 'archive.orders', 'archive.order_items'))
+
+def _fts_query(text):
+    # Cada palabra como frase entre comillas (sin sintaxis FTS del usuario).
+    # Solo la última lleva prefijo: es la que puede estar a medio escribir, y
+    # un prefijo en cada palabra obliga a FTS5 a unir las listas de muchos términos
+    terms = [t.replace('"', '""') for t in text.split() if t.strip('"')]
+    return ' '.join([f'"{t}"' for t in terms[:-1]] + [f'"{t}"*' for t in terms[-1:]])
+
+def _search_counts(db, match, filters, args):
+    """(total, por estado, por mes) de las SEARCH_FACET_LIMIT coincidencias más recientes"""
+    key, now = (current_branch(), match, *args), time.monotonic()
+    with _search_counts_lock:
+        entry = _search_counts_cache.get(key)
+        if entry is not None and entry[0] > now:
+            _search_counts_cache.move_to_end(key)
+            return entry[1]
+    # Con los mismos filtros que la página, así total, facetas y resultados coinciden
+    sql = f"""WITH m AS MATERIALIZED (SELECT status, month FROM orders_fts WHERE orders_fts MATCH ?{filters}
+                                      ORDER BY rowid DESC LIMIT {SEARCH_FACET_LIMIT})
+        SELECT 'total', NULL, COUNT(*) FROM m
+        UNION ALL SELECT 'status', status, COUNT(*) FROM m GROUP BY status
+        UNION ALL SELECT 'month', month, COUNT(*) FROM m GROUP BY month"""
+    total, by_status, by_month = 0, {}, {}
+    for kind, value, n in db.execute(sql, (match, *args)):
+        if kind == 'total':
+            total = n
+        elif kind == 'status':
+            by_status[value] = n
+        else:
+            by_month[value] = n
+    counts = (total, by_status, dict(sorted(by_month.items(), reverse=True)))
+    with _search_counts_lock:
+        _search_counts_cache[key] = (now + app.config['SEARCH_CACHE_TTL'], counts)
+        _search_counts_cache.move_to_end(key)
+        while len(_search_counts_cache) > SEARCH_CACHE_SIZE:
+            _search_counts_cache.popitem(last=False)
+    return counts
+
+def search_orders(db, text, status=None, month=None, page=1):
+    """Órdenes que coinciden (una página), total y facetas por estado y mes"""
+    match = _fts_query(text)
+    if not match:
+        return [], 0, {}, {}
+    filters, args = '', []
+    if status:
+        filters += ' AND status = ?'
+        args.append(status)
+    if month:
+        filters += ' AND month = ?'
+        args.append(month)
+    total, by_status, by_month = _search_counts(db, match, filters, args)
+    # La página sale del índice en orden de rowid descendente (más recientes
+    # primero), que FTS5 recorre sin ordenar y corta en LIMIT
+    ids = [row[0] for row in db.execute(
+        f'SELECT rowid FROM orders_fts WHERE orders_fts MATCH ?{filters} ORDER BY rowid DESC LIMIT ? OFFSET ?',
+        (match, *args, SEARCH_PAGE_SIZE, (page - 1) * SEARCH_PAGE_SIZE))]
+    hits = []
+    if ids:
+        marks = ','.join('?' * len(ids))
+        found = Query(f'SELECT o.id, o.order_number, o.status, o.created_at, o.delivery_date, o.total, c.name, c.phone '
+                      f'FROM all_orders o LEFT JOIN clients c ON o.client_id = c.id WHERE o.id IN ({marks})',
+                      SearchHitRow).all(db, *ids)
+        hits = sorted(found, key=lambda h: h.id, reverse=True)
+    return hits, total, by_status, by_month
+
+@app.route('/orders/search')
+@login_required
+def order_search():
+    q = request.args.get('q', '').strip()
+    status = request.args.get('status') or None
+    month = request.args.get('month') or None
+    page = max(1, request.args.get('page', 1, type=int))
+    started = time.perf_counter()
+    hits, total, by_status, by_month = search_orders(get_db(), q, status, month, page)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    return render_page(SEARCH_TEMPLATE, q=q, status=status, month=month, page=page, hits=hits,
+                       total=total, by_status=by_status, by_month=by_month, elapsed_ms=elapsed_ms,
+                       limit=SEARCH_FACET_LIMIT,
+                       pages=(total + SEARCH_PAGE_SIZE - 1) // SEARCH_PAGE_SIZE)
+
+@app.cli.command('rebuild-search')
+def rebuild_search_command():
+    """Reconstruir el índice de búsqueda de órdenes"""
+    for branch, path in get_branches().items():
+        db = connect_db(path)
+        try:
+            rebuild_order_search(db)
+            count = db.execute('SELECT COUNT(*) FROM orders_fts').fetchone()[0]
+        finally:
+            db.close()
+        print(f'[{branch}] {count} órdenes indexadas')
+
+# ---------------------- CARGAS DE LAVADO ----------------------
+# Reparte las prendas de las órdenes pendientes en cargas de lavadora de
+# WASH_LOAD_CAPACITY kg. Solo comparten carga las categorías con el mismo
+# programa (WASH_PROGRAMS); una categoría sin programa se lava sola. Dentro
+# de cada programa las piezas se toman por fecha de entrega, de la más
+# próxima a la más lejana, y cada día con "best fit decreasing": las piezas
+# más pesadas primero, cada una en la carga abierta donde menos espacio
+# sobra. Las cargas se lavan en el orden en que se abren, así una pieza
+# puede completar una carga más urgente pero nunca queda en una que sale
+# después de su fecha de entrega.
+WASH_PROGRAMS = {
+    'cama': 'blancos', 'toallas': 'blancos',
+    'ropa_casual': 'color', 'deportiva': 'color', 'uniformes': 'color',
+    'ropa_formal': 'delicado', 'interior': 'delicado',
+}
+# Peso aproximado por pieza en kg: por prenda si está, si no por categoría
+WASH_CATEGORY_WEIGHTS = {
+    'ropa_casual': 0.3, 'ropa_formal': 0.5, 'deportiva': 0.3, 'interior': 0.1,
+    'cama': 0.8, 'toallas': 0.5, 'uniformes': 0.5,
+}
+WASH_GARMENT_WEIGHTS = {
+    'edredón': 3.0, 'cobija': 2.0, 'sábana doble': 0.9, 'funda de almohada': 0.2,
+    'traje completo': 1.2, 'corbata': 0.1, 'toalla de playa': 0.8, 'toalla de mano': 0.2,
+    'sudadera': 0.7, 'pantalón jean': 0.6, 'pijama': 0.4,
+}
+WASH_DEFAULT_WEIGHT = 0.4
+NO_DELIVERY_DATE = '9999-12-31'
+
+def _piece_grams(garment, category):
+    return round(1000 * (WASH_GARMENT_WEIGHTS.get(garment) or WASH_CATEGORY_WEIGHTS.get(category)
+                         or WASH_DEFAULT_WEIGHT))
+
+def plan_wash_loads(items, capacity_kg):
+    """Cargas para las prendas pendientes (PendingItemRow), en orden de lavado"""
+    capacity = round(capacity_kg * 1000)
+    programs = {}
+    for item in items:
+        category = item.category or 'sin_categoria'
+        program = WASH_PROGRAMS.get(category, category)
+        due = item.delivery_date or NO_DELIVERY_DATE
+        programs.setdefault(program, {}).setdefault(due, []).append(
+            (_piece_grams(item.garment_type, category), item))
+    loads = []
+    for program, by_due in programs.items():
+        free = []  # (gramos libres, índice en loads) de las cargas de este programa, ordenado
+        for due in sorted(by_due):
+            for grams, item in sorted(by_due[due], key=lambda p: -p[0]):
+                for _ in range(item.quantity):
+                    k = bisect_left(free, (grams, -1))
+                    if k < len(free):
+                        left, n = free.pop(k)
+                    else:
+                        left, n = capacity, len(loads)
+                        loads.append({'program': program, 'due': due, 'grams': 0, 'pieces': Counter()})
+                    load = loads[n]
+                    load['grams'] += grams
+                    load['pieces'][(item.order_number, item.garment_type)] += 1
+                    if left - grams > 0:
+                        insort(free, (left - grams, n))
+    loads.sort(key=lambda l: (l['due'], l['program']))
+    return [{'program': l['program'], 'due': None if l['due'] == NO_DELIVERY_DATE else l['due'],
+             'weight_kg': l['grams'] / 1000, 'fill': l['grams'] / capacity, 'overweight': l['grams'] > capacity,
+             'orders': len({number for number, _ in l['pieces']}),
+             'items': sorted((number, garment, qty) for (number, garment), qty in l['pieces'].items())}
+            for l in loads]
+
+def wash_load_lower_bound(loads, capacity_kg):
+    """Mínimo teórico de cargas: peso total de cada programa entre la capacidad"""
+    grams = Counter()
+    for load in loads:
+        grams[load['program']] += round(load['weight_kg'] * 1000)
+    capacity = round(capacity_kg * 1000)
+    return sum(-(-g // capacity) for g in grams.values())
+
+@app.route('/loads')
+@login_required
+def wash_loads():
+    capacity = app.config['WASH_LOAD_CAPACITY']
+    loads = plan_wash_loads(items_repo.pending.iter(get_db()), capacity)
+    return render_page(WASH_LOADS_TEMPLATE, loads=loads, capacity=capacity,
+                       lower_bound=wash_load_lower_bound(loads, capacity),
+                       today=date.today().isoformat())
+
+@app.cli.command('plan-loads')
+def plan_loads_command():
+    """Mostrar las cargas de lavado para las órdenes pendientes"""
+    capacity = app.config['WASH_LOAD_CAPACITY']
+    for branch, path in get_branches().items():
+        db = connect_db(path)
+        try:
+            loads = plan_wash_loads(items_repo.pending.iter(db), capacity)
+        finally:
+            db.close()
+        print(f'[{branch}] {len(loads)} cargas (mínimo {wash_load_lower_bound(loads, capacity)})')
+        for n, load in enumerate(loads, 1):
+            print(f'  {n:3d}. {load["program"]:10s} entrega {load["due"] or "-":10s} '
+                  f'{load["weight_kg"]:5.1f} kg  {load["orders"]} órdenes')
+
+# ---------------------- CAPACIDAD DE ENTREGA ----------------------
+# Un día admite una orden más si no pasa de DELIVERY_MAX_ORDERS órdenes,
+# DELIVERY_MAX_PIECES piezas ni el máximo de piezas de cada categoría en
+# DELIVERY_CATEGORY_PIECES. Un día sin entregas acepta cualquier orden, así
+# una orden más grande que la capacidad también tiene fecha. La carga de cada
+# día sale de delivery_load, que mantienen los triggers, nunca de sumar
+# órdenes. new_order vuelve a comprobar el día dentro de su transacción,
+# después de insertar: SQLite serializa las escrituras y dos cajeros no
+# pueden tomar el último lugar del mismo día.
+def rebuild_delivery_load(db):
+    """Recalcular delivery_load desde las órdenes de la base principal"""
+    db.execute('DELETE FROM delivery_load')
+    db.execute("""INSERT INTO delivery_load (day, category, pieces, orders)
+        SELECT o.delivery_date, COALESCE(p.category, 'otros'), SUM(i.quantity), 0
+        FROM orders o JOIN order_items i ON i.order_id = o.id LEFT JOIN price_list p ON p.garment_type = i.garment_type
+        WHERE o.delivery_date IS NOT NULL GROUP BY 1, 2""")
+    db.execute("""INSERT INTO delivery_load (day, category, pieces, orders)
+        SELECT o.delivery_date, '*', COALESCE(SUM(i.qty), 0), COUNT(*)
+        FROM orders o LEFT JOIN (SELECT order_id, SUM(quantity) AS qty FROM order_items GROUP BY order_id) i
+             ON i.order_id = o.id
+        WHERE o.delivery_date IS NOT NULL GROUP BY 1""")
+
+def order_basket(form, categories):
+    """Piezas por categoría (y '*' en total) de los campos qty_<prenda> de un formulario"""
+    basket = Counter()
+    for key, value in form.items():
+        if key.startswith('qty_') and value.isdigit() and int(value) > 0:
+            basket[categories.get(key[4:], 'otros')] += int(value)
+            basket['*'] += int(value)
+    return basket
+
+def _closed_weekdays():
+    return {int(d) for d in app.config['DELIVERY_CLOSED_WEEKDAYS'].split(',') if d.strip().isdigit()}
+
+def _day_fits(load, basket):
+    # load: piezas por categoría y '#' = órdenes ya comprometidas ese día
+    if not load.get('#'):
+        return True
+    max_orders = app.config['DELIVERY_MAX_ORDERS']
+    if max_orders and load['#'] + 1 > max_orders:
+        return False
+    limits = dict(app.config['DELIVERY_CATEGORY_PIECES'], **{'*': app.config['DELIVERY_MAX_PIECES']})
+    return all(not limits.get(cat) or load.get(cat, 0) + pieces <= limits[cat] for cat, pieces in basket.items())
+
+def _loads_between(db, start, end):
+    loads = {}
+    for day, category, pieces, orders in db.execute(
+            'SELECT day, category, pieces, orders FROM delivery_load WHERE day >= ? AND day < ?', (start, end)):
+        load = loads.setdefault(day, {})
+        load[category] = pieces
+        if category == '*':
+            load['#'] = orders
+    return loads
+
+def available_delivery_dates(db, basket, start=None, count=5):
+    """Las próximas count fechas (AAAA-MM-DD) con lugar para la orden, desde start"""
+    start = start or date.today()
+    horizon = app.config['DELIVERY_HORIZON']
+    loads = _loads_between(db, start.isoformat(), (start + timedelta(days=horizon)).isoformat())
+    closed, found = _closed_weekdays(), []
+    for offset in range(horizon):
+        day = start + timedelta(days=offset)
+        if day.weekday() not in closed and _day_fits(loads.get(day.isoformat(), {}), basket):
+            found.append(day.isoformat())
+            if len(found) == count:
+                break
+    return found
+
+def delivery_date_ok(db, day, basket, included=False):
+    """Si la orden cabe en day; included=True si delivery_load ya la cuenta"""
+    try:
+        when = date.fromisoformat(day)
+    except ValueError:
+        return False
+    if when.weekday() in _closed_weekdays():
+        return False
+    load = _loads_between(db, day, (when + timedelta(days=1)).isoformat()).get(day, {})
+    if included:
+        load = {cat: load.get(cat, 0) - basket.get(cat, 0) for cat in set(load) | set(basket)}
+        load['#'] -= 1
+    return _day_fits(load, basket)
+
+@app.route('/api/delivery-slots')
+@login_required
+def api_delivery_slots():
+    db = get_db()
+    categories = {p.garment_type: p.category for p in prices_repo.all.iter(db)}
+    basket = order_basket(request.args, categories)
+    count = min(max(request.args.get('n', 5, type=int), 1), 20)
+    result = {'dates': available_delivery_dates(db, basket, count=count)}
+    if request.args.get('date'):
+        result['date_ok'] = delivery_date_ok(db, request.args['date'], basket)
+    return jsonify(result)
+
+@app.cli.command('rebuild-delivery-load')
+def rebuild_delivery_load_command():
+    """Recalcular la carga de entregas por día"""
+    for branch, path in get_branches().items():
+        db = connect_db(path)
+        try:
+            with db:
+                rebuild_delivery_load(db)
+            days = db.execute("SELECT COUNT(*) FROM delivery_load WHERE category='*'").fetchone()[0]
+        finally:
+            db.close()
+        print(f'[{branch}] {days} días con entregas')
+
+# ---------------------- TABLERO EN VIVO ----------------------
+# new_order y change_status registran un evento en order_events dentro de su
+# propia transacción. En cada proceso, un único hilo por sucursal lee los
+# eventos nuevos y los reparte a las pantallas conectadas por SSE: muchas
+# pantallas abiertas cuestan una consulta por intervalo, no una por pantalla.
+# Pasar por la tabla hace que los eventos lleguen también a los demás workers.
+ORDER_EVENTS_SQL = """SELECT e.id, e.kind, e.order_id, o.order_number, o.status, o.total, o.created_at,
+           c.name as client_name
+    FROM order_events e LEFT JOIN orders o ON o.id=e.order_id LEFT JOIN clients c ON c.id=o.client_id
+    WHERE e.id > ? ORDER BY e.id LIMIT 500"""
+
+def publish_order_event(db, kind, order_id):
+    cur = db.execute('INSERT INTO order_events (kind,order_id,created_at) VALUES (?,?,?)',
+                     (kind, order_id, datetime.utcnow().isoformat()))
+    # Poda ocasional: basta con los últimos BOARD_EVENTS_KEEP para reconexiones
+    if cur.lastrowid % 1000 == 0:
+        db.execute('DELETE FROM order_events WHERE id <= ?', (cur.lastrowid - app.config['BOARD_EVENTS_KEEP'],))
+
+def fetch_order_events(db, after_id):
+    return [dict(r) for r in db.execute(ORDER_EVENTS_SQL, (after_id,))]
+
+class OrderEventBus:
+    def __init__(self, branch):
+        self.branch = branch
+        self.subscribers = set()
+        self.lock = threading.Lock()
+        self.thread = None
+        self.last_id = None
+        self.watch_until = 0.0
+
+    def watch(self, db):
+        """Mantener el hilo vivo, aun sin pantallas, mientras haya estados públicos en caché"""
+        with self.lock:
+            self.watch_until = time.monotonic() + app.config['STATUS_CACHE_TTL']
+            if self.thread is None:
+                # Hilo detenido: las entradas anteriores ya vencieron, se parte del último evento
+                self.last_id = db.execute('SELECT COALESCE(MAX(id), 0) FROM order_events').fetchone()[0]
+                self.thread = threading.Thread(target=self._run, name=f'board-{self.branch}', daemon=True)
+                self.thread.start()
+
+    def subscribe(self):
+        q = queue.Queue(maxsize=app.config['BOARD_QUEUE_SIZE'])
+        q.dropped = False
+        with self.lock:
+            self.subscribers.add(q)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name=f'board-{self.branch}', daemon=True)
+                self.thread.start()
+        return q
+
+    def unsubscribe(self, q):
+        with self.lock:
+            self.subscribers.discard(q)
+
+    def _fan_out(self, events):
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for q in subscribers:
+            for event in events:
+                try:
+                    q.put_nowait(event)
+                except queue.Full:
+                    # Pantalla que no consume: se corta y reconecta con Last-Event-ID
+                    q.dropped = True
+                    self.unsubscribe(q)
+                    break
+
+    def _run(self):
+        db = connect_db(branch_db_path(self.branch))
+        try:
+            if self.last_id is None:
+                self.last_id = db.execute('SELECT COALESCE(MAX(id), 0) FROM order_events').fetchone()[0]
+            while True:
+                with self.lock:
+                    if not self.subscribers and time.monotonic() >= self.watch_until:
+                        self.thread = None
+                        return
+                events = fetch_order_events(db, self.last_id)
+                if events:
+                    self.last_id = events[-1]['id']
+                    for event in events:
+                        if event['kind'] in ('status', 'created') and event['order_number']:
+                            invalidate_order_status(self.branch, event['order_number'])
+                    self._fan_out(events)
+                else:
+                    time.sleep(app.config['BOARD_POLL_INTERVAL'])
+        except Exception:
+            app.logger.exception('Tablero en vivo detenido (%s)', self.branch)
+            with self.lock:
+                self.thread = None
+        finally:
+            db.close()
+
+_event_buses = {}
+_event_buses_lock = threading.Lock()
+
+def get_event_bus(branch):
+    with _event_buses_lock:
+        if branch not in _event_buses:
+            _event_buses[branch] = OrderEventBus(branch)
+        return _event_buses[branch]
+
+def _sse(event):
+    return f"id: {event['id']}\nevent: order\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+@app.route('/board/stream')
+@login_required
+def board_stream():
+    bus = get_event_bus(current_branch())
+    q = bus.subscribe()
+    # Al reconectar, el navegador envía el último id recibido: reenviar lo perdido
+    missed = []
+    last_event_id = request.headers.get('Last-Event-ID', '')
+    if last_event_id.isdigit():
+        missed = fetch_order_events(get_db(), int(last_event_id))
+
+    def stream():
+        sent = missed[-1]['id'] if missed else 0
+        try:
+            yield 'retry: 3000\n\n'
+            for event in missed:
+                yield _sse(event)
+            while True:
+                try:
+                    event = q.get(timeout=app.config['BOARD_HEARTBEAT'])
+                except queue.Empty:
+                    if q.dropped:
+                        return
+                    yield ': ping\n\n'
+                    continue
+                if event['id'] > sent:
+                    sent = event['id']
+                    yield _sse(event)
+                if q.dropped and q.empty():
+                    return
+        finally:
+            bus.unsubscribe(q)
+
+    return Response(stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 # ---------------------- REPORTES Y EXPORTACIÓN ----------------------
+SALES_TODAY_SQL = "SELECT SUM(total) as total FROM orders WHERE created_at LIKE ?"
+POPULAR_SQL = "SELECT garment_type, SUM(quantity) as q FROM all_order_items GROUP BY garment_type ORDER BY q DESC"
+EXPORT_ORDERS_SQL = ('SELECT o.order_number, c.name as client_name, c.phone, o.status, o.created_at, o.delivery_date, '
+                     'o.total, o.notes FROM all_orders o LEFT JOIN clients c ON o.client_id=c.id')
+
 @app.route('/reports')
 @login_required
 def reports():
-    db = get_db()
+    db = get_read_db()
     cur = db.cursor()
     today = date.today().isoformat()
-    cur.execute("SELECT SUM(total) as total FROM orders WHERE created_at LIKE ?", (today + '%',))
+    cur.execute(SALES_TODAY_SQL, (today + '%',))
     sales_today = cur.fetchone()['total'] or 0
-    cur.execute("SELECT garment_type, SUM(quantity) as q FROM order_items GROUP BY garment_type ORDER BY q DESC LIMIT 10")
+    cur.execute(POPULAR_SQL + " LIMIT 10")
     popular = cur.fetchall()
-    return render_template_string(REPORTS_TEMPLATE, sales_today=sales_today, popular=popular)
+    return render_page(REPORTS_TEMPLATE, sales_today=sales_today, popular=popular,
+                       multi_branch=len(get_branches()) > 1,
+                       parquet_available=backend_available('pyarrow'))
+
+@app.route('/reports/chain')
+@admin_required
+def chain_reports():
+    today = date.today().isoformat()
+    sales = [(branch, rows[0]['total'] or 0) for branch, rows in federated_query(SALES_TODAY_SQL, (today + '%',))]
+    # Cada sucursal devuelve su agregado completo (pocas filas); se suman aquí
+    totals = {}
+    for _, rows in federated_query(POPULAR_SQL):
+        for r in rows:
+            totals[r['garment_type']] = totals.get(r['garment_type'], 0) + r['q']
+    popular = sorted(totals.items(), key=lambda kv: kv[1], reverse=True)[:10]
+    return render_page(CHAIN_REPORTS_TEMPLATE, sales=sales,
+                       chain_total=sum(total for _, total in sales), popular=popular)
+
+@app.route('/export/chain_orders.csv')
+@admin_required
+@limit_concurrency('export')
+def export_chain_orders_csv():
+    si = io.StringIO()
+    w = csv.writer(si)
+    w.writerow(['branch','order_number','client_name','phone','status','created_at','delivery_date','total','notes'])
+    rows = [(branch, r) for branch, branch_rows in federated_query(EXPORT_ORDERS_SQL) for r in branch_rows]
+    rows.sort(key=lambda br: br[1]['created_at'] or '')
+    for branch, r in rows:
+        w.writerow([branch, r['order_number'], r['client_name'], r['phone'], r['status'], r['created_at'], r['delivery_date'], r['total'], r['notes']])
+    return send_file(io.BytesIO(si.getvalue().encode('utf-8')), mimetype='text/csv',
+                     as_attachment=True, download_name='ordenes_cadena.csv')
+
+# Generadores de exportaciones: escriben en un archivo binario y avisan el
+# avance con progress(hechas, total). Los usan tanto las rutas directas como
+# los trabajos en segundo plano.
+def _orders_export_query(params):
+    sql, args = EXPORT_ORDERS_SQL + ' WHERE 1=1', []
+    if params.get('since'):
+        sql += ' AND o.created_at >= ?'
+        args.append(params['since'])
+    if params.get('until'):
+        sql += ' AND o.created_at < ?'
+        args.append(params['until'])
+    return sql + ' ORDER BY o.created_at', args
+
+def _count(db, sql, args=()):
+    return db.execute(f'SELECT COUNT(*) FROM ({sql})', args).fetchone()[0]
+
+def write_orders_csv(db, out, params, progress=None):
+    sql, args = _orders_export_query(params)
+    total = _count(db, sql, args) if progress else 0
+    text = io.TextIOWrapper(out, encoding='utf-8', newline='')
+    writer = csv.writer(text)
+    writer.writerow(['order_number','client_name','phone','status','created_at','delivery_date','total','notes'])
+    for n, r in enumerate(Query(sql, ExportOrderRow).iter(db, *args), 1):
+        writer.writerow(r)
+        if progress and n % 1000 == 0:
+            progress(n, total)
+    text.flush()
+    text.detach()  # no cerrar `out` junto con el wrapper
+    if progress:
+        progress(total, total)
+
+def write_orders_xlsx(db, out, params, progress=None):
+    xl = load_backend('openpyxl')
+    sql, args = _orders_export_query(params)
+    total = _count(db, sql, args) if progress else 0
+    wb = xl.Workbook()
+    ws = wb.active
+    ws.title = 'Órdenes'
+    headers = ['Número Orden','Cliente','Teléfono','Estado','Fecha Creación','Fecha Entrega','Total','Notas']
+    ws.append(headers)
+    
+    for n, r in enumerate(Query(sql, ExportOrderRow).iter(db, *args), 1):
+        ws.append(r)
+        if progress and n % 1000 == 0:
+            progress(n, total)
+    
+    # Ajustar anchos de columna
+    for column in ws.columns:
+        max_length = 0
+        column_letter = xl.get_column_letter(column[0].column)
+        for cell in column:
+            try:
+                if len(str(cell.value)) > max_length:
+                    max_length = len(str(cell.value))
+            except:
+                pass
+        ws.column_dimensions[column_letter].width = min(max_length + 2, 50)
+    
+    wb.save(out)
+    if progress:
+        progress(total, total)
+
+# Exportación columnar para análisis: una fila por item (las órdenes sin items
+# salen una vez con columnas de item nulas), con tipos reales y los textos
+# repetitivos codificados como diccionario. Se escribe por lotes directo del
+# cursor, así la memoria no crece con el tamaño de la exportación. El join se
+# hace por separado en main y archive (con sus índices) en lugar de sobre las
+# vistas all_*, que SQLite materializaría. Ordenar por id de orden (el orden
+# de creación) sale del recorrido por clave primaria, sin ordenar aparte, y
+# deja estadísticas de fecha útiles por grupo de filas.
+PARQUET_BATCH = 50000
+PARQUET_SQL = ('SELECT o.id, o.order_number, o.client_id, c.name, o.status, NULLIF(o.created_at, \'\'), '
+               'NULLIF(o.delivery_date, \'\'), o.total, o.notes, i.id, i.garment_type, p.category, '
+               'i.quantity, i.unit_price, i.subtotal '
+               'FROM {schema}.orders o LEFT JOIN {schema}.order_items i ON i.order_id = o.id '
+               'LEFT JOIN main.clients c ON o.client_id = c.id '
+               'LEFT JOIN main.price_list p ON p.garment_type = i.garment_type WHERE 1=1')
+
+def _parquet_query(params):
+    where, args = '', []
+    if params.get('since'):
+        where += ' AND o.created_at >= ?'
+        args.append(params['since'])
+    if params.get('until'):
+        where += ' AND o.created_at < ?'
+        args.append(params['until'])
+    parts = [PARQUET_SQL.format(schema=schema) + where for schema in ('main', 'archive')]
+    return ' UNION ALL '.join(parts) + ' ORDER BY 1', args * 2
+
+def _parquet_schema(pa):
+    text_dict = pa.dictionary(pa.int32(), pa.string())
+    return pa.schema([
+        ('order_id', pa.int64()), ('order_number', pa.string()), ('client_id', pa.int64()),
+        ('client_name', pa.string()), ('status', text_dict), ('created_at', pa.timestamp('us')),
+        ('delivery_date', pa.date32()), ('order_total', pa.float64()), ('notes', pa.string()),
+        ('item_id', pa.int64()), ('garment_type', text_dict), ('category', text_dict),
+        ('quantity', pa.int32()), ('unit_price', pa.float64()), ('subtotal', pa.float64()),
+    ])
+
+def write_orders_parquet(db, out, params, progress=None):
+    arrow = load_backend('pyarrow')
+    pa = arrow.pa
+    schema = _parquet_schema(pa)
+    sql, args = _parquet_query(params)
+    total = _count(db, sql, args) if progress else 0
+    cur = db.cursor()
+    cur.row_factory = None
+    cur.execute(sql, args)
+    done = 0
+    with arrow.pq.ParquetWriter(out, schema, compression='zstd') as writer:
+        while True:
+            rows = cur.fetchmany(PARQUET_BATCH)
+            if not rows:
+                break
+            arrays = []
+            for field, values in zip(schema, zip(*rows)):
+                if pa.types.is_dictionary(field.type):
+                    arrays.append(pa.array(values, pa.string()).dictionary_encode())
+                elif pa.types.is_timestamp(field.type) or pa.types.is_date(field.type):
+                    # Fechas guardadas como texto ISO; Arrow las convierte en C
+                    arrays.append(pa.array(values, pa.string()).cast(field.type))
+                else:
+                    arrays.append(pa.array(values, field.type))
+            writer.write_batch(pa.RecordBatch.from_arrays(arrays, schema=schema))
+            done += len(rows)
+            if progress:
+                progress(done, total)
+    if progress:
+        progress(total, total)
+
+BACKUP_TABLES = [
+    ('clients.csv', 'SELECT id, name, phone, address, created_at FROM clients', ['id','name','phone','address','created_at']),
+    ('orders.csv', f'SELECT {ORDER_COLUMNS} FROM all_orders', ['id','order_number','client_id','status','created_at','delivery_date','total','notes']),
+    ('inventory.csv', f'SELECT {INVENTORY_COLUMNS} FROM inventory', ['id','name','qty','low_threshold','per_order']),
+    ('consumption_rates.csv', 'SELECT garment_type, inventory_id, per_unit FROM consumption_rates',
+     ['garment_type','inventory_id','per_unit']),
+]
+
+def write_backup_zip(db, out, params, progress=None):
+    total = sum(_count(db, sql) for _, sql, _ in BACKUP_TABLES) if progress else 0
+    done = 0
+    with zipfile.ZipFile(out, mode='w') as z:
+        for filename, sql, columns in BACKUP_TABLES:
+            si = io.StringIO()
+            w = csv.writer(si)
+            w.writerow(columns)
+            cur = db.cursor()
+            cur.row_factory = None  # las columnas ya vienen en el orden del encabezado
+            for r in cur.execute(sql):
+                w.writerow(r)
+                done += 1
+                if progress and done % 1000 == 0:
+                    progress(done, total)
+            z.writestr(filename, si.getvalue())
+    if progress:
+        progress(total, total)
+
+# tipo -> (nombre de descarga, mimetype, generador, solo admin)
+EXPORT_KINDS = {
+    'orders_csv': ('orders.csv', 'text/csv', write_orders_csv, False),
+    'orders_xlsx': ('ordenes.xlsx', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+                    write_orders_xlsx, False),
+    'backup_zip': ('backup.zip', 'application/zip', write_backup_zip, True),
+    'orders_parquet': ('ordenes.parquet', 'application/vnd.apache.parquet', write_orders_parquet, False),
+}
+# Tipos que necesitan una dependencia opcional
+EXPORT_BACKENDS = {'orders_xlsx': 'openpyxl', 'orders_parquet': 'pyarrow'}
+
+def _send_export(kind):
+    download_name, mimetype, writer, _ = EXPORT_KINDS[kind]
+    bio = io.BytesIO()
+    writer(get_read_db(), bio, {})
+    bio.seek(0)
+    return send_file(bio, mimetype=mimetype, as_attachment=True, download_name=download_name)
+
+@app.route('/export/orders.csv')
+@login_required
+@limit_concurrency('export')
+def export_orders_csv():
+    return _send_export('orders_csv')
+
+@app.route('/export/orders.xlsx')
+@login_required
+@limit_concurrency('export')
+def export_orders_xlsx():
+    if not backend_available('openpyxl'):
+        flash('openpyxl no está instalado. Instala con: pip install openpyxl', 'danger')
+        return redirect(url_for('reports'))
+    return _send_export('orders_xlsx')
+
+@app.route('/export/orders.parquet')
+@login_required
+@limit_concurrency('export')
+def export_orders_parquet():
+    if not backend_available('pyarrow'):
+        flash('pyarrow no está instalado. Instala con: pip install pyarrow', 'danger')
+        return redirect(url_for('reports'))
+    return _send_export('orders_parquet')
+
+@app.route('/export/backup_all.zip')
+@admin_required
+@limit_concurrency('backup')
+def export_backup_zip():
+    return _send_export('backup_zip')
+
+@app.route('/metrics/limits')
+@admin_required
+def limits_metrics():
+    return jsonify(concurrency_metrics())
+
+@app.route('/admin/maintenance')
+@admin_required
+def maintenance():
+    branches = [(branch, *maintenance_status(branch)) for branch in get_branches()]
+    return render_page(MAINTENANCE_TEMPLATE, branches=branches, maintenance_jobs=MAINTENANCE_JOBS,
+                       scheduler_enabled=app.config['SCHEDULER_ENABLED'])
+
+# ---------------------- TRABAJOS DE EXPORTACIÓN ----------------------
+# Las exportaciones grandes se encolan y corren en un pool de hilos. El
+# estado vive en la tabla export_jobs, así que cualquier worker puede
+# responder /exports/jobs/<id>, y el resultado queda en EXPORT_DIR hasta
+# expires_at. Pedidos idénticos mientras uno está en curso reciben el mismo
+# trabajo; uno terminado no se reutiliza, para no entregar datos viejos.
+_export_pool = None
+_export_pool_lock = threading.Lock()
+
+def _export_executor():
+    global _export_pool
+    if _export_pool is None:
+        with _export_pool_lock:
+            if _export_pool is None:
+                _export_pool = ThreadPoolExecutor(max_workers=app.config['EXPORT_WORKERS'],
+                                                  thread_name_prefix='export')
+    return _export_pool
+
+def _update_job(db, job_id, **fields):
+    fields['updated_at'] = datetime.utcnow().isoformat()
+    assignments = ', '.join(f'{k}=?' for k in fields)
+    with db:
+        db.execute(f'UPDATE export_jobs SET {assignments} WHERE id=?', (*fields.values(), job_id))
+
+def purge_expired_exports(db):
+    now = datetime.utcnow()
+    # Sin expires_at: trabajos con error o abandonados (el worker murió); se
+    # borran cuando llevan EXPORT_TTL segundos sin actualizarse
+    abandoned = (now - timedelta(seconds=app.config['EXPORT_TTL'])).isoformat()
+    expired = db.execute('SELECT id, result_path FROM export_jobs WHERE expires_at < ? '
+                         'OR (expires_at IS NULL AND updated_at < ?)', (now.isoformat(), abandoned)).fetchall()
+    for job in expired:
+        paths = glob.glob(os.path.join(glob.escape(app.config['EXPORT_DIR']), job['id'] + '.*.tmp'))
+        if job['result_path']:
+            paths.append(job['result_path'])
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
+    if expired:
+        with db:
+            db.executemany('DELETE FROM export_jobs WHERE id=?', [(job['id'],) for job in expired])
+
+def enqueue_export(db, kind, params, username=None, branch=None):
+    """Encolar (o reutilizar) un trabajo de exportación; devuelve su id"""
+    branch = branch or current_branch()
+    purge_expired_exports(db)
+    dedupe_key = hashlib.sha1(json.dumps([kind, params], sort_keys=True).encode()).hexdigest()
+    now = datetime.utcnow()
+    stale = (now - timedelta(seconds=app.config['EXPORT_STALE_AFTER'])).isoformat()
+    # BEGIN IMMEDIATE: dos workers no pueden crear el mismo trabajo a la vez
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        existing = db.execute(
+            "SELECT id FROM export_jobs WHERE dedupe_key=? AND status IN ('queued','running') AND updated_at >= ? "
+            "ORDER BY created_at DESC LIMIT 1", (dedupe_key, stale)).fetchone()
+        if existing:
+            db.commit()
+            return existing['id']
+        job_id = uuid.uuid4().hex
+        db.execute('INSERT INTO export_jobs (id,kind,params,dedupe_key,status,progress,total,username,'
+                   'created_at,updated_at) VALUES (?,?,?,?,?,?,?,?,?,?)',
+                   (job_id, kind, json.dumps(params), dedupe_key, 'queued', 0, 0, username,
+                    now.isoformat(), now.isoformat()))
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    _export_executor().submit(_run_export_job, job_id, branch)
+    return job_id
+
+def _run_export_job(job_id, branch):
+    path = branch_db_path(branch)
+    db = connect_db(path)
+    try:
+        job = db.execute('SELECT * FROM export_jobs WHERE id=?', (job_id,)).fetchone()
+        download_name, _, writer, _ = EXPORT_KINDS[job['kind']]
+        last = [0.0]
+
+        def progress(done, total):
+            now = time.monotonic()
+            if now - last[0] >= 0.5 or done == total:
+                last[0] = now
+                _update_job(db, job_id, progress=done, total=total)
+
+        def heartbeat():
+            # Esperando cupo: sin esto enqueue_export lo daría por muerto tras EXPORT_STALE_AFTER
+            now = time.monotonic()
+            if now - last[0] >= app.config['EXPORT_STALE_AFTER'] / 4:
+                last[0] = now
+                _update_job(db, job_id)
+
+        os.makedirs(app.config['EXPORT_DIR'], exist_ok=True)
+        target = os.path.join(app.config['EXPORT_DIR'], f'{job_id}{os.path.splitext(download_name)[1]}')
+        # Comparte cupos con las descargas directas; el trabajo sigue "en cola" mientras espera
+        with concurrency_slot(EXPORT_LIMIT_GROUPS[job['kind']], background=True, heartbeat=heartbeat):
+            _update_job(db, job_id, status='running')
+            read_db = connect_read_db(branch) or connect_db(path)
+            try:
+                with open(target + '.tmp', 'wb') as f:
+                    writer(read_db, f, json.loads(job['params']), progress)
+            finally:
+                read_db.close()
+        os.replace(target + '.tmp', target)
+        expires = datetime.utcnow() + timedelta(seconds=app.config['EXPORT_TTL'])
+        _update_job(db, job_id, status='done', result_path=target, finished_at=datetime.utcnow().isoformat(),
+                    expires_at=expires.isoformat())
+    except Exception as e:
+        app.logger.exception('Falló la exportación %s', job_id)
+        _update_job(db, job_id, status='error', error=str(e), finished_at=datetime.utcnow().isoformat())
+    finally:
+        db.close()
+
+def _job_for_user(job_id):
+    job = get_db().execute('SELECT * FROM export_jobs WHERE id=?', (job_id,)).fetchone()
+    if job is None or (EXPORT_KINDS[job['kind']][3] and session.get('user_role') != 'admin'):
+        return None
+    return job
+
+@app.route('/exports/<kind>', methods=['POST'])
+@login_required
+def start_export(kind):
+    if kind not in EXPORT_KINDS:
+        return jsonify({'error': 'Tipo de exportación desconocido'}), 404
+    if EXPORT_KINDS[kind][3] and session.get('user_role') != 'admin':
+        flash('Acceso denegado: permisos insuficientes', 'danger')
+        return redirect(url_for('reports'))
+    backend = EXPORT_BACKENDS.get(kind)
+    if backend and not backend_available(backend):
+        flash(f'{backend} no está instalado. Instala con: pip install {backend}', 'danger')
+        return redirect(url_for('reports'))
+    params = {k: request.form[k] for k in ('since', 'until') if request.form.get(k)}
+    job_id = enqueue_export(get_db(), kind, params, session.get('username'))
+    return redirect(url_for('export_job_page', job_id=job_id))
 
-@app.route('/export/orders.csv')
+@app.route('/exports/jobs/<job_id>')
 @login_required
-def export_orders_csv():
-    db = get_db()
-    cur = db.cursor()
-    cur.execute('SELECT o.*, c.name as client_name, c.phone FROM orders o LEFT JOIN clients c ON o.client_id=c.id')
-    rows = cur.fetchall()
-    
-    output = io.BytesIO()
-    writer = csv.writer(io.TextIOWrapper(output, encoding='utf-8'))
-    writer.writerow(['order_number','client_name','phone','status','created_at','delivery_date','total','notes'])
-    
-    for r in rows:
-        writer.writerow([r['order_number'], r['client_name'], r['phone'], r['status'], r['created_at'], r['delivery_date'], r['total'], r['notes']])
-    
-    output.seek(0)
-    return send_file(output, mimetype='text/csv', as_attachment=True, download_name='orders.csv')
+def export_job_page(job_id):
+    if _job_for_user(job_id) is None:
+        flash('Exportación no encontrada o vencida', 'warning')
+        return redirect(url_for('reports'))
+    return render_page(EXPORT_JOB_TEMPLATE, job_id=job_id)
 
-@app.route('/export/orders.xlsx')
+@app.route('/exports/jobs/<job_id>/status')
 @login_required
-def export_orders_xlsx():
-    if not OPENPYXL_AVAILABLE:
-        flash('openpyxl no está instalado. Instala con: pip install openpyxl', 'danger')
+def export_job_status(job_id):
+    job = _job_for_user(job_id)
+    if job is None:
+        return jsonify({'error': 'Exportación no encontrada o vencida'}), 404
+    total = job['total'] or 0
+    return jsonify({
+        'id': job['id'],
+        'kind': job['kind'],
+        'status': job['status'],
+        'progress': job['progress'],
+        'total': total,
+        'percent': 100 if job['status'] == 'done' else (round(100 * job['progress'] / total) if total else 0),
+        'error': job['error'],
+        'expires_at': job['expires_at'],
+        'download_url': url_for('export_job_download', job_id=job_id) if job['status'] == 'done' else None,
+    })
+
+@app.route('/exports/jobs/<job_id>/download')
+@login_required
+def export_job_download(job_id):
+    job = _job_for_user(job_id)
+    if (job is None or job['status'] != 'done' or job['expires_at'] < datetime.utcnow().isoformat()
+            or not os.path.exists(job['result_path'])):
+        flash('Exportación no encontrada o vencida', 'warning')
         return redirect(url_for('reports'))
-    
-    db = get_db()
-    cur = db.cursor()
-    cur.execute('SELECT o.*, c.name as client_name, c.phone FROM orders o LEFT JOIN clients c ON o.client_id=c.id')
-    rows = cur.fetchall()
-    
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    ws.title = 'Órdenes'
-    headers = ['Número Orden','Cliente','Teléfono','Estado','Fecha Creación','Fecha Entrega','Total','Notas']
-    ws.append(headers)
-    
-    for r in rows:
-        ws.append([r['order_number'], r['client_name'], r['phone'], r['status'], r['created_at'], r['delivery_date'], r['total'], r['notes']])
-    
-    # Ajustar anchos de columna
-    for column in ws.columns:
-        max_length = 0
-        column_letter = get_column_letter(column[0].column)
-        for cell in column:
-            try:
-                if len(str(cell.value)) > max_length:
-                    max_length = len(str(cell.value))
-            except:
-                pass
-        ws.column_dimensions[column_letter].width = min(max_length + 2, 50)
-    
-    bio = io.BytesIO()
-    wb.save(bio)
-    bio.seek(0)
-    return send_file(bio, mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 
-                    as_attachment=True, download_name='ordenes.xlsx')
+    download_name, mimetype, _, _ = EXPORT_KINDS[job['kind']]
+    return send_file(job['result_path'], mimetype=mimetype, as_attachment=True, download_name=download_name)
 
-@app.route('/export/backup_all.zip')
-@admin_required
-def export_backup_zip():
-    mem = io.BytesIO()
-    with zipfile.ZipFile(mem, mode='w') as z:
-        db = get_db()
-        cur = db.cursor()
-        
-        # Clientes
-        cur.execute('SELECT * FROM clients')
-        si = io.StringIO()
-        w = csv.writer(si)
-        w.writerow(['id','name','phone','address','created_at'])
-        for r in cur.fetchall():
-            w.writerow([r['id'], r['name'], r['phone'], r['address'], r['created_at']])
-        z.writestr('clients.csv', si.getvalue())
-        
-        # Órdenes
-        cur.execute('SELECT * FROM orders')
-        si = io.StringIO()
-        w = csv.writer(si)
-        w.writerow(['id','order_number','client_id','status','created_at','delivery_date','total','notes'])
-        for r in cur.fetchall():
-            w.writerow([r['id'], r['order_number'], r['client_id'], r['status'], r['created_at'], r['delivery_date'], r['total'], r['notes']])
-        z.writestr('orders.csv', si.getvalue())
-        
-        # Inventario
-        cur.execute('SELECT * FROM inventory')
-        si = io.StringIO()
-        w = csv.writer(si)
-        w.writerow(['id','name','qty','low_threshold'])
-        for r in cur.fetchall():
-            w.writerow([r['id'], r['name'], r['qty'], r['low_threshold']])
-        z.writestr('inventory.csv', si.getvalue())
-    
-    mem.seek(0)
-    return send_file(mem, mimetype='application/zip', as_attachment=True, download_name='backup.zip')
+# ---------------------- CAMBIOS PARA SINCRONIZACIÓN ----------------------
+# Triggers en CHANGE_TABLES anotan cada alta, cambio o baja en change_log con
+# un seq creciente. /api/changes?since=<seq> devuelve lo posterior a ese seq
+# con el estado actual de cada fila, o su baja: quien sincroniza solo guarda
+# el último seq recibido y el costo depende de los cambios, no del tamaño de
+# la base. Archivar una orden la borra de main pero sigue existiendo en
+# all_orders, así que se informa como fila vigente y no como baja.
+CHANGE_SOURCES = {
+    'clients': 'clients',
+    'orders': 'all_orders',
+    'order_items': 'all_order_items',
+    'price_list': 'price_list',
+    'inventory': 'inventory',
+}
+
+def _rows_by_id(db, table, ids):
+    rows = {}
+    for start in range(0, len(ids), 500):
+        batch = ids[start:start + 500]
+        cur = db.execute(f'SELECT * FROM {CHANGE_SOURCES[table]} WHERE id IN ({",".join("?" * len(batch))})', batch)
+        columns = [d[0] for d in cur.description]
+        cur.row_factory = None
+        for raw in cur:
+            rows[raw[0]] = dict(zip(columns, raw))
+    return rows
+
+def changes_pruned_upto(db):
+    state = db.execute("SELECT high_water FROM scheduler_state WHERE name='changes_prune'").fetchone()
+    return int(state['high_water']) if state and state['high_water'] else 0
+
+def fetch_changes(db, since, limit):
+    """Cambios con seq > since: [{seq, table, id, op, row}], y si quedan más"""
+    log = db.execute('SELECT seq, table_name, row_id FROM change_log WHERE seq > ? ORDER BY seq LIMIT ?',
+                     (since, limit + 1)).fetchall()
+    has_more = len(log) > limit
+    # Varias entradas de la misma fila en la página: basta la última
+    latest = {}
+    for entry in log[:limit]:
+        latest[(entry['table_name'], entry['row_id'])] = entry['seq']
+    ids_by_table = {}
+    for table, row_id in latest:
+        ids_by_table.setdefault(table, []).append(row_id)
+    current = {table: _rows_by_id(db, table, ids) for table, ids in ids_by_table.items()}
+    changes = []
+    for (table, row_id), seq in sorted(latest.items(), key=lambda kv: kv[1]):
+        row = current[table].get(row_id)
+        changes.append({'seq': seq, 'table': table, 'id': row_id,
+                        'op': 'upsert' if row is not None else 'delete', 'row': row})
+    next_since = log[min(len(log), limit) - 1]['seq'] if log else since
+    return changes, next_since, has_more
+
+@scheduled_job('changes_prune', 'CHANGES_PRUNE_INTERVAL')
+def prune_change_log(db):
+    """Borrar entradas más viejas que CHANGES_RETENTION_DAYS y recordar hasta qué seq"""
+    cutoff = (datetime.utcnow() - timedelta(days=app.config['CHANGES_RETENTION_DAYS'])).isoformat()
+    # seq y changed_at crecen juntos: se recorre desde el inicio hasta la primera reciente
+    first_kept = db.execute('SELECT seq FROM change_log WHERE changed_at >= ? ORDER BY seq LIMIT 1',
+                            (cutoff,)).fetchone()
+    upto = (first_kept['seq'] - 1 if first_kept else
+            db.execute('SELECT COALESCE(MAX(seq), 0) FROM change_log').fetchone()[0])
+    if upto <= changes_pruned_upto(db):
+        return {'deleted': 0}
+    with db:
+        cur = db.execute('DELETE FROM change_log WHERE seq <= ?', (upto,))
+        db.execute("INSERT INTO scheduler_state (name) VALUES ('changes_prune') ON CONFLICT(name) DO NOTHING")
+        db.execute("UPDATE scheduler_state SET high_water=? WHERE name='changes_prune'", (str(upto),))
+    return {'deleted': cur.rowcount, 'pruned_upto': upto}
+
+def _changes_token_ok():
+    token = app.config['CHANGES_API_TOKEN']
+    header = request.headers.get('Authorization', '')
+    return bool(token) and header.startswith('Bearer ') and hmac.compare_digest(header[7:], token)
+
+@app.route('/api/changes')
+def api_changes():
+    """Long-poll: con wait=<s> espera hasta que haya cambios o se cumpla el plazo"""
+    if not _changes_token_ok() and session.get('user_role') != 'admin':
+        return jsonify({'error': 'No autorizado'}), 401
+    branch = request.args.get('branch') or current_branch()
+    if branch not in get_branches():
+        return jsonify({'error': 'Sucursal desconocida'}), 404
+    since = request.args.get('since', 0, type=int)
+    limit = max(1, min(request.args.get('limit', app.config['CHANGES_PAGE_SIZE'], type=int),
+                       app.config['CHANGES_PAGE_SIZE']))
+    wait = max(0.0, min(request.args.get('wait', 0, type=float), app.config['CHANGES_MAX_WAIT']))
+    db = connect_db(branch_db_path(branch))
+    try:
+        pruned = changes_pruned_upto(db)
+        if since < pruned:
+            return jsonify({'error': 'El registro ya no tiene cambios tan antiguos; hace falta una copia completa',
+                            'pruned_upto': pruned}), 410
+        deadline = time.monotonic() + wait
+        while True:
+            changes, next_since, has_more = fetch_changes(db, since, limit)
+            if changes or time.monotonic() >= deadline:
+                break
+            time.sleep(app.config['CHANGES_POLL_INTERVAL'])
+    finally:
+        db.close()
+    return jsonify({'branch': branch, 'changes': changes, 'next_since': next_since, 'has_more': has_more})
 
 # ---------------------- NOTIFICACIONES TWILIO ----------------------
 def get_twilio_client():
     sid = os.environ.get('TWILIO_ACCOUNT_SID')
     token = os.environ.get('TWILIO_AUTH_TOKEN')
-    if not sid or not token or not TWILIO_AVAILABLE:
+    if not sid or not token or not backend_available('twilio'):
         return None
-    return TwilioClient(sid, token)
+    return load_backend('twilio').Client(sid, token)
+
+NOTIFICATION_MESSAGES = {
+    'ready': 'Hola {name}, su orden {number} ya está lista. ¡Gracias por preferirnos!',
+    'overdue': 'Hola {name}, su orden {number} está demorada. Le avisaremos en cuanto esté lista. Disculpe las molestias.',
+}
 
-def send_notification(order_id, channel='sms'):
+def send_notification(order_id, channel='sms', kind='ready', db=None):
     """Enviar notificación SMS/WhatsApp al cliente"""
-    db = get_db()
+    db = db or get_db()
     cur = db.cursor()
     cur.execute('SELECT o.order_number, c.phone, c.name FROM orders o LEFT JOIN clients c ON o.client_id=c.id WHERE o.id=?', (order_id,))
     result = cur.fetchone()
@@ -658,34 +3599,31 @@ def send_notification(order_id, channel='sms'):
     else:
         to_number = phone
     
-    body = f'Hola {client_name}, su orden {order_number} ya está lista. ¡Gracias por preferirnos!'
+    body = NOTIFICATION_MESSAGES[kind].format(name=client_name, number=order_number)
     
     try:
         msg = tw_client.messages.create(body=body, from_=from_number, to=to_number)
-        log_action('send_notification', 'orders', order_id, session.get('username','system'))
+        username = session.get('username', 'system') if has_request_context() else 'system'
+        log_action('send_notification', 'orders', order_id, username, db=db)
         return msg.sid
     except Exception as e:
         raise RuntimeError(f'Error enviando mensaje: {str(e)}')
 
 # ---------------------- GENERACIÓN DE PDF ----------------------
 def generate_receipt_pdf(order_id):
-    if not REPORTLAB_AVAILABLE:
-        raise RuntimeError('reportlab no disponible. Instala con: pip install reportlab')
+    pdf = load_backend('reportlab')
     
     db = get_db()
-    cur = db.cursor()
-    cur.execute('SELECT o.*, c.name as client_name, c.phone, c.address FROM orders o LEFT JOIN clients c ON o.client_id=c.id WHERE o.id=?', (order_id,))
-    order = cur.fetchone()
+    order = orders_repo.detail.one(db, order_id)
     
     if not order:
         raise ValueError('Orden no encontrada')
     
-    cur.execute('SELECT * FROM order_items WHERE order_id=?', (order_id,))
-    items = cur.fetchall()
+    items = items_repo.by_order.all(db, order_id)
     
     bio = io.BytesIO()
-    c = pdf_canvas.Canvas(bio, pagesize=letter)
-    width, height = letter
+    c = pdf.canvas.Canvas(bio, pagesize=pdf.letter)
+    width, height = pdf.letter
     
     # Encabezado
     company = os.environ.get('COMPANY_NAME', 'Lavandería Effiwash')
@@ -702,13 +3640,13 @@ def generate_receipt_pdf(order_id):
     c.setFont('Helvetica-Bold', 16)
     c.drawString(180, y, company)
     c.setFont('Helvetica', 10)
-    c.drawString(180, y-15, f'Orden: {order["order_number"]}')
-    c.drawString(180, y-30, f'Fecha: {order["created_at"][:19]}')
+    c.drawString(180, y-15, f'Orden: {order.order_number}')
+    c.drawString(180, y-30, f'Fecha: {order.created_at[:19]}')
     
     # Información del cliente
-    c.drawString(40, y-80, f'Cliente: {order["client_name"] or "-"}')
-    c.drawString(40, y-95, f'Teléfono: {order["phone"] or "-"}')
-    c.drawString(40, y-110, f'Entrega: {order["delivery_date"] or "-"}')
+    c.drawString(40, y-80, f'Cliente: {order.client_name or "-"}')
+    c.drawString(40, y-95, f'Teléfono: {order.phone or "-"}')
+    c.drawString(40, y-110, f'Entrega: {order.delivery_date or "-"}')
     
     # Tabla de items
     start_y = y-140
@@ -722,10 +3660,10 @@ def generate_receipt_pdf(order_id):
     yy = start_y - 20
     
     for item in items:
-        c.drawString(40, yy, item['garment_type'])
-        c.drawString(200, yy, str(item['quantity']))
-        c.drawString(260, yy, f"${item['unit_price']:.2f}")
-        c.drawString(320, yy, f"${item['subtotal']:.2f}")
+        c.drawString(40, yy, item.garment_type)
+        c.drawString(200, yy, str(item.quantity))
+        c.drawString(260, yy, f"${item.unit_price:.2f}")
+        c.drawString(320, yy, f"${item.subtotal:.2f}")
         yy -= 15
         
         if yy < 100:  # Nueva página si es necesario
@@ -735,7 +3673,7 @@ def generate_receipt_pdf(order_id):
     # Total
     c.setFont('Helvetica-Bold', 12)
     c.drawString(260, yy-20, 'TOTAL:')
-    c.drawString(320, yy-20, f"${order['total']:.2f}")
+    c.drawString(320, yy-20, f"${order.total:.2f}")
     
     c.save()
     bio.seek(0)
@@ -743,6 +3681,7 @@ def generate_receipt_pdf(order_id):
 
 @app.route('/orders/<int:order_id>/receipt')
 @login_required
+@limit_concurrency('pdf')
 def order_receipt(order_id):
     try:
         pdf_io = generate_receipt_pdf(order_id)
@@ -760,7 +3699,7 @@ BASE_HTML = """
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
     <title>Sistema de Lavandería Effiwash</title>
-    <link href="https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/css/bootstrap.min.css" rel="stylesheet">
+    <link href="{{ asset_url('vendor/bootstrap-5.3.0/bootstrap.min.css') }}" rel="stylesheet">
     <style>
         .navbar-brand { font-weight: bold; }
         .table-hover tbody tr:hover { background-color: #f5f5f5; }
@@ -773,8 +3712,16 @@ BASE_HTML = """
         <div class="container">
             <a class="navbar-brand" href="/"> Lavandería Effiwash Express</a>
             <div class="navbar-nav ms-auto">
+                {% if session.user_id %}
+                <form class="d-flex me-3" action="/orders/search" role="search">
+                    <input class="form-control form-control-sm" type="search" name="q" placeholder="Buscar orden, cliente, teléfono..." value="{{ request.args.q if request.endpoint == 'order_search' else '' }}">
+                </form>
+                {% endif %}
+                {% if session.branch %}<span class="navbar-text me-3">Sucursal: {{ session.branch }}</span>{% endif %}
+                {% if session.user_id %}
                 <span class="navbar-text me-3">Usuario: {{ session.username }}</span>
                 <a class="btn btn-outline-light btn-sm" href="/logout">Cerrar Sesión</a>
+                {% endif %}
             </div>
         </div>
     </nav>
@@ -794,7 +3741,7 @@ BASE_HTML = """
         {% block content %}{% endblock %}
     </div>
 
-    <script src="https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/js/bootstrap.bundle.min.js"></script>
+    <script src="{{ asset_url('vendor/bootstrap-5.3.0/bootstrap.min.js') }}"></script>
 </body>
 </html>
 """
@@ -806,7 +3753,7 @@ LOGIN_TEMPLATE = """
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
     <title>Iniciar Sesión - Lavandería Effiwash</title>
-    <link href="https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/css/bootstrap.min.css" rel="stylesheet">
+    <link href="{{ asset_url('vendor/bootstrap-5.3.0/bootstrap.min.css') }}" rel="stylesheet">
 </head>
 <body class="bg-light d-flex align-items-center justify-content-center" style="min-height: 100vh;">
     <div class="card shadow" style="width: 100%; max-width: 400px;">
@@ -824,6 +3771,17 @@ LOGIN_TEMPLATE = """
                     <input type="password" class="form-control" name="password" required>
                 </div>
                 
+                {% if branches|length > 1 %}
+                <div class="mb-3">
+                    <label class="form-label">Sucursal:</label>
+                    <select class="form-select" name="branch">
+                        {% for name in branches %}
+                        <option value="{{ name }}">{{ name.title() }}</option>
+                        {% endfor %}
+                    </select>
+                </div>
+                {% endif %}
+                
                 <button type="submit" class="btn btn-primary w-100">Entrar al Sistema</button>
             </form>
             
@@ -840,7 +3798,7 @@ INDEX_TEMPLATE = BASE_HTML.replace('{% block content %}{% endblock %}', '''
 {% block content %}
 <div class="row">
     <div class="col-md-8">
-        <h2> Órdenes Recientes</h2>
+        <h2> Órdenes Recientes <small id="liveBadge" class="badge bg-secondary fs-6 align-middle">sin conexión</small></h2>
         <div class="table-responsive">
             <table class="table table-striped table-hover">
                 <thead class="table-dark">
@@ -852,15 +3810,16 @@ INDEX_TEMPLATE = BASE_HTML.replace('{% block content %}{% endblock %}', '''
                         <th>Acciones</th>
                     </tr>
                 </thead>
-                <tbody>
+                <tbody id="ordersBody">
                     {% for order in orders %}
-                    <tr>
+                    <tr data-order-id="{{ order.id }}">
                         <td>{{ order.order_number }}</td>
                         <td>{{ order.client_name or 'No especificado' }}</td>
                         <td>
-                            <span class="badge bg-{{ 'success' if order.status == 'listo' else 'warning' if order.status == 'pendiente' else 'secondary' }}">
+                            <span class="badge status-badge bg-{{ 'success' if order.status == 'listo' else 'warning' if order.status == 'pendiente' else 'secondary' }}">
                                 {{ order.status }}
                             </span>
+                            {% if order.overdue_at and order.status == 'pendiente' %}<span class="badge bg-danger">vencida</span>{% endif %}
                         </td>
                         <td>${{ "%.2f"|format(order.total or 0) }}</td>
                         <td>
@@ -884,7 +3843,7 @@ INDEX_TEMPLATE = BASE_HTML.replace('{% block content %}{% endblock %}', '''
                         {% for item in low_items %}
                         <li class="list-group-item d-flex justify-content-between align-items-center">
                             {{ item.name }}
-                            <span class="badge bg-danger rounded-pill">{{ item.qty }}</span>
+                            <span class="badge bg-danger rounded-pill">{{ "%g"|format(item.qty|round(2)) }}</span>
                         </li>
                         {% endfor %}
                     </ul>
@@ -901,11 +3860,52 @@ INDEX_TEMPLATE = BASE_HTML.replace('{% block content %}{% endblock %}', '''
             <div class="card-body">
                 <a href="/orders/new" class="btn btn-success w-100 mb-2"> Nueva Orden</a>
                 <a href="/clients" class="btn btn-outline-primary w-100 mb-2"> Gestionar Clientes</a>
+                <a href="/loads" class="btn btn-outline-secondary w-100 mb-2"> Cargas de Lavado</a>
                 <a href="/reports" class="btn btn-outline-info w-100"> Ver Reportes</a>
             </div>
         </div>
     </div>
 </div>
+
+<script>
+// Tablero en vivo: recibe creaciones y cambios de estado por Server-Sent Events
+const statusColor = s => s === 'listo' ? 'success' : s === 'pendiente' ? 'warning' : 'secondary';
+function renderRow(row, ev) {
+    row.dataset.orderId = ev.order_id;
+    row.innerHTML = '<td></td><td></td><td><span class="badge status-badge"></span></td><td></td>' +
+                    '<td><a class="btn btn-sm btn-info">Ver</a></td>';
+    row.cells[0].textContent = ev.order_number;
+    row.cells[1].textContent = ev.client_name || 'No especificado';
+    row.cells[3].textContent = '$' + (ev.total || 0).toFixed(2);
+    row.querySelector('a').href = '/orders/' + ev.order_id;
+    setStatus(row, ev.status);
+}
+function setStatus(row, status) {
+    const badge = row.querySelector('.status-badge');
+    badge.className = 'badge status-badge bg-' + statusColor(status);
+    badge.textContent = status;
+}
+if (window.EventSource) {
+    const badge = document.getElementById('liveBadge');
+    const source = new EventSource('/board/stream');
+    source.onopen = () => { badge.className = 'badge bg-success fs-6 align-middle'; badge.textContent = 'en vivo'; };
+    source.onerror = () => { badge.className = 'badge bg-secondary fs-6 align-middle'; badge.textContent = 'reconectando'; };
+    source.addEventListener('order', e => {
+        const ev = JSON.parse(e.data);
+        if (!ev.order_number) return;  // orden borrada
+        const body = document.getElementById('ordersBody');
+        let row = body.querySelector(`tr[data-order-id="${ev.order_id}"]`);
+        if (row) {
+            setStatus(row, ev.status);
+        } else if (ev.kind === 'created') {
+            row = document.createElement('tr');
+            renderRow(row, ev);
+            body.prepend(row);
+            while (body.rows.length > 20) body.deleteRow(-1);
+        }
+    });
+}
+</script>
 {% endblock %}
 ''')
 
@@ -916,13 +3916,38 @@ CLIENTS_TEMPLATE = BASE_HTML.replace('{% block content %}{% endblock %}', '''
     <a href="/clients/new" class="btn btn-success"> Nuevo Cliente</a>
 </div>
 
+<form method="get" class="row g-2 align-items-end mb-3">
+    <input type="hidden" name="sort" value="{{ sort }}">
+    <div class="col-auto">
+        <label class="form-label small">Mínimo de órdenes</label>
+        <input type="number" class="form-control form-control-sm" name="min_orders" min="0" value="{{ min_orders or '' }}">
+    </div>
+    <div class="col-auto">
+        <label class="form-label small">Gasto mínimo ($)</label>
+        <input type="number" step="0.01" class="form-control form-control-sm" name="min_spent" min="0" value="{{ min_spent or '' }}">
+    </div>
+    <div class="col-auto">
+        <button type="submit" class="btn btn-sm btn-primary">Filtrar</button>
+        <a href="/clients" class="btn btn-sm btn-outline-secondary">Limpiar</a>
+    </div>
+</form>
+
+{% macro sort_link(key, label) -%}
+<a class="text-white{{ ' fw-bold' if sort == key else ' text-decoration-none' }}"
+   href="?sort={{ key }}{% if min_orders %}&min_orders={{ min_orders }}{% endif %}{% if min_spent %}&min_spent={{ min_spent }}{% endif %}">{{ label }}</a>
+{%- endmacro %}
+
 <div class="table-responsive">
     <table class="table table-striped table-hover">
         <thead class="table-dark">
             <tr>
-                <th>Nombre</th>
+                <th>{{ sort_link('name', 'Nombre') }}</th>
                 <th>Teléfono</th>
                 <th>Dirección</th>
+                <th>{{ sort_link('orders', 'Órdenes') }}</th>
+                <th>{{ sort_link('spent', 'Total Gastado') }}</th>
+                <th>{{ sort_link('avg', 'Ticket Promedio') }}</th>
+                <th>{{ sort_link('last', 'Última Orden') }}</th>
                 <th>Acciones</th>
             </tr>
         </thead>
@@ -932,6 +3957,10 @@ CLIENTS_TEMPLATE = BASE_HTML.replace('{% block content %}{% endblock %}', '''
                 <td>{{ client.name }}</td>
                 <td>{{ client.phone }}</td>
                 <td>{{ client.address or '-' }}</td>
+                <td>{{ client.order_count }}</td>
+                <td>${{ "%.2f"|format(client.total_spent) }}</td>
+                <td>${{ "%.2f"|format(client.avg_ticket) }}</td>
+                <td>{{ client.last_order_at[:10] if client.last_order_at else '-' }}</td>
                 <td>
                     <a href="/clients/{{ client.id }}" class="btn btn-sm btn-info"> Ver Órdenes</a>
                 </td>
@@ -993,6 +4022,9 @@ CLIENT_DETAIL_TEMPLATE = BASE_HTML.replace('{% block content %}{% endblock %}',
                 <p><strong>Teléfono:</strong> {{ client.phone }}</p>
                 <p><strong>Dirección:</strong> {{ client.address or 'No especificada' }}</p>
                 <p><strong>Fecha de registro:</strong> {{ client.created_at[:10] }}</p>
+                <p><strong>Órdenes:</strong> {{ client.order_count }} &middot;
+                   <strong>Total gastado:</strong> ${{ "%.2f"|format(client.total_spent) }} &middot;
+                   <strong>Ticket promedio:</strong> ${{ "%.2f"|format(client.avg_ticket) }}</p>
             </div>
         </div>
     </div>
@@ -1003,7 +4035,6 @@ CLIENT_DETAIL_TEMPLATE = BASE_HTML.replace('{% block content %}{% endblock %}',
                 <h5 class="mb-0">Órdenes del Cliente</h5>
             </div>
             <div class="card-body">
-                {% if orders %}
                     <div class="list-group">
                         {% for order in orders %}
                         <a href="/orders/{{ order.id }}" class="list-group-item list-group-item-action">
@@ -1016,11 +4047,10 @@ CLIENT_DETAIL_TEMPLATE = BASE_HTML.replace('{% block content %}{% endblock %}',
                             <p class="mb-1">Total: ${{ "%.2f"|format(order.total or 0) }}</p>
                             <small>Entrega: {{ order.delivery_date or 'No especificada' }}</small>
                         </a>
+                        {% else %}
+                    <p class="text-muted">Este cliente no tiene órdenes registradas.</p>
                         {% endfor %}
                     </div>
-                {% else %}
-                    <p class="text-muted">Este cliente no tiene órdenes registradas.</p>
-                {% endif %}
             </div>
         </div>
     </div>
@@ -1044,6 +4074,8 @@ INVENTORY_TEMPLATE = BASE_HTML.replace('{% block content %}{% endblock %}', '''
                 <th>Producto</th>
                 <th>Cantidad</th>
                 <th>Umbral Mínimo</th>
+                <th>Consumo diario</th>
+                <th>Se agota</th>
                 <th>Estado</th>
                 {% if session.user_role == 'admin' %}
                 <th>Acciones</th>
@@ -1054,8 +4086,11 @@ INVENTORY_TEMPLATE = BASE_HTML.replace('{% block content %}{% endblock %}', '''
             {% for item in items %}
             <tr>
                 <td>{{ item.name }}</td>
-                <td>{{ item.qty }}</td>
+                {% set f = forecast.get(item.id) %}
+                <td>{{ "%g"|format(item.qty|round(2)) }}</td>
                 <td>{{ item.low_threshold }}</td>
+                <td>{{ "%.2f"|format(f.daily) if f else '-' }}{% if f and f.trend > 0.001 %} <small class="text-danger">↑</small>{% endif %}</td>
+                <td>{{ f.date.strftime('%d/%m/%Y') if f and f.date else '-' }}</td>
                 <td>
                     {% if item.qty <= item.low_threshold %}
                     <span class="badge bg-danger">Bajo Stock</span>
@@ -1066,6 +4101,7 @@ INVENTORY_TEMPLATE = BASE_HTML.replace('{% block content %}{% endblock %}', '''
                 {% if session.user_role == 'admin' %}
                 <td>
                     <a href="/inventory/edit/{{ item.id }}" class="btn btn-sm btn-warning">Editar</a>
+                    <a href="/inventory/{{ item.id }}/rates" class="btn btn-sm btn-outline-secondary">Consumo</a>
                 </td>
                 {% endif %}
             </tr>
@@ -1090,12 +4126,16 @@ INVENTORY_EDIT_TEMPLATE = BASE_HTML.replace('{% block content %}{% endblock %}',
                     </div>
                     <div class="mb-3">
                         <label class="form-label">Cantidad en stock:</label>
-                        <input type="number" class="form-control" name="qty" value="{{ item.qty if item else 0 }}" required min="0">
+                        <input type="number" class="form-control" name="qty" value="{{ item.qty|round(2) if item else 0 }}" required min="0" step="any">
                     </div>
                     <div class="mb-3">
                         <label class="form-label">Umbral mínimo (alerta):</label>
                         <input type="number" class="form-control" name="low_threshold" value="{{ item.low_threshold if item else 5 }}" required min="1">
                     </div>
+                    <div class="mb-3">
+                        <label class="form-label">Consumo por orden (p. ej. bolsas):</label>
+                        <input type="number" class="form-control" name="per_order" value="{{ item.per_order if item else 0 }}" min="0" step="any">
+                    </div>
                     <div class="d-grid gap-2">
                         <button type="submit" class="btn btn-primary">{% if item %}Actualizar{% else %}Crear{% endif %} Producto</button>
                         <a href="/inventory" class="btn btn-secondary">Cancelar</a>
@@ -1108,6 +4148,37 @@ INVENTORY_EDIT_TEMPLATE = BASE_HTML.replace('{% block content %}{% endblock %}',
 {% endblock %}
 ''')
 
+INVENTORY_RATES_TEMPLATE = BASE_HTML.replace('{% block content %}{% endblock %}', '''
+{% block content %}
+<div class="d-flex justify-content-between align-items-center mb-4">
+    <h2> Consumo de {{ item.name }}</h2>
+    <a href="/inventory" class="btn btn-secondary">← Volver a Inventario</a>
+</div>
+<p class="text-muted">Unidades de {{ item.name }} que consume cada pieza. Vacío o 0: la prenda no lo consume.</p>
+<form method="post">
+    <div class="row">
+        {% for category, garments in garments_by_category.items() %}
+        <div class="col-md-4 mb-3">
+            <div class="card">
+                <div class="card-header">{{ category.replace('_', ' ').title() }}</div>
+                <div class="card-body">
+                    {% for g in garments %}
+                    <div class="input-group input-group-sm mb-2">
+                        <span class="input-group-text w-50">{{ g.garment_type.title() }}</span>
+                        <input type="number" class="form-control" name="rate_{{ g.garment_type }}"
+                               value="{{ rates.get(g.garment_type, '') }}" min="0" step="any">
+                    </div>
+                    {% endfor %}
+                </div>
+            </div>
+        </div>
+        {% endfor %}
+    </div>
+    <button type="submit" class="btn btn-primary">Guardar</button>
+</form>
+{% endblock %}
+''')
+
 PRICES_TEMPLATE = BASE_HTML.replace('{% block content %}{% endblock %}', '''
 {% block content %}
 <div class="d-flex justify-content-between align-items-center mb-4">
@@ -1239,6 +4310,7 @@ NEW_ORDER_TEMPLATE = BASE_HTML.replace('{% block content %}{% endblock %}', '''
         <div class="card">
             <div class="card-body">
                 <form method="post" id="orderForm">
+                    <input type="hidden" name="idempotency_key" value="{{ idempotency_key }}">
                     <div class="row mb-3">
                         <div class="col-md-6">
                             <label class="form-label">👤 Cliente (opcional):</label>
@@ -1253,6 +4325,7 @@ NEW_ORDER_TEMPLATE = BASE_HTML.replace('{% block content %}{% endblock %}', '''
                             <label class="form-label">📅 Fecha de entrega:</label>
                             <input type="date" class="form-control" name="delivery_date" required 
                                    min="{{ today }}" value="{{ today }}">
+                            <div id="deliverySlots" class="form-text"></div>
                         </div>
                     </div>
                     
@@ -1489,6 +4562,41 @@ function updateOrderSummary() {
     }
     
     totalSpan.textContent = `$${total.toFixed(2)}`;
+    refreshDeliverySlots();
+}
+
+// Fechas de entrega con capacidad para las prendas elegidas
+let slotsTimer = null;
+function refreshDeliverySlots() {
+    clearTimeout(slotsTimer);
+    slotsTimer = setTimeout(async () => {
+        const deliveryInput = document.querySelector('input[name="delivery_date"]');
+        const params = new URLSearchParams({date: deliveryInput.value});
+        for (const [garment, data] of Object.entries(selectedItems)) {
+            params.append(`qty_${garment}`, data.quantity);
+        }
+        const box = document.getElementById('deliverySlots');
+        try {
+            const res = await fetch('/api/delivery-slots?' + params);
+            if (!res.ok) return;
+            const slots = await res.json();
+            box.innerHTML = '';
+            if (slots.date_ok === false) {
+                box.insertAdjacentHTML('beforeend', '<span class="text-danger d-block">Esa fecha ya no tiene capacidad para esta orden.</span>');
+            }
+            box.insertAdjacentHTML('beforeend', slots.dates.length ? 'Disponibles: ' : 'Sin fechas disponibles en el horizonte');
+            for (const day of slots.dates) {
+                const btn = document.createElement('button');
+                btn.type = 'button';
+                btn.className = 'btn btn-sm py-0 me-1 ' + (day === deliveryInput.value ? 'btn-primary' : 'btn-outline-primary');
+                btn.textContent = day.split('-').reverse().join('/');
+                btn.addEventListener('click', () => { deliveryInput.value = day; refreshDeliverySlots(); });
+                box.appendChild(btn);
+            }
+        } catch (e) {
+            box.textContent = '';
+        }
+    }, 250);
 }
 
 // Función para capitalizar texto (title case)
@@ -1507,6 +4615,8 @@ document.addEventListener('DOMContentLoaded', function() {
         if (!deliveryInput.value) {
             deliveryInput.value = today;
         }
+        deliveryInput.addEventListener('change', refreshDeliverySlots);
+        refreshDeliverySlots();
     }
     
     // Inicializar todos los inputs para que tengan evento de cambio
@@ -1630,6 +4740,10 @@ REPORTS_TEMPLATE = BASE_HTML.replace('{% block content %}{% endblock %}', '''
         <a href="/export/orders.xlsx" class="btn btn-outline-primary"> Exportar Excel</a>
         {% if session.user_role == 'admin' %}
         <a href="/export/backup_all.zip" class="btn btn-outline-warning"> Backup Completo</a>
+        {% if multi_branch %}
+        <a href="/reports/chain" class="btn btn-outline-dark"> Reporte de Cadena</a>
+        {% endif %}
+        <a href="/admin/maintenance" class="btn btn-outline-secondary"> Mantenimiento</a>
         {% endif %}
     </div>
 </div>
@@ -1675,22 +4789,50 @@ REPORTS_TEMPLATE = BASE_HTML.replace('{% block content %}{% endblock %}', '''
         <h5 class="mb-0"> Herramientas de Exportación</h5>
     </div>
     <div class="card-body">
+        <p class="text-muted small">Las exportaciones se generan en segundo plano; la descarga queda disponible al terminar.</p>
         <div class="row">
             <div class="col-md-4 text-center">
                 <h6> Exportar CSV</h6>
                 <p class="text-muted">Formato compatible con Excel</p>
-                <a href="/export/orders.csv" class="btn btn-outline-success">Descargar CSV</a>
+                <form method="post" action="/exports/orders_csv">
+                    <div class="input-group input-group-sm mb-2">
+                        <input type="date" class="form-control" name="since" title="Desde">
+                        <input type="date" class="form-control" name="until" title="Hasta (excluida)">
+                    </div>
+                    <button type="submit" class="btn btn-outline-success">Generar CSV</button>
+                </form>
             </div>
             <div class="col-md-4 text-center">
                 <h6> Exportar Excel</h6>
                 <p class="text-muted">Formato .xlsx avanzado</p>
-                <a href="/export/orders.xlsx" class="btn btn-outline-primary">Descargar Excel</a>
+                <form method="post" action="/exports/orders_xlsx">
+                    <div class="input-group input-group-sm mb-2">
+                        <input type="date" class="form-control" name="since" title="Desde">
+                        <input type="date" class="form-control" name="until" title="Hasta (excluida)">
+                    </div>
+                    <button type="submit" class="btn btn-outline-primary">Generar Excel</button>
+                </form>
             </div>
             {% if session.user_role == 'admin' %}
             <div class="col-md-4 text-center">
                 <h6> Backup Completo</h6>
                 <p class="text-muted">Respaldo de toda la base</p>
-                <a href="/export/backup_all.zip" class="btn btn-outline-warning">Descargar Backup</a>
+                <form method="post" action="/exports/backup_zip">
+                    <button type="submit" class="btn btn-outline-warning">Generar Backup</button>
+                </form>
+            </div>
+            {% endif %}
+            {% if parquet_available %}
+            <div class="col-md-4 text-center">
+                <h6> Exportar Parquet</h6>
+                <p class="text-muted">Órdenes con sus prendas, para análisis</p>
+                <form method="post" action="/exports/orders_parquet">
+                    <div class="input-group input-group-sm mb-2">
+                        <input type="date" class="form-control" name="since" title="Desde">
+                        <input type="date" class="form-control" name="until" title="Hasta (excluida)">
+                    </div>
+                    <button type="submit" class="btn btn-outline-info">Generar Parquet</button>
+                </form>
             </div>
             {% endif %}
         </div>
@@ -1699,9 +4841,356 @@ REPORTS_TEMPLATE = BASE_HTML.replace('{% block content %}{% endblock %}', '''
 {% endblock %}
 ''')
 
+PUBLIC_STATUS_TEMPLATE = BASE_HTML.replace('{% block content %}{% endblock %}', '''
+{% block content %}
+<div class="row justify-content-center">
+    <div class="col-md-6">
+        <h2> Consultar mi Orden</h2>
+        <div class="card mb-3">
+            <div class="card-body">
+                <form action="/estado">
+                    {% if branches|length > 1 %}
+                    <div class="mb-3">
+                        <label class="form-label">Sucursal:</label>
+                        <select class="form-select" name="branch">
+                            {% for b in branches %}<option value="{{ b }}" {{ 'selected' if request.args.branch == b }}>{{ b }}</option>{% endfor %}
+                        </select>
+                    </div>
+                    {% endif %}
+                    <div class="mb-3">
+                        <label class="form-label">Número de orden:</label>
+                        <input type="text" class="form-control" name="order" value="{{ request.args.order or '' }}" required>
+                    </div>
+                    <div class="mb-3">
+                        <label class="form-label">Últimos {{ digits }} dígitos de su teléfono:</label>
+                        <input type="text" class="form-control" name="phone" inputmode="numeric" required
+                               minlength="{{ digits }}" maxlength="{{ digits }}">
+                    </div>
+                    <button class="btn btn-primary w-100">Consultar</button>
+                </form>
+            </div>
+        </div>
+        {% if retry %}
+        <div class="alert alert-warning">Demasiadas consultas. Intente de nuevo en {{ retry }} segundos.</div>
+        {% elif result %}
+        <div class="card">
+            <div class="card-body">
+                <h5>Orden #{{ result.order_number }}</h5>
+                <p class="mb-1">Estado:
+                    <span class="badge bg-{{ 'success' if result.status == 'listo' else 'warning' if result.status == 'pendiente' else 'secondary' }}">{{ result.status }}</span>
+                    {% if result.overdue %}<span class="badge bg-danger">vencida</span>{% endif %}
+                </p>
+                <p class="mb-0">Entrega: {{ result.delivery_date or 'No especificada' }}</p>
+            </div>
+        </div>
+        {% elif searched %}
+        <div class="alert alert-danger">No encontramos una orden con esos datos.</div>
+        {% endif %}
+    </div>
+</div>
+{% endblock %}
+''')
+
+WASH_LOADS_TEMPLATE = BASE_HTML.replace('{% block content %}{% endblock %}', '''
+{% block content %}
+<div class="d-flex justify-content-between align-items-center mb-4">
+    <h2> Cargas de Lavado</h2>
+    <a href="/" class="btn btn-secondary">← Volver</a>
+</div>
+<p class="text-muted">
+    {{ loads|length }} carga(s) de {{ "%.0f"|format(capacity) }} kg para las órdenes pendientes
+    (mínimo teórico: {{ lower_bound }}). Lavar en este orden.
+</p>
+<div class="table-responsive">
+    <table class="table table-striped">
+        <thead class="table-dark">
+            <tr><th>#</th><th>Programa</th><th>Entrega</th><th>Peso</th><th>Prendas</th></tr>
+        </thead>
+        <tbody>
+            {% for load in loads %}
+            <tr>
+                <td>{{ loop.index }}</td>
+                <td>{{ load.program }}</td>
+                <td>
+                    {{ load.due or 'Sin fecha' }}
+                    {% if load.due and load.due < today %}<span class="badge bg-danger">vencida</span>{% endif %}
+                </td>
+                <td>
+                    {{ "%.1f"|format(load.weight_kg) }} kg
+                    <div class="progress" style="height: 6px;">
+                        <div class="progress-bar {{ 'bg-danger' if load.overweight }}" style="width: {{ [load.fill * 100, 100]|min }}%"></div>
+                    </div>
+                    {% if load.overweight %}<small class="text-danger">Pieza más pesada que la capacidad</small>{% endif %}
+                </td>
+                <td>
+                    {% for number, garment, qty in load['items'] %}
+                    <small class="d-block">{{ number }}: {{ qty }} × {{ garment }}</small>
+                    {% endfor %}
+                </td>
+            </tr>
+            {% else %}
+            <tr><td colspan="5" class="text-center text-muted">No hay prendas pendientes</td></tr>
+            {% endfor %}
+        </tbody>
+    </table>
+</div>
+{% endblock %}
+''')
+
+SEARCH_TEMPLATE = BASE_HTML.replace('{% block content %}{% endblock %}', '''
+{% block content %}
+{% macro search_url(status=status, month=month, page=1) -%}
+/orders/search?{{ {'q': q, 'status': status or '', 'month': month or '', 'page': page}|urlencode }}
+{%- endmacro %}
+<h2> Buscar Órdenes</h2>
+<form class="row g-2 mb-3" action="/orders/search">
+    <div class="col-md-8">
+        <input class="form-control" type="search" name="q" value="{{ q }}" autofocus
+               placeholder="Número de orden, notas, cliente, teléfono o prenda">
+    </div>
+    <div class="col-md-2"><button class="btn btn-primary w-100">Buscar</button></div>
+</form>
+{% if q %}
+<div class="row">
+    <div class="col-md-3">
+        <div class="card mb-3">
+            <div class="card-header">Estado</div>
+            <div class="list-group list-group-flush">
+                {% for s, n in by_status.items() %}
+                <a class="list-group-item d-flex justify-content-between {{ 'active' if s == status }}"
+                   href="{{ search_url(status=None if s == status else s) }}">{{ s }} <span class="badge bg-secondary">{{ n }}</span></a>
+                {% endfor %}
+            </div>
+        </div>
+        <div class="card">
+            <div class="card-header">Mes de creación</div>
+            <div class="list-group list-group-flush">
+                {% for m, n in by_month.items() %}
+                <a class="list-group-item d-flex justify-content-between {{ 'active' if m == month }}"
+                   href="{{ search_url(month=None if m == month else m) }}">{{ m or 'sin fecha' }} <span class="badge bg-secondary">{{ n }}</span></a>
+                {% endfor %}
+            </div>
+        </div>
+    </div>
+    <div class="col-md-9">
+        <p class="text-muted small">{{ '%d+' % limit if total >= limit else total }} resultado(s) en {{ "%.1f"|format(elapsed_ms) }} ms
+            {% if total >= limit %}(las facetas cuentan las {{ limit }} más recientes){% endif %}</p>
+        <table class="table table-striped table-hover">
+            <thead class="table-dark">
+                <tr><th># Orden</th><th>Cliente</th><th>Teléfono</th><th>Estado</th><th>Creada</th><th>Total</th></tr>
+            </thead>
+            <tbody>
+                {% for h in hits %}
+                <tr>
+                    <td><a href="/orders/{{ h.id }}">{{ h.order_number }}</a></td>
+                    <td>{{ h.client_name or '-' }}</td>
+                    <td>{{ h.phone or '-' }}</td>
+                    <td>{{ h.status }}</td>
+                    <td>{{ (h.created_at or '')[:10] }}</td>
+                    <td>${{ "%.2f"|format(h.total or 0) }}</td>
+                </tr>
+                {% else %}
+                <tr><td colspan="6" class="text-center text-muted">Sin resultados</td></tr>
+                {% endfor %}
+            </tbody>
+        </table>
+        {% if pages > 1 %}
+        <nav><ul class="pagination pagination-sm">
+            {% if page > 1 %}<li class="page-item"><a class="page-link" href="{{ search_url(page=page - 1) }}">Anterior</a></li>{% endif %}
+            <li class="page-item disabled"><span class="page-link">{{ page }} / {{ pages }}</span></li>
+            {% if page < pages %}<li class="page-item"><a class="page-link" href="{{ search_url(page=page + 1) }}">Siguiente</a></li>{% endif %}
+        </ul></nav>
+        {% endif %}
+    </div>
+</div>
+{% endif %}
+{% endblock %}
+''')
+
+MAINTENANCE_TEMPLATE = BASE_HTML.replace('{% block content %}{% endblock %}', '''
+{% block content %}
+<div class="d-flex justify-content-between align-items-center mb-4">
+    <h2> Mantenimiento de la Base</h2>
+    <a href="/reports" class="btn btn-secondary">← Volver</a>
+</div>
+{% if not scheduler_enabled %}
+<div class="alert alert-warning">El planificador está desactivado (SCHEDULER_ENABLED=0): las tareas solo corren con <code>flask run-job</code>.</div>
+{% endif %}
+{% for branch, jobs, stats in branches %}
+<div class="card mb-4">
+    <div class="card-header d-flex justify-content-between">
+        <h5 class="mb-0">{{ branch.title() }}</h5>
+        <span class="text-muted small">
+            {{ "%.1f"|format(stats.size_mb) }} MB, {{ "%.1f"|format(stats.free_mb) }} MB libres
+            ({{ stats.free_pages }} páginas) · auto_vacuum {{ stats.auto_vacuum }}
+        </span>
+    </div>
+    <div class="card-body">
+        <table class="table table-sm">
+            <thead>
+                <tr><th>Tarea</th><th>Última ejecución (UTC)</th><th>Duración</th><th>Resultado</th></tr>
+            </thead>
+            <tbody>
+                {% for name in maintenance_jobs %}
+                {% set job = jobs.get(name) %}
+                <tr>
+                    <td>{{ name }}</td>
+                    <td>{{ job.last_run_at[:19] if job and job.last_run_at else 'nunca' }}</td>
+                    <td>{{ "%.2f s"|format(job.last_duration) if job and job.last_duration is not none else '-' }}</td>
+                    <td>
+                        {% if job and job.last_result %}
+                        {% set failed = job.last_result.error or job.last_result.ok == false %}
+                        <code class="{{ 'text-danger' if failed else '' }}">{{ job.last_result|tojson }}</code>
+                        {% else %}-{% endif %}
+                    </td>
+                </tr>
+                {% endfor %}
+            </tbody>
+        </table>
+        <h6 class="mt-3">Otras tareas</h6>
+        <table class="table table-sm text-muted">
+            <tbody>
+                {% for name, job in jobs.items() if name not in maintenance_jobs %}
+                <tr>
+                    <td>{{ name }}</td>
+                    <td>{{ job.last_run_at[:19] if job.last_run_at else 'nunca' }}</td>
+                    <td>{{ "%.2f s"|format(job.last_duration) if job.last_duration is not none else '-' }}</td>
+                    <td><code>{{ job.last_result|tojson if job.last_result else '-' }}</code></td>
+                </tr>
+                {% endfor %}
+            </tbody>
+        </table>
+    </div>
+</div>
+{% endfor %}
+{% endblock %}
+''')
+
+CHAIN_REPORTS_TEMPLATE = BASE_HTML.replace('{% block content %}{% endblock %}', '''
+{% block content %}
+<div class="d-flex justify-content-between align-items-center mb-4">
+    <h2> Reporte de la Cadena</h2>
+    <div>
+        <a href="/export/chain_orders.csv" class="btn btn-outline-success"> Exportar CSV de la Cadena</a>
+        <a href="/reports" class="btn btn-secondary">← Volver</a>
+    </div>
+</div>
+
+<div class="row">
+    <div class="col-md-6">
+        <div class="card">
+            <div class="card-header bg-success text-white">
+                <h5 class="mb-0"> Ventas del Día por Sucursal</h5>
+            </div>
+            <div class="card-body">
+                <table class="table table-sm">
+                    <tbody>
+                        {% for branch, total in sales %}
+                        <tr>
+                            <td>{{ branch.title() }}</td>
+                            <td class="text-end">${{ "%.2f"|format(total) }}</td>
+                        </tr>
+                        {% endfor %}
+                    </tbody>
+                    <tfoot>
+                        <tr class="table-success">
+                            <td><strong>Total cadena</strong></td>
+                            <td class="text-end"><strong>${{ "%.2f"|format(chain_total) }}</strong></td>
+                        </tr>
+                    </tfoot>
+                </table>
+            </div>
+        </div>
+    </div>
+
+    <div class="col-md-6">
+        <div class="card">
+            <div class="card-header bg-info text-white">
+                <h5 class="mb-0"> Servicios Más Populares (Cadena)</h5>
+            </div>
+            <div class="card-body">
+                {% if popular %}
+                <div class="list-group">
+                    {% for garment, q in popular %}
+                    <div class="list-group-item d-flex justify-content-between align-items-center">
+                        {{ garment.title() }}
+                        <span class="badge bg-primary rounded-pill">{{ q }}</span>
+                    </div>
+                    {% endfor %}
+                </div>
+                {% else %}
+                <p class="text-muted">No hay datos suficientes</p>
+                {% endif %}
+            </div>
+        </div>
+    </div>
+</div>
+{% endblock %}
+''')
+
+EXPORT_JOB_TEMPLATE = BASE_HTML.replace('{% block content %}{% endblock %}', '''
+{% block content %}
+<div class="row justify-content-center">
+    <div class="col-md-6">
+        <h2> Exportación en Curso</h2>
+        <div class="card">
+            <div class="card-body">
+                <p id="jobStatus" class="mb-2">En cola...</p>
+                <div class="progress mb-3">
+                    <div id="jobBar" class="progress-bar" role="progressbar" style="width: 0%">0%</div>
+                </div>
+                <div class="d-grid gap-2">
+                    <a id="jobDownload" href="#" class="btn btn-success d-none">Descargar</a>
+                    <a href="/reports" class="btn btn-secondary">← Volver a Reportes</a>
+                </div>
+            </div>
+        </div>
+    </div>
+</div>
+
+<script>
+const labels = { queued: 'En cola...', running: 'Generando...', done: 'Listo', error: 'Error' };
+function poll() {
+    fetch('/exports/jobs/{{ job_id }}/status')
+        .then(r => r.json())
+        .then(job => {
+            if (job.error && !job.status) {
+                document.getElementById('jobStatus').textContent = job.error;
+                return;
+            }
+            const bar = document.getElementById('jobBar');
+            bar.style.width = job.percent + '%';
+            bar.textContent = job.percent + '%';
+            let text = labels[job.status] || job.status;
+            if (job.status === 'running' && job.total) {
+                text += ` (${job.progress} de ${job.total} filas)`;
+            }
+            if (job.status === 'error') {
+                text += ': ' + job.error;
+                bar.classList.add('bg-danger');
+            }
+            document.getElementById('jobStatus').textContent = text;
+            if (job.status === 'done') {
+                const link = document.getElementById('jobDownload');
+                link.href = job.download_url;
+                link.classList.remove('d-none');
+            } else if (job.status !== 'error') {
+                setTimeout(poll, 1000);
+            }
+        })
+        .catch(() => setTimeout(poll, 3000));
+}
+poll();
+</script>
+{% endblock %}
+''')
+
 # ---------------------- EJECUCIÓN ----------------------
 if __name__ == '__main__':
     print(" Sistema de Lavandería Effiwash iniciando...")
     print(" Accede en: http://localhost:5000")
     print(" Usuario: admin / Contraseña: admin123")
+    # En desarrollo se inicializa aquí; en producción usar init-db + wsgi.py
+    with app.app_context():
+        init_db()
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
@@ -0,0 +1,50 @@
+"""Piezas compartidas por los benchmarks.
+
+bench_app importa app.py con DB_PATH en un directorio temporal y el
+programador de tareas apagado; new_db crea el esquema (opcionalmente sin
+triggers, para cargas masivas) y timed devuelve el mejor de varios tiempos.
+"""
+import contextlib
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@contextlib.contextmanager
+def bench_app(db_name='bench.db'):
+    """Devuelve (módulo app, ruta de la base) dentro de un directorio temporal."""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, db_name)
+        os.environ['DB_PATH'] = path
+        os.environ['SCHEDULER_ENABLED'] = '0'
+        if ROOT not in sys.path:
+            sys.path.insert(0, ROOT)
+        import app as app_module
+        yield app_module, path
+
+
+def new_db(app_module, path, triggers=True):
+    db = app_module.connect_db(path)
+    app_module.init_db(db)
+    if not triggers:
+        # Carga inicial sin triggers (búsqueda, change_log, capacidad); cada benchmark reconstruye lo que mide
+        for (name,) in db.execute("SELECT name FROM sqlite_master WHERE type='trigger'").fetchall():
+            db.execute(f'DROP TRIGGER {name}')
+    return db
+
+
+def timed_result(fn, repeat=3):
+    """Mejor tiempo en ms y el resultado de la última ejecución."""
+    best, result = float('inf'), None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - t0)
+    return best * 1000, result
+
+
+def timed(fn, repeat=3):
+    return timed_result(fn, repeat)[0]
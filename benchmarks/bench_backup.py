@@ -0,0 +1,83 @@
+"""Respaldos incrementales sobre una base sintética grande.
+
+Crea una base de ~N MiB (órdenes con notas de relleno) y mide:
+  - la copia base
+  - un delta después de cambiar unas pocas órdenes (tiempo y tamaño)
+  - la restauración a la hora del último delta
+
+    python benchmarks/bench_backup.py [MiB] [deltas]
+"""
+import os
+import random
+import sqlite3
+import sys
+import time
+
+from _common import bench_app, new_db
+ROW_BYTES = 1024
+
+
+def build(app_module, path, mib):
+    db = new_db(app_module, path, triggers=False)
+    rows = mib * 1024 * 1024 // ROW_BYTES
+    batch = 20000
+    for start in range(0, rows, batch):
+        with db:
+            db.executemany('INSERT INTO orders (order_number,client_id,status,created_at,delivery_date,total,notes) '
+                           'VALUES (?,?,?,?,?,?,?)',
+                           ((f'B-{i}', None, 'entregado', '2024-01-01T10:00:00', '2024-01-03', 100.0,
+                             os.urandom(ROW_BYTES // 2 - 60).hex())
+                            for i in range(start, min(rows, start + batch))))
+    db.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    return db, rows
+
+
+def touch(db, rows, rnd, count):
+    with db:
+        db.executemany('UPDATE orders SET status=? WHERE id=?',
+                       (('listo', rnd.randint(1, rows)) for _ in range(count)))
+        db.executemany('INSERT INTO orders (order_number,status,created_at,notes) VALUES (?,?,?,?)',
+                       ((f'N-{time.time_ns()}-{i}', 'pendiente', '2024-02-01T10:00:00', 'nueva')
+                        for i in range(count)))
+
+
+def dir_size(path):
+    return sum(os.path.getsize(os.path.join(d, f)) for d, _, files in os.walk(path) for f in files)
+
+
+def main():
+    mib = int(sys.argv[1]) if len(sys.argv) > 1 else 2048
+    deltas = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    with bench_app('lavanderia.db') as (app_module, path):
+        t0 = time.perf_counter()
+        db, rows = build(app_module, path, mib)
+        print(f'base sintética: {os.path.getsize(path) / 2**20:.0f} MiB, {rows} órdenes '
+              f'(creada en {time.perf_counter() - t0:.0f} s)')
+        target = app_module.backup_dir_for(path)
+        rnd = random.Random(0)
+
+        t0 = time.perf_counter()
+        result = app_module.backup_database(path, target)
+        print(f'copia base:  {time.perf_counter() - t0:7.2f} s  {result}')
+        for n in range(deltas):
+            touch(db, rows, rnd, 500)
+            t0 = time.perf_counter()
+            result = app_module.backup_database(path, target)
+            elapsed = time.perf_counter() - t0
+            chain = app_module._chains(target)[-1]
+            delta = os.path.join(chain, app_module._read_manifest(chain)[-1]['file'])
+            print(f'delta {n + 1}:     {elapsed:7.2f} s  {result}  {os.path.getsize(delta) / 1024:.0f} KiB')
+        print(f'respaldos en disco: {dir_size(target) / 2**20:.0f} MiB')
+
+        out = os.path.join(os.path.dirname(path), 'restaurada.db')
+        t0 = time.perf_counter()
+        point = app_module.restore_database(target, app_module.datetime.utcnow().isoformat(), out)
+        print(f'restauración al punto {point}: {time.perf_counter() - t0:7.2f} s (incluye quick_check)')
+        live = db.execute('SELECT COUNT(*), SUM(status = "listo") FROM orders').fetchone()
+        restored = sqlite3.connect(out).execute('SELECT COUNT(*), SUM(status = "listo") FROM orders').fetchone()
+        print(f'órdenes viva {tuple(live)} restaurada {restored}')
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
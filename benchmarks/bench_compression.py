@@ -0,0 +1,42 @@
+"""Bytes transferidos y tiempo estimado de carga del formulario de nueva orden.
+
+Compara la página sin comprimir contra gzip y brotli, en primera visita
+(HTML + CSS + JS) y en visitas siguientes (los recursos con hash quedan en la
+caché del navegador). El tiempo de carga se estima para un enlace lento.
+
+    python benchmarks/bench_compression.py [kbit/s] [rtt_ms]
+"""
+import re
+import sys
+import time
+
+from _common import bench_app, new_db
+
+
+def main():
+    kbps = float(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    rtt = float(sys.argv[2]) if len(sys.argv) > 2 else 150
+    with bench_app() as (app_module, path):
+        new_db(app_module, path).close()
+        client = app_module.app.test_client()
+        client.post('/login', data={'username': 'admin', 'password': 'admin123'})
+        html = client.get('/orders/new').get_data(as_text=True)
+        assets = re.findall(r'/assets/[^"]+', html)
+
+        print(f'Enlace: {kbps:.0f} kbit/s, RTT {rtt:.0f} ms')
+        for label, encoding in (('sin comprimir', ''), ('gzip', 'gzip'), ('brotli', 'br, gzip')):
+            headers = {'Accept-Encoding': encoding}
+            t0 = time.perf_counter()
+            page = client.get('/orders/new', headers=headers)
+            server_ms = (time.perf_counter() - t0) * 1000
+            html_bytes = len(page.data)
+            asset_bytes = sum(len(client.get(url, headers=headers).data) for url in assets)
+            # HTML y luego CSS/JS en paralelo: dos viajes de ida y vuelta más la transferencia
+            first = 2 * rtt + (html_bytes + asset_bytes) * 8 / kbps
+            repeat = rtt + html_bytes * 8 / kbps
+            print(f'{label:14s} HTML {html_bytes / 1024:7.1f} KB  recursos {asset_bytes / 1024:7.1f} KB  '
+                  f'servidor {server_ms:5.1f} ms  carga 1ª visita ~{first:6.0f} ms  siguientes ~{repeat:5.0f} ms')
+
+
+if __name__ == '__main__':
+    main()
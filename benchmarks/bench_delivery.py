@@ -0,0 +1,81 @@
+"""Fechas de entrega disponibles: tabla delivery_load frente a sumar órdenes.
+
+Crea N órdenes (3 items cada una) con entregas repartidas en dos años,
+incluidos los próximos 60 días, y mide:
+  - antes: sumar piezas y órdenes por día y categoría del horizonte en cada consulta
+  - ahora: available_delivery_dates, que lee delivery_load
+  - el costo de los triggers al insertar una orden con 3 items (mediana de 500)
+
+    python benchmarks/bench_delivery.py [órdenes]
+"""
+import random
+import statistics
+import sys
+import time
+from datetime import date, timedelta
+
+from _common import bench_app, new_db
+
+NAIVE_SQL = """SELECT o.delivery_date, COALESCE(p.category, 'otros'), SUM(i.quantity), COUNT(DISTINCT o.id)
+    FROM orders o JOIN order_items i ON i.order_id = o.id LEFT JOIN price_list p ON p.garment_type = i.garment_type
+    WHERE o.delivery_date >= ? AND o.delivery_date < ? GROUP BY 1, 2"""
+
+
+def build(app_module, path, orders):
+    db = new_db(app_module, path, triggers=False)
+    garments = [r[0] for r in db.execute('SELECT garment_type FROM price_list')]
+    rnd = random.Random(0)
+    first = date.today() - timedelta(days=670)
+    with db:
+        db.executemany('INSERT INTO orders (id,order_number,status,created_at,delivery_date,total) VALUES (?,?,?,?,?,?)',
+                       ((i + 1, f'B-{i}', 'pendiente', '2024-01-01T10:00:00',
+                         (first + timedelta(days=i * 730 // orders)).isoformat(), 100.0) for i in range(orders)))
+        db.executemany('INSERT INTO order_items (order_id,garment_type,quantity,unit_price,subtotal) VALUES (?,?,?,?,?)',
+                       ((i // 3 + 1, rnd.choice(garments), rnd.randint(1, 4), 10.0, 10.0) for i in range(orders * 3)))
+        app_module.rebuild_delivery_load(db)
+    return db, garments
+
+
+def insert_order(db, n, day, garments):
+    with db:
+        cur = db.execute('INSERT INTO orders (order_number,status,created_at,delivery_date) VALUES (?,?,?,?)',
+                         (f'T-{n}', 'pendiente', '2024-01-01T10:00:00', day))
+        db.executemany('INSERT INTO order_items (order_id,garment_type,quantity,unit_price,subtotal) VALUES (?,?,?,?,?)',
+                       [(cur.lastrowid, g, 2, 10.0, 20.0) for g in garments])
+
+
+def median_ms(fn, repeat=50):
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - t0) * 1000)
+    return statistics.median(times)
+
+
+def main():
+    orders = int(sys.argv[1]) if len(sys.argv) > 1 else 500000
+    with bench_app() as (app_module, path):
+        db, garments = build(app_module, path, orders)
+        app_module.app.config['DELIVERY_MAX_ORDERS'] = 0  # sin límite de órdenes: recorre todo el horizonte
+        basket = {'*': 6, 'cama': 2, 'ropa_casual': 4}
+        start = date.today()
+        end = (start + timedelta(days=app_module.app.config['DELIVERY_HORIZON'])).isoformat()
+
+        print(f'{orders} órdenes en dos años')
+        print(f'antes: sumar órdenes del horizonte      {median_ms(lambda: db.execute(NAIVE_SQL, (start.isoformat(), end)).fetchall()):8.2f} ms')
+        print(f'ahora: available_delivery_dates          {median_ms(lambda: app_module.available_delivery_dates(db, basket, start)):8.2f} ms')
+
+        day = (start + timedelta(days=3)).isoformat()
+        sample = garments[:3]
+        counter = iter(range(10 ** 9))
+        without = median_ms(lambda: insert_order(db, next(counter), day, sample), 500)
+        for statement in app_module._delivery_load_triggers():
+            db.execute(statement)
+        with_triggers = median_ms(lambda: insert_order(db, next(counter), day, sample), 500)
+        print(f'insertar orden + 3 items: sin triggers {without:6.2f} ms  con triggers {with_triggers:6.2f} ms')
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
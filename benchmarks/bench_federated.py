@@ -0,0 +1,54 @@
+"""Escalado de los reportes federados con el número de sucursales.
+
+Crea N bases sintéticas (una por sucursal) y mide el reporte de prendas
+populares ejecutado en serie y con federated_query (en paralelo).
+
+    python benchmarks/bench_federated.py [órdenes_por_sucursal]
+
+Por defecto 20000 órdenes por sucursal (menos de un minuto); el tamaño de
+la medición original es `python benchmarks/bench_federated.py 100000`.
+"""
+import os
+import random
+import sys
+
+from _common import bench_app, new_db, timed
+SHARD_COUNTS = (1, 2, 4, 8)
+
+
+def build_shard(app_module, path, orders):
+    db = new_db(app_module, path, triggers=False)
+    garments = [r[0] for r in db.execute('SELECT garment_type FROM price_list')]
+    rnd = random.Random(path)
+    with db:
+        db.executemany('INSERT INTO orders (order_number,client_id,status,created_at,total) VALUES (?,?,?,?,?)',
+                       ((f'B-{i}', None, 'entregado', '2024-01-01T10:00:00', 0) for i in range(orders)))
+        db.executemany('INSERT INTO order_items (order_id,garment_type,quantity,unit_price,subtotal) VALUES (?,?,?,?,?)',
+                       ((i % orders + 1, rnd.choice(garments), rnd.randint(1, 5), 10, 10) for i in range(orders * 3)))
+    db.close()
+
+
+def main():
+    orders = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    with bench_app('sucursal0.db') as (app_module, first):
+        paths = [os.path.join(os.path.dirname(first), f'sucursal{i}.db') for i in range(max(SHARD_COUNTS))]
+        for path in paths:
+            build_shard(app_module, path, orders)
+        print(f'{orders} órdenes y {orders * 3} items por sucursal')
+        for count in SHARD_COUNTS:
+            app_module.app.config['BRANCHES'] = {f's{i}': p for i, p in enumerate(paths[:count])}
+
+            def serial():
+                for path in paths[:count]:
+                    db = app_module.connect_db(path)
+                    db.execute(app_module.POPULAR_SQL).fetchall()
+                    db.close()
+
+            def parallel():
+                app_module.federated_query(app_module.POPULAR_SQL)
+
+            print(f'{count} sucursales: serie {timed(serial):8.1f} ms   federado {timed(parallel):8.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""Descuento de insumos y pronóstico de agotamiento sobre un historial grande.
+
+Crea N órdenes repartidas en los últimos 56 días (3 items cada una) y mide:
+  - consume_supplies: descuento de una orden nueva (mediana de 200)
+  - backfill_supply_usage: llenar supply_usage desde el historial (migración)
+  - antes: recorrer las filas del historial en Python, sumando por insumo y día
+  - ahora: forecast_stockouts, que lee supply_usage
+
+    python benchmarks/bench_inventory.py [órdenes]
+"""
+import random
+import statistics
+import sys
+import time
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+
+from _common import bench_app, new_db, timed
+
+
+def build(app_module, path, orders):
+    db = new_db(app_module, path, triggers=False)
+    garments = [r[0] for r in db.execute('SELECT garment_type FROM price_list')]
+    rnd = random.Random(0)
+    today = datetime.utcnow().date()
+    with db:
+        db.executemany('INSERT INTO orders (id,order_number,status,created_at,total) VALUES (?,?,?,?,?)',
+                       ((i + 1, f'B-{i}', 'entregado',
+                         f'{today - timedelta(days=55 - i * 56 // orders)}T10:00:00', 100.0) for i in range(orders)))
+        db.execute('DELETE FROM supply_usage')
+        db.executemany('INSERT INTO order_items (order_id,garment_type,quantity,unit_price,subtotal) VALUES (?,?,?,?,?)',
+                       ((i // 3 + 1, rnd.choice(garments), rnd.randint(1, 5), 10.0, 10.0) for i in range(orders * 3)))
+        db.execute('UPDATE inventory SET qty = 100000')
+    return db
+
+
+def naive_forecast(db):
+    rates = defaultdict(dict)
+    for garment, inv, per_unit in db.execute('SELECT garment_type, inventory_id, per_unit FROM consumption_rates'):
+        rates[garment][inv] = per_unit
+    per_order = dict(db.execute('SELECT id, per_order FROM inventory WHERE per_order > 0').fetchall())
+    since = (date.today() - timedelta(days=55)).isoformat()
+    daily = defaultdict(float)
+    seen = set()
+    for order_id, created, garment, qty in db.execute(
+            'SELECT o.id, o.created_at, i.garment_type, i.quantity FROM orders o '
+            'JOIN order_items i ON i.order_id = o.id WHERE o.created_at >= ?', (since,)):
+        day = created[:10]
+        for inv, per_unit in rates[garment].items():
+            daily[inv, day] += per_unit * qty
+        if order_id not in seen:
+            seen.add(order_id)
+            for inv, amount in per_order.items():
+                daily[inv, day] += amount
+    return daily
+
+
+def main():
+    orders = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    with bench_app() as (app_module, path):
+        db = build(app_module, path, orders)
+
+        t0 = time.perf_counter()
+        with db:
+            app_module.backfill_supply_usage(db)
+        backfill = time.perf_counter() - t0
+        consume = []
+        for order_id in range(1, 201):
+            t0 = time.perf_counter()
+            with db:
+                app_module.consume_supplies(db, order_id, date.today().isoformat())
+            consume.append((time.perf_counter() - t0) * 1000)
+
+        print(f'{orders} órdenes en 56 días, {orders * 3} items')
+        print(f'consume_supplies (con commit)  mediana {statistics.median(consume):7.2f} ms')
+        print(f'backfill_supply_usage          {backfill * 1000:9.1f} ms')
+        print(f'historial en Python (antes)    {timed(lambda: naive_forecast(db)):9.1f} ms')
+        print(f'forecast_stockouts (ahora)     {timed(lambda: app_module.forecast_stockouts(db)):9.1f} ms')
+        for item in app_module.inventory_repo.all.iter(db):
+            f = app_module.forecast_stockouts(db)[item.id]
+            print(f'  {item.name:12s} {f["daily"]:10.2f}/día  se agota {f["date"]}')
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
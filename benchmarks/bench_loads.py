@@ -0,0 +1,96 @@
+"""Planificador de cargas de lavado con miles de prendas pendientes.
+
+Genera órdenes pendientes sintéticas (1-5 líneas, 1-6 piezas por línea,
+entregas en los próximos 7 días) y compara:
+  - a mano: primera carga donde quepa, en el orden de llegada de las órdenes
+  - sin fechas: plan_wash_loads ignorando la fecha de entrega (mínimo de cargas)
+  - planificador: plan_wash_loads (la vista /loads)
+Para cada uno: cargas, mínimo teórico, tiempo y piezas con prioridad invertida
+(lavando las cargas en el orden del plan, la pieza espera detrás de una carga
+en la que todo se entrega después que ella).
+
+    python benchmarks/bench_loads.py [órdenes]
+"""
+import random
+import sys
+import time
+from datetime import date, timedelta
+
+from _common import bench_app
+
+
+def synthetic_items(app_module, orders, rnd):
+    garments = [('camisa casual', 'ropa_casual'), ('pantalón jean', 'ropa_casual'), ('blusa', 'ropa_casual'),
+             ('camisa formal', 'ropa_formal'), ('traje completo', 'ropa_formal'), ('corbata', 'ropa_formal'),
+             ('uniforme deportivo', 'deportiva'), ('sudadera', 'deportiva'), ('calzoncillos', 'interior'),
+             ('pijama', 'interior'), ('sábana doble', 'cama'), ('cobija', 'cama'), ('edredón', 'cama'),
+             ('funda de almohada', 'cama'), ('toalla de baño', 'toallas'), ('toalla de playa', 'toallas'),
+             ('uniforme escolar', 'uniformes'), ('bata', 'uniformes')]
+    today = date.today()
+    items = []
+    for n in range(orders):
+        due = (today + timedelta(days=rnd.randint(0, 6))).isoformat()
+        for garment, category in rnd.sample(garments, rnd.randint(1, 5)):
+            items.append(app_module.PendingItemRow(f'B-{n}', due, garment, rnd.randint(1, 6), category))
+    return items
+
+
+def first_fit_arrival(app_module, items, capacity_kg):
+    capacity = round(capacity_kg * 1000)
+    loads = []
+    for item in items:
+        category = item.category
+        program = app_module.WASH_PROGRAMS.get(category, category)
+        grams = app_module._piece_grams(item.garment_type, category)
+        for _ in range(item.quantity):
+            for load in loads:
+                if load['program'] == program and load['grams'] + grams <= capacity:
+                    break
+            else:
+                load = {'program': program, 'grams': 0, 'dues': []}
+                loads.append(load)
+            load['grams'] += grams
+            load['dues'].append(item.delivery_date)
+    return [{'program': l['program'], 'weight_kg': l['grams'] / 1000, 'dues': l['dues']} for l in loads]
+
+
+def inverted_pieces(loads):
+    """Piezas cuya carga se lava después de una carga en la que todo se entrega más tarde"""
+    inverted, latest_min = 0, ''
+    for load in loads:
+        inverted += sum(1 for due in load['dues'] if due < latest_min)
+        latest_min = max(latest_min, min(load['dues']))
+    return inverted
+
+
+def dues_of(plan, items_by_order):
+    for load in plan:
+        load['dues'] = [items_by_order[number] for number, _, qty in load['items'] for _ in range(qty)]
+    return plan
+
+
+def main():
+    orders = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    with bench_app() as (app_module, _):
+        capacity = 10
+        items = synthetic_items(app_module, orders, random.Random(0))
+        due_of = {i.order_number: i.delivery_date for i in items}
+        pieces = sum(i.quantity for i in items)
+        print(f'{orders} órdenes pendientes, {len(items)} líneas, {pieces} piezas, lavadora de {capacity} kg')
+
+        def run(name, fn):
+            t0 = time.perf_counter()
+            loads = fn()
+            elapsed = (time.perf_counter() - t0) * 1000
+            bound = app_module.wash_load_lower_bound(loads, capacity)
+            print(f'{name:13s} {len(loads):5d} cargas (mínimo {bound})  {elapsed:8.1f} ms  '
+                  f'{inverted_pieces(loads):6d} piezas con prioridad invertida')
+
+        run('a mano', lambda: first_fit_arrival(app_module, items, capacity))
+        run('sin fechas', lambda: dues_of(app_module.plan_wash_loads(
+            [i._replace(delivery_date=None) for i in items], capacity), due_of))
+        run('planificador', lambda: dues_of(app_module.plan_wash_loads(items, capacity), due_of))
+
+
+if __name__ == '__main__':
+    main()
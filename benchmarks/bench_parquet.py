@@ -0,0 +1,63 @@
+"""Exportación Parquet frente a la exportación CSV de órdenes.
+
+Crea una base sintética (3 items por orden) y mide, para cada formato, el
+tiempo de exportación, el tamaño del archivo y el tiempo de carga:
+  - CSV: csv.reader de la biblioteca estándar y pyarrow.csv (con inferencia)
+  - Parquet: pyarrow.parquet.read_table
+El CSV tiene una fila por orden; el Parquet, una por item (incluye más datos).
+
+    python benchmarks/bench_parquet.py [órdenes]
+"""
+import csv
+import io
+import random
+import sys
+
+from _common import bench_app, new_db, timed_result as timed
+
+
+def build(app_module, path, orders):
+    db = new_db(app_module, path)
+    garments = [r[0] for r in db.execute('SELECT garment_type FROM price_list')]
+    rnd = random.Random(0)
+    with db:
+        db.executemany('INSERT INTO clients (name, phone, created_at) VALUES (?,?,?)',
+                       ((f'Cliente {i}', f'809{i:07d}', '2024-01-01') for i in range(1000)))
+        db.executemany('INSERT INTO orders (order_number,client_id,status,created_at,delivery_date,total,notes) '
+                       'VALUES (?,?,?,?,?,?,?)',
+                       ((f'B-{i}', rnd.randint(1, 1000), rnd.choice(('pendiente', 'listo', 'entregado')),
+                         f'2024-{i % 12 + 1:02d}-01T10:{i % 60:02d}:00', f'2024-{i % 12 + 1:02d}-03', 150.0, '')
+                        for i in range(orders)))
+        db.executemany('INSERT INTO order_items (order_id,garment_type,quantity,unit_price,subtotal) VALUES (?,?,?,?,?)',
+                       ((i // 3 + 1, rnd.choice(garments), rnd.randint(1, 5), 50.0, 50.0) for i in range(orders * 3)))
+    return db
+
+
+def main():
+    orders = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    with bench_app() as (app_module, path):
+        arrow = app_module.load_backend('pyarrow')
+        import pyarrow.csv as pacsv
+        db = build(app_module, path, orders)
+
+        def export(writer):
+            bio = io.BytesIO()
+            writer(db, bio, {})
+            return bio.getvalue()
+
+        csv_ms, csv_data = timed(lambda: export(app_module.write_orders_csv))
+        pq_ms, pq_data = timed(lambda: export(app_module.write_orders_parquet))
+        load_csv_ms, _ = timed(lambda: list(csv.reader(io.StringIO(csv_data.decode('utf-8')))))
+        load_pacsv_ms, _ = timed(lambda: pacsv.read_csv(io.BytesIO(csv_data)))
+        load_pq_ms, table = timed(lambda: arrow.pq.read_table(io.BytesIO(pq_data)))
+
+        print(f'{orders} órdenes, {orders * 3} items')
+        print(f'CSV      exportar {csv_ms:8.1f} ms  tamaño {len(csv_data) / 1024:9.0f} KiB  '
+              f'carga csv.reader {load_csv_ms:7.1f} ms  pyarrow.csv {load_pacsv_ms:7.1f} ms  (filas de orden)')
+        print(f'Parquet  exportar {pq_ms:8.1f} ms  tamaño {len(pq_data) / 1024:9.0f} KiB  '
+              f'carga read_table {load_pq_ms:7.1f} ms  ({table.num_rows} filas de item, con tipos)')
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
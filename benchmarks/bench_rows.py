@@ -0,0 +1,73 @@
+"""Costo por fila de sqlite3.Row frente a las filas de la capa de datos.
+
+Crea una base sintética y compara, para una exportación CSV de todas las
+órdenes y para el historial de un cliente con muchas órdenes:
+  - antes: SELECT * con sqlite3.Row y acceso por nombre de columna
+  - ahora: Query con columnas explícitas y namedtuples
+Reporta el mejor tiempo de 3 corridas y el pico de memoria (tracemalloc)
+al materializar el historial.
+
+    python benchmarks/bench_rows.py [órdenes]
+"""
+import csv
+import io
+import sys
+import tracemalloc
+
+from _common import bench_app, new_db, timed
+
+
+def build(app_module, path, orders):
+    db = new_db(app_module, path)
+    with db:
+        db.execute("INSERT INTO clients (name, phone, created_at) VALUES ('Cliente frecuente', '8090000000', '2024-01-01')")
+        db.executemany('INSERT INTO orders (order_number,client_id,status,created_at,delivery_date,total,notes) '
+                       'VALUES (?,?,?,?,?,?,?)',
+                       ((f'B-{i}', 1, 'entregado', f'2024-01-01T10:{i % 60:02d}:00', '2024-01-03', 150.0, 'sin notas')
+                        for i in range(orders)))
+    return db
+
+
+def peak_kib(fn):
+    tracemalloc.start()
+    result = fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    del result
+    return peak / 1024
+
+
+def main():
+    orders = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    with bench_app() as (app_module, path):
+        db = build(app_module, path, orders)
+        old_export_sql = 'SELECT o.*, c.name as client_name, c.phone FROM all_orders o LEFT JOIN clients c ON o.client_id=c.id'
+
+        def export_before():
+            w = csv.writer(io.StringIO())
+            for r in db.execute(old_export_sql):
+                w.writerow([r['order_number'], r['client_name'], r['phone'], r['status'], r['created_at'],
+                            r['delivery_date'], r['total'], r['notes']])
+
+        def export_after():
+            w = csv.writer(io.StringIO())
+            for r in app_module.Query(app_module.EXPORT_ORDERS_SQL, app_module.ExportOrderRow).iter(db):
+                w.writerow(r)
+
+        def history_before():
+            return db.execute('SELECT * FROM all_orders WHERE client_id=? ORDER BY created_at DESC', (1,)).fetchall()
+
+        def history_after():
+            return app_module.orders_repo.by_client.all(db, 1)
+
+        print(f'{orders} órdenes')
+        print(f'exportación CSV   antes {timed(export_before):8.1f} ms   ahora {timed(export_after):8.1f} ms')
+        print(f'historial cliente antes {timed(history_before):8.1f} ms   ahora {timed(history_after):8.1f} ms')
+        before, after = peak_kib(history_before), peak_kib(history_after)
+        print(f'memoria historial antes {before:8.0f} KiB  ahora {after:8.0f} KiB  '
+              f'({before * 1024 / orders:.0f} vs {after * 1024 / orders:.0f} bytes/fila)')
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
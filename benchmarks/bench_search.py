@@ -0,0 +1,88 @@
+"""Latencia de la búsqueda de órdenes (FTS5 con facetas) sobre una base grande.
+
+Crea órdenes sintéticas con 3 items cada una, construye el índice con
+rebuild_order_search y mide search_orders (página, total y facetas) para
+consultas muy selectivas, medianas y muy amplias. Reporta mediana y p95.
+
+    python benchmarks/bench_search.py [órdenes]
+"""
+import random
+import statistics
+import sys
+import time
+
+from _common import bench_app, new_db
+FIRST = ['Ana', 'Luis', 'María', 'José', 'Carmen', 'Pedro', 'Rosa', 'Juan', 'Elena', 'Miguel',
+         'Lucía', 'Carlos', 'Sofía', 'Andrés', 'Paula', 'Diego', 'Marta', 'Jorge', 'Laura', 'Rafael']
+LAST = ['Pérez', 'Gómez', 'Rodríguez', 'Fernández', 'López', 'Martínez', 'Sánchez', 'Díaz', 'Núñez', 'Reyes',
+        'Castillo', 'Ortiz', 'Vargas', 'Ramos', 'Jiménez', 'Herrera', 'Medina', 'Castro', 'Suárez', 'Rosario',
+        'Mejía', 'Peña', 'Santana', 'Guzmán', 'Cabrera', 'Polanco', 'Tavárez', 'Almonte', 'Batista', 'Abreu']
+WORDS = ['mancha', 'vino', 'botón', 'urgente', 'planchar', 'delicado', 'cuello', 'almidón', 'sin', 'doblar']
+
+
+def build(app_module, path, orders):
+    db = new_db(app_module, path, triggers=False)
+    garments = [r[0] for r in db.execute('SELECT garment_type FROM price_list')]
+    rnd = random.Random(0)
+    with db:
+        db.executemany('INSERT INTO clients (name, phone, created_at) VALUES (?,?,?)',
+                       ((f'{rnd.choice(FIRST)} {rnd.choice(LAST)} {rnd.choice(LAST)}', f'809{i:07d}', '2024-01-01')
+                        for i in range(20000)))
+    batch = 50000
+    for start in range(0, orders, batch):
+        ids = range(start, min(orders, start + batch))
+        with db:
+            db.executemany('INSERT INTO orders (id,order_number,client_id,status,created_at,delivery_date,total,notes) '
+                           'VALUES (?,?,?,?,?,?,?,?)',
+                           ((i + 1, f'B{i:08d}', rnd.randint(1, 20000), rnd.choice(('pendiente', 'listo', 'entregado')),
+                             f'20{20 + i * 6 // orders}-{i % 12 + 1:02d}-01T10:00:00', '2024-01-03', 150.0,
+                             ' '.join(rnd.sample(WORDS, 2))) for i in ids))
+            db.executemany('INSERT INTO order_items (order_id,garment_type,quantity,unit_price,subtotal) '
+                           'VALUES (?,?,?,?,?)',
+                           ((i + 1, rnd.choice(garments), 1, 50.0, 50.0) for i in ids for _ in range(3)))
+    t0 = time.perf_counter()
+    app_module.rebuild_order_search(db)
+    print(f'índice construido en {time.perf_counter() - t0:.1f} s')
+    return db
+
+
+def measure(app_module, db, queries, repeat=20, cached=False):
+    """Sin caché: primera página de una consulta nueva. Con caché: la página 2, con total y facetas ya contados"""
+    times = []
+    for _ in range(repeat):
+        for q, kw in queries:
+            if cached:
+                app_module.search_orders(db, q, **kw)
+            else:
+                app_module._search_counts_cache.clear()
+            t0 = time.perf_counter()
+            result = app_module.search_orders(db, q, page=2 if cached else 1, **kw)
+            times.append((time.perf_counter() - t0) * 1000)
+    times.sort()
+    return statistics.median(times), times[int(len(times) * 0.95) - 1], result[1]
+
+
+def main():
+    orders = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    with bench_app() as (app_module, path):
+        db = build(app_module, path, orders)
+        rnd = random.Random(1)
+        cases = {
+            'número de orden': [(f'B{rnd.randrange(orders):08d}', {}) for _ in range(10)],
+            'teléfono (prefijo)': [(f'809{rnd.randrange(20000):07d}'[:9], {}) for _ in range(10)],
+            'nombre + apellido': [(f'{rnd.choice(FIRST)} {rnd.choice(LAST)}', {}) for _ in range(10)],
+            'nombre + prenda': [(f'{rnd.choice(FIRST)} {rnd.choice(LAST)} camisa', {}) for _ in range(10)],
+            'nota + estado': [('mancha vino', {'status': 'listo'})],
+            'palabra común': [('urgente', {})],
+        }
+        print(f'{orders} órdenes')
+        for cached in (False, True):
+            print('página siguiente (total y facetas en caché)' if cached else 'primera página')
+            for name, queries in cases.items():
+                med, p95, total = measure(app_module, db, queries, cached=cached)
+                print(f'  {name:20s} mediana {med:8.2f} ms  p95 {p95:8.2f} ms  ({total} coincidencias en la última)')
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""Tiempo de arranque en frío y memoria (RSS máxima) de un worker.
+
+Lanza un intérprete nuevo por repetición e importa el punto de entrada,
+tal como lo haría gunicorn al crear un worker. Al final mide, en un proceso
+nuevo, la primera petición a /orders/new (compila la plantilla) y las
+siguientes.
+
+    python benchmarks/bench_startup.py [repeticiones]
+"""
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from _common import ROOT
+
+RSS_PROBE = '\nimport resource\nprint(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)'
+
+
+def run(code, env, repeat):
+    times, rss = [], []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        out = subprocess.run([sys.executable, '-c', code + RSS_PROBE], cwd=ROOT, env=env,
+                             check=True, capture_output=True, text=True).stdout
+        times.append((time.perf_counter() - t0) * 1000)
+        rss.append(int(out.split()[-1]) / 1024)
+    return statistics.median(times), min(times), statistics.median(rss)
+
+
+FIRST_REQUESTS = """
+import time, wsgi
+client = wsgi.app.test_client()
+client.post('/login', data={'username': 'admin', 'password': 'admin123'})
+times = []
+for _ in range(10):
+    t0 = time.perf_counter()
+    client.get('/orders/new')
+    times.append((time.perf_counter() - t0) * 1000)
+print(times[0], sorted(times[1:])[4])
+"""
+
+
+def main():
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, DB_PATH=os.path.join(tmp, 'bench.db'))
+        subprocess.run([sys.executable, '-m', 'flask', '--app', 'app', 'init-db'],
+                       cwd=ROOT, env=env, check=True, stdout=subprocess.DEVNULL)
+        cases = [
+            ('python vacío', 'pass'),
+            ('import flask (sin la aplicación)', 'import flask'),
+            ('import wsgi (check de esquema)', 'import wsgi'),
+            ('import app + init_db (arranque anterior)',
+             'import app\nwith app.app.app_context(): app.init_db()'),
+            ('import wsgi + cargar backends opcionales',
+             'import wsgi, app\nfor name in app.OPTIONAL_BACKENDS:\n'
+             '    app.backend_available(name) and app.load_backend(name)'),
+        ]
+        for label, code in cases:
+            median, best, rss = run(code, env, repeat)
+            print(f'{label:45s} mediana {median:7.1f} ms   mínimo {best:7.1f} ms   RSS {rss:6.1f} MB')
+        out = subprocess.run([sys.executable, '-c', FIRST_REQUESTS], cwd=ROOT, env=env,
+                             check=True, capture_output=True, text=True).stdout
+        first, rest = (float(x) for x in out.split())
+        print(f'/orders/new: primera petición {first:.1f} ms, siguientes (mediana) {rest:.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
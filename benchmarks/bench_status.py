@@ -0,0 +1,62 @@
+"""Ráfaga de consultas públicas de estado, con y sin caché.
+
+Simula lo que pasa después de un envío masivo de SMS: muchas consultas a
+/api/status sobre un conjunto pequeño de órdenes recientes, en una base con
+muchas órdenes. Mide consultas por segundo en el proceso y cuántas
+sentencias llegan a SQLite, con STATUS_CACHE_TTL=0 (sin caché) y con la
+caché por defecto.
+
+    python benchmarks/bench_status.py [órdenes] [consultas]
+"""
+import random
+import sys
+import time
+
+from _common import bench_app, new_db
+
+
+def build(app_module, path, orders):
+    db = new_db(app_module, path)
+    with db:
+        db.executemany('INSERT INTO clients (name, phone, created_at) VALUES (?,?,?)',
+                       ((f'Cliente {i}', f'809{i:07d}', '2024-01-01') for i in range(1000)))
+        db.executemany('INSERT INTO orders (order_number,client_id,status,created_at,delivery_date,total) '
+                       'VALUES (?,?,?,?,?,?)',
+                       ((f'B-{i}', i % 1000 + 1, 'listo', '2024-01-01T10:00:00', '2024-01-03', 100.0)
+                        for i in range(orders)))
+    db.close()
+
+
+def main():
+    orders = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    requests = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+    with bench_app() as (app_module, path):
+        build(app_module, path, orders)
+        app = app_module.create_app({'TESTING': True, 'STATUS_RATE_MAX': 10 ** 9})
+        statements = [0]
+        connect = app_module.connect_db
+
+        def counting_connect(path=None):
+            db = connect(path)
+            db.set_trace_callback(lambda sql: statements.__setitem__(0, statements[0] + 1))
+            return db
+
+        app_module.connect_db = counting_connect
+        rnd = random.Random(0)
+        recent = [orders - 1 - rnd.randrange(300) for _ in range(requests)]
+        client = app.test_client()
+        print(f'{orders} órdenes, {requests} consultas sobre 300 órdenes recientes')
+        for name, ttl in (('sin caché', 0), ('con caché', 60)):
+            app.config['STATUS_CACHE_TTL'] = ttl
+            app_module._status_cache.clear()
+            statements[0] = 0
+            t0 = time.perf_counter()
+            for i in recent:
+                r = client.get(f'/api/status?order=B-{i}&phone={(i % 1000):04d}')
+                assert r.status_code == 200, r.status_code
+            elapsed = time.perf_counter() - t0
+            print(f'{name:10s} {requests / elapsed:8.0f} consultas/s  {statements[0]:6d} sentencias SQLite')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""Historial de un cliente grande: página completa frente a página en streaming.
+
+Crea un cliente con muchas órdenes y mide, para /clients/<id>:
+  - antes: render_template_string con todas las filas en una lista
+  - ahora: stream_page sobre el cursor (la vista actual)
+el tiempo hasta el primer bloque y el tiempo total (respuesta gzip), y en
+una corrida aparte el pico de memoria (tracemalloc) del worker.
+
+    python benchmarks/bench_stream.py [órdenes]
+"""
+import sys
+import time
+import tracemalloc
+
+from _common import bench_app, new_db
+
+
+def build(app_module, path, orders):
+    db = new_db(app_module, path)
+    with db:
+        db.execute("INSERT INTO clients (name, phone, created_at) VALUES ('Cliente frecuente', '8090000000', '2024-01-01')")
+        db.executemany('INSERT INTO orders (order_number,client_id,status,created_at,delivery_date,total,notes) '
+                       'VALUES (?,?,?,?,?,?,?)',
+                       ((f'B-{i}', 1, 'entregado', f'2024-01-01T10:{i % 60:02d}:00', '2024-01-03', 150.0, '')
+                        for i in range(orders)))
+    db.close()
+
+
+def measure(client, url, trace=False):
+    if trace:
+        tracemalloc.start()
+    t0 = time.perf_counter()
+    response = client.get(url, buffered=False, headers={'Accept-Encoding': 'gzip'})
+    first, size = None, 0
+    for chunk in response.response:
+        if first is None:
+            first = time.perf_counter() - t0
+        size += len(chunk)
+    response.close()
+    total = time.perf_counter() - t0
+    if not trace:
+        return first * 1000, total * 1000, size
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak / 2**20
+
+
+def main():
+    orders = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    with bench_app() as (app_module, path):
+        build(app_module, path, orders)
+        app = app_module.create_app({'TESTING': True})
+
+        @app.route('/bench/client-before/<int:client_id>')
+        @app_module.login_required
+        def client_before(client_id):
+            db = app_module.get_db()
+            client = app_module.clients_repo.by_id.one(db, client_id)
+            rows = app_module.orders_repo.by_client.all(db, client_id)
+            return app_module.render_template_string(app_module.CLIENT_DETAIL_TEMPLATE, client=client, orders=rows)
+
+        client = app.test_client()
+        client.post('/login', data={'username': 'admin', 'password': 'admin123'})
+        print(f'{orders} órdenes de un mismo cliente')
+        for name, url in (('antes', '/bench/client-before/1'), ('ahora', '/clients/1')):
+            measure(client, url)
+            first, total, size = measure(client, url)
+            peak = measure(client, url, trace=True)
+            print(f'{name}: primer bloque {first:8.1f} ms  total {total:8.1f} ms  '
+                  f'pico de memoria {peak:7.1f} MiB  ({size / 1024:.0f} KiB enviados)')
+
+
+if __name__ == '__main__':
+    main()
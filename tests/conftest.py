@@ -0,0 +1,53 @@
+"""Fixtures compartidas: cada prueba usa una base nueva en un directorio temporal."""
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault('SCHEDULER_ENABLED', '0')
+
+import app as lavanderia  # noqa: E402
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    config = {
+        'TESTING': True,
+        'SCHEDULER_ENABLED': False,
+        'BRANCHES': {},
+        'DB_PATH': str(tmp_path / 'lavanderia.db'),
+        'ARCHIVE_DB_PATH': str(tmp_path / 'lavanderia_archivo.db'),
+        'BACKUP_DIR': str(tmp_path / 'backups'),
+        'EXPORT_DIR': str(tmp_path / 'exports'),
+        'LIMIT_DIR': str(tmp_path / 'locks'),
+        'AUDIT_ARCHIVE_DIR': str(tmp_path / 'audit_archive'),
+    }
+    for key, value in config.items():
+        monkeypatch.setitem(lavanderia.app.config, key, value)
+    # Estado en memoria del proceso que apunta a la base de la prueba anterior
+    for cache in (lavanderia._status_cache, lavanderia._status_hits, lavanderia._login_failures,
+                  lavanderia._event_buses, lavanderia._search_counts_cache):
+        cache.clear()
+    db = lavanderia.connect_db(config['DB_PATH'])
+    try:
+        lavanderia.init_db(db)
+    finally:
+        db.close()
+    yield lavanderia.app
+
+
+@pytest.fixture
+def db(app):
+    conn = lavanderia.connect_db(app.config['DB_PATH'])
+    yield conn
+    conn.close()
+
+
+@pytest.fixture
+def client(app):
+    c = app.test_client()
+    response = c.post('/login', data={'username': 'admin', 'password': 'admin123'})
+    assert response.status_code == 302
+    return c
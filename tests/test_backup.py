@@ -0,0 +1,34 @@
+import sqlite3
+from datetime import datetime
+
+import app as lavanderia
+
+
+def add_order(db, number):
+    with db:
+        db.execute("INSERT INTO orders (order_number, status, created_at, total) VALUES (?, 'pendiente', ?, 0)",
+                   (number, datetime.utcnow().isoformat()))
+
+
+def order_numbers(path):
+    conn = sqlite3.connect(path)
+    try:
+        return {r[0] for r in conn.execute('SELECT order_number FROM orders')}
+    finally:
+        conn.close()
+
+
+def test_restore_to_each_point(app, db, tmp_path):
+    src = app.config['DB_PATH']
+    target = lavanderia.backup_dir_for(src)
+    add_order(db, 'A1')
+    assert lavanderia.backup_database(src, target)['kind'] == 'base'
+    first = datetime.utcnow().isoformat()
+    add_order(db, 'A2')
+    assert lavanderia.backup_database(src, target)['kind'] == 'delta'
+
+    out = str(tmp_path / 'restaurada.db')
+    assert lavanderia.restore_database(target, first, out) <= first
+    assert order_numbers(out) == {'A1'}
+    lavanderia.restore_database(target, datetime.utcnow().isoformat(), out)
+    assert order_numbers(out) == {'A1', 'A2'}
@@ -0,0 +1,68 @@
+from datetime import date, datetime, timedelta
+
+import app as lavanderia
+
+
+def first_garment(db):
+    return db.execute('SELECT garment_type FROM price_list ORDER BY garment_type LIMIT 1').fetchone()[0]
+
+
+def order_form(garment, qty, delivery_date, key=None):
+    form = {'client_id': '', 'delivery_date': delivery_date, 'notes': '', f'qty_{garment}': str(qty)}
+    if key:
+        form['idempotency_key'] = key
+    return form
+
+
+def count_orders(db):
+    return db.execute('SELECT COUNT(*) FROM orders').fetchone()[0]
+
+
+def test_resubmitted_form_creates_one_order(client, db):
+    form = order_form(first_garment(db), 2, (date.today() + timedelta(days=2)).isoformat(), key='abc123')
+    assert client.post('/orders/new', data=form).status_code == 302
+    second = client.post('/orders/new', data=form, follow_redirects=True).get_data(as_text=True)
+    assert count_orders(db) == 1
+    number = db.execute('SELECT order_number FROM orders').fetchone()[0]
+    assert f'La orden {number} ya había sido registrada' in second
+
+
+def test_order_without_items_leaves_nothing(client, db):
+    form = order_form(first_garment(db), 0, date.today().isoformat(), key='vacia1')
+    client.post('/orders/new', data=form)
+    assert count_orders(db) == 0
+    assert db.execute('SELECT COUNT(*) FROM idempotency_keys').fetchone()[0] == 0
+
+
+def test_full_delivery_day_is_rejected(app, client, db, monkeypatch):
+    monkeypatch.setitem(app.config, 'DELIVERY_MAX_PIECES', 5)
+    monkeypatch.setitem(app.config, 'DELIVERY_CATEGORY_PIECES', {})
+    monkeypatch.setitem(app.config, 'DELIVERY_ENFORCE', True)
+    garment, day = first_garment(db), (date.today() + timedelta(days=3)).isoformat()
+    client.post('/orders/new', data=order_form(garment, 4, day))
+    page = client.post('/orders/new', data=order_form(garment, 3, day), follow_redirects=True).get_data(as_text=True)
+    assert count_orders(db) == 1
+    assert f'El {day} no tiene capacidad para esta orden' in page
+    assert db.execute("SELECT pieces FROM delivery_load WHERE day=? AND category='*'", (day,)).fetchone()[0] == 4
+
+
+def test_overdue_sweep_flags_late_orders_created_after_a_sweep(db):
+    today = datetime.utcnow().date()
+    past, future = (today - timedelta(days=3)).isoformat(), (today + timedelta(days=3)).isoformat()
+    now = datetime.utcnow().isoformat()
+
+    def add(number, status, delivery_date):
+        with db:
+            db.execute('INSERT INTO orders (order_number, status, created_at, delivery_date, total) VALUES (?,?,?,?,0)',
+                       (number, status, now, delivery_date))
+
+    add('V1', 'pendiente', past)
+    add('F1', 'pendiente', future)
+    add('L1', 'listo', past)
+    assert lavanderia.sweep_overdue_orders(db)['marked'] == 1
+    # Creada después de la primera pasada con una fecha anterior a la última marcada
+    add('V0', 'pendiente', (today - timedelta(days=30)).isoformat())
+    assert lavanderia.sweep_overdue_orders(db)['marked'] == 1
+    assert lavanderia.sweep_overdue_orders(db)['marked'] == 0
+    flagged = {r[0] for r in db.execute('SELECT order_number FROM orders WHERE overdue_at IS NOT NULL')}
+    assert flagged == {'V1', 'V0'}
@@ -0,0 +1,44 @@
+import app as lavanderia
+
+
+def add_orders(db, rows):
+    with db:
+        db.executemany('INSERT INTO orders (order_number, status, created_at, notes, total) VALUES (?,?,?,?,0)',
+                       rows)
+
+
+def test_filtered_search_counts_match_hits(db):
+    add_orders(db, [(f'P{i}', 'pendiente', '2024-01-05T10:00:00', 'mancha vino') for i in range(4)] +
+                   [(f'L{i}', 'listo', '2024-02-05T10:00:00', 'mancha vino') for i in range(3)] +
+                   [('X1', 'listo', '2024-02-06T10:00:00', 'planchar')])
+
+    hits, total, by_status, by_month = lavanderia.search_orders(db, 'mancha', status='listo')
+    assert len(hits) == total == 3
+    assert {h.status for h in hits} == {'listo'}
+    assert by_status == {'listo': 3}
+    assert by_month == {'2024-02': 3}
+
+    hits, total, by_status, by_month = lavanderia.search_orders(db, 'mancha', month='2024-01')
+    assert len(hits) == total == 4
+    assert by_status == {'pendiente': 4}
+
+    hits, total, by_status, _ = lavanderia.search_orders(db, 'mancha')
+    assert len(hits) == total == 7
+    assert by_status == {'pendiente': 4, 'listo': 3}
+
+
+def test_counts_stop_at_facet_limit(db, monkeypatch):
+    monkeypatch.setattr(lavanderia, 'SEARCH_FACET_LIMIT', 5)
+    add_orders(db, [(f'U{i}', 'pendiente', '2024-01-05T10:00:00', 'urgente') for i in range(8)])
+    hits, total, by_status, _ = lavanderia.search_orders(db, 'urgente')
+    assert len(hits) == 8
+    assert total == 5
+    assert sum(by_status.values()) == 5
+
+
+def test_search_page_shows_capped_total(client, db, monkeypatch):
+    monkeypatch.setattr(lavanderia, 'SEARCH_FACET_LIMIT', 5)
+    add_orders(db, [(f'U{i}', 'listo', '2024-01-05T10:00:00', 'urgente') for i in range(2)])
+    page = client.get('/orders/search?q=urgente').get_data(as_text=True)
+    assert '2 resultado(s)' in page
+    assert '5+' not in page
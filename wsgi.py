@@ -0,0 +1,21 @@
+"""Punto de entrada WSGI para producción con varios workers.
+
+Preparar la base una sola vez (y después de cada actualización):
+
+    flask --app app init-db
+
+Arrancar el servidor, por ejemplo con gunicorn:
+
+    gunicorn -w 4 -b 0.0.0.0:8000 wsgi:app
+
+Cada worker solo comprueba la versión del esquema al importar este módulo.
+
+El tablero en vivo (/board/stream) mantiene una conexión abierta por
+pantalla; con workers síncronos cada pantalla ocuparía un worker entero, así
+que conviene usar hilos:
+
+    gunicorn -w 4 -k gthread --threads 32 -b 0.0.0.0:8000 wsgi:app
+"""
+from app import create_app
+
+app = create_app()